@@ -1,6 +1,7 @@
 import streamlit as st
 import sqlite3
 import pandas as pd
+import numpy as np
 import requests
 from requests.auth import HTTPBasicAuth
 from datetime import datetime, timedelta, date
@@ -8,13 +9,32 @@ import json
 import os
 from cryptography.fernet import Fernet
 import base64
+import codecs
+import hashlib
+import hmac
+import re
+import threading
+import time
+import random
+import zlib
+from bisect import bisect_right, insort
+from collections import Counter, OrderedDict, deque
+from html import escape as html_escape, unescape as html_unescape
+from html.parser import HTMLParser
 # Nowy import dla Google Gemini
 from google import genai
 import openai
-from concurrent.futures import ThreadPoolExecutor, as_completed
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, as_completed, wait, FIRST_COMPLETED
+from concurrent.futures.process import BrokenProcessPool
 from urllib.parse import urlparse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from types import SimpleNamespace
+from contextlib import contextmanager
 import io
-from PIL import Image
+import mimetypes
+import multiprocessing
+from multiprocessing import shared_memory
+from cpu_tasks import html_to_text, simhash_text, simhash_shared_html, transcode_image
 
 # --- KONFIGURACJA I INICJALIZACJA ---
 
@@ -27,17 +47,24 @@ FERNET = Fernet(KEY)
 def encrypt_data(data: str) -> bytes:
     return FERNET.encrypt(data.encode())
 
-def decrypt_data(encrypted_data: bytes) -> str:
+def decrypt_data(encrypted_data: bytes, display_error=True) -> str:
     """Deszyfruje dane. W przypadku błędu zwraca None."""
     try:
         return FERNET.decrypt(encrypted_data).decode()
     except Exception as e:
-        st.error(f"⚠️ Nie można odszyfrować hasła. Możliwe przyczyny: zmieniony klucz szyfrowania lub uszkodzone dane.")
+        if display_error: st.error(f"⚠️ Nie można odszyfrować hasła. Możliwe przyczyny: zmieniony klucz szyfrowania lub uszkodzone dane.")
         return None
 
+def decrypt_cached(encrypted_data: bytes) -> str:
+    """decrypt_data z pamięcią w stanie sesji (kluczem jest szyfrogram) - przebieg skryptu nie odszyfrowuje ponownie haseł wszystkich stron."""
+    cache = st.session_state.setdefault('decrypted_passwords', {})
+    if encrypted_data not in cache: cache[encrypted_data] = decrypt_data(encrypted_data, display_error=False)
+    return cache[encrypted_data]
+
 # --- ZARZĄDZANIE BAZĄ DANYCH W PAMIĘCI ---
 
 def get_db_connection():
+    if WORKSPACE_MODE == "shared": return get_data_db_connection()
     if 'db_conn' not in st.session_state:
         st.session_state.db_conn = sqlite3.connect(":memory:", check_same_thread=False)
         init_db(st.session_state.db_conn)
@@ -52,31 +79,363 @@ def init_db(conn):
             url TEXT UNIQUE,
             username TEXT,
             app_password BLOB,
-            image_style_prompt TEXT
+            image_style_prompt TEXT,
+            version INTEGER NOT NULL DEFAULT 1
         )
     """)
-    cursor.execute("CREATE TABLE IF NOT EXISTS personas (id INTEGER PRIMARY KEY, name TEXT UNIQUE, description TEXT)")
+    cursor.execute("CREATE TABLE IF NOT EXISTS personas (id INTEGER PRIMARY KEY, name TEXT UNIQUE, description TEXT, version INTEGER NOT NULL DEFAULT 1)")
+    cursor.execute("CREATE TABLE IF NOT EXISTS workspace_revisions (entity TEXT PRIMARY KEY, revision INTEGER, changed_by TEXT, changed_at TEXT)")
+    cursor.execute("CREATE TABLE IF NOT EXISTS workspace_claims (resource TEXT PRIMARY KEY, operator TEXT, claimed_at TEXT)")
     conn.commit()
 
 def db_execute(conn, query, params=(), fetch=None):
     cursor = conn.cursor()
     cursor.execute(query, params)
-    if fetch == "one": result = cursor.fetchone()
-    elif fetch == "all": result = cursor.fetchall()
-    else: result = None
+    if fetch == "one": return cursor.fetchone()
+    if fetch == "all": return cursor.fetchall()
+    conn.commit()
+
+# --- TRWAŁA BAZA DANYCH (PLIK SQLITE) ---
+# Indeksy i dane, które mają przetrwać restart aplikacji i być wspólne dla wszystkich sesji.
+
+DATA_DB_PATH = st.secrets.get("DATA_DB_PATH", "pbn_data.db")
+
+class ThreadLocalConnection:
+    """
+    Połączenie z plikiem bazy osobne dla każdego wątku (skrypty sesji, wątki w tle) pod jednym obiektem.
+    Transakcja jednego wątku nie może więc zostać zatwierdzona ani wycofana przez zapytanie z innego; WAL pozwala czytać równolegle.
+    """
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+
+    def connection(self):
+        if not hasattr(self._local, "conn"): self._local.conn = sqlite3.connect(self.path, timeout=30)
+        return self._local.conn
+
+    def __getattr__(self, name):
+        return getattr(self.connection(), name)
+
+    def __enter__(self):
+        return self.connection().__enter__()
+
+    def __exit__(self, *exc_info):
+        return self.connection().__exit__(*exc_info)
+
+@st.cache_resource
+def get_data_db_connection():
+    conn = ThreadLocalConnection(DATA_DB_PATH)
+    conn.execute("PRAGMA journal_mode=WAL")
+    init_db(conn)
+    init_data_db(conn)
+    return conn
+
+@st.cache_resource
+def get_data_db_lock():
+    """Blokada dla transakcji zapisu - jeden pisarz naraz we wszystkich sesjach i wątkach."""
+    return threading.Lock()
+
+def init_data_db(conn):
+    cursor = conn.cursor()
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS content_fingerprints (
+            site_url TEXT,
+            post_id INTEGER,
+            title TEXT,
+            link TEXT,
+            simhash INTEGER,
+            band0 INTEGER, band1 INTEGER, band2 INTEGER, band3 INTEGER,
+            modified TEXT,
+            PRIMARY KEY (site_url, post_id)
+        )
+    """)
+    for band in range(4):
+        cursor.execute(f"CREATE INDEX IF NOT EXISTS idx_fingerprints_band{band} ON content_fingerprints (band{band})")
+    cursor.execute("CREATE TABLE IF NOT EXISTS sync_state (site_url TEXT, kind TEXT, synced_until TEXT, PRIMARY KEY (site_url, kind))")
+    cursor.execute("CREATE TABLE IF NOT EXISTS site_stats (site_url TEXT PRIMARY KEY, total_posts TEXT, last_post_date TEXT, fetched_at TEXT)")
+    cursor.execute("CREATE TABLE IF NOT EXISTS site_health (site_url TEXT PRIMARY KEY, status TEXT, http_status INTEGER, latency_ms INTEGER, error TEXT, consecutive_failures INTEGER, checked_at TEXT)")
+    cursor.execute("CREATE TABLE IF NOT EXISTS post_daily_counts (site_url TEXT, day TEXT, count INTEGER, PRIMARY KEY (site_url, day))")
+    # post_index: status 'publish' = wpis wliczony do post_daily_counts; NULL = znany tylko z listy tytułów (jeszcze nie liczony)
+    cursor.execute("CREATE TABLE IF NOT EXISTS post_index (site_url TEXT, post_id INTEGER, status TEXT, date TEXT, modified TEXT, title TEXT, PRIMARY KEY (site_url, post_id))")
+    if "title" not in {row[1] for row in cursor.execute("PRAGMA table_info(post_index)")}: cursor.execute("ALTER TABLE post_index ADD COLUMN title TEXT")
+    cursor.execute("CREATE TABLE IF NOT EXISTS schedule_reservations (site_url TEXT, publish_at TEXT, title TEXT, operator TEXT, reserved_at TEXT)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_schedule_reservations_site ON schedule_reservations (site_url, publish_at)")
+    cursor.execute("CREATE TABLE IF NOT EXISTS generation_checkpoints (kind TEXT, run_id TEXT, item_key TEXT, payload TEXT, saved_at TEXT, PRIMARY KEY (kind, run_id, item_key))")
     conn.commit()
-    return result
+
+# --- WSPÓLNA PRZESTRZEŃ ROBOCZA (WIELU OPERATORÓW) ---
+# WORKSPACE_MODE = "shared": strony i persony w trwałej bazie, wspólne dla wszystkich sesji; "session": osobna baza w pamięci każdej sesji.
+
+WORKSPACE_MODE = st.secrets.get("WORKSPACE_MODE", "shared")
+WORKSPACE_POLL_SECONDS = 20
+WORKSPACE_ENTITY_LABELS = {"sites": "Strony", "personas": "Persony", "batch_jobs": "Zadania wsadowe", "schedule": "Harmonogram"}
+BATCH_CLAIM_TTL = 600
+SCHEDULE_RESERVATION_TTL = 3600
+
+class StaleWriteError(Exception):
+    """Wiersz zmienił inny operator od chwili odczytu - zapis wycofany."""
+
+class Workspace:
+    """
+    Zapisy konfiguracji z optymistyczną blokadą: wiersz ma kolumnę version, a UPDATE/DELETE trafia tylko w wersję,
+    którą operator widział - zmiana wprowadzona w międzyczasie przez kogoś innego odrzuca zapis zamiast go nadpisać.
+    Każda transakcja podbija licznik encji w workspace_revisions (kto i kiedy) - to wystarcza do tanich powiadomień o zmianach.
+    """
+    def __init__(self, conn, lock):
+        self.conn = conn
+        self.lock = lock
+
+    @contextmanager
+    def transaction(self, operator, *entities):
+        with self.lock, self.conn:
+            yield self.conn
+            now = datetime.now().isoformat(timespec="seconds")
+            for entity in entities:
+                self.conn.execute("INSERT INTO workspace_revisions VALUES (?, 1, ?, ?) ON CONFLICT (entity) DO UPDATE SET revision = revision + 1, changed_by = excluded.changed_by, changed_at = excluded.changed_at", (entity, operator, now))
+
+    def revisions(self, entities=None):
+        rows = self.conn.execute("SELECT entity, revision, changed_by, changed_at FROM workspace_revisions").fetchall()
+        return {entity: {"revision": revision, "changed_by": by, "changed_at": at} for entity, revision, by, at in rows if entities is None or entity in entities}
+
+    def insert(self, table, operator, **fields):
+        """False, gdy wiersz narusza unikalność (np. URL strony już istnieje)."""
+        try:
+            with self.transaction(operator, table) as conn:
+                conn.execute(f"INSERT INTO {table} ({', '.join(fields)}) VALUES ({', '.join('?' * len(fields))})", list(fields.values()))
+            return True
+        except sqlite3.IntegrityError:
+            return False
+
+    def update(self, table, row_id, version, operator, **fields):
+        """False, gdy wiersz zmieniono lub usunięto od odczytu wersji `version`."""
+        try:
+            with self.transaction(operator, table) as conn:
+                assignments = ", ".join(f"{name} = ?" for name in fields)
+                if not conn.execute(f"UPDATE {table} SET {assignments}, version = version + 1 WHERE id = ? AND version = ?", [*fields.values(), row_id, version]).rowcount:
+                    raise StaleWriteError(table)
+            return True
+        except StaleWriteError:
+            return False
+
+    def delete(self, table, row_id, version, operator):
+        try:
+            with self.transaction(operator, table) as conn:
+                if not conn.execute(f"DELETE FROM {table} WHERE id = ? AND version = ?", (row_id, version)).rowcount:
+                    raise StaleWriteError(table)
+            return True
+        except StaleWriteError:
+            return False
+
+    def claim(self, resource, operator, ttl=BATCH_CLAIM_TTL):
+        """Krótkotrwała wyłączność na zasób (np. pobieranie wyników zadania wsadowego) - True, jeśli przyznana temu operatorowi."""
+        now = datetime.now()
+        with self.lock, self.conn:
+            row = self.conn.execute("SELECT operator, claimed_at FROM workspace_claims WHERE resource = ?", (resource,)).fetchone()
+            if row and row[0] != operator and row[1] >= (now - timedelta(seconds=ttl)).isoformat(): return False
+            self.conn.execute("INSERT OR REPLACE INTO workspace_claims VALUES (?, ?, ?)", (resource, operator, now.isoformat(timespec="seconds")))
+        return True
+
+    def renew(self, resource, operator):
+        """Przedłuża claim tego operatora; False, gdy wygasł i przejął go ktoś inny."""
+        with self.lock, self.conn:
+            return bool(self.conn.execute("UPDATE workspace_claims SET claimed_at = ? WHERE resource = ? AND operator = ?", (datetime.now().isoformat(timespec="seconds"), resource, operator)).rowcount)
+
+    @contextmanager
+    def lease(self, resource, operator, ttl=BATCH_CLAIM_TTL):
+        """
+        claim() na czas całego bloku: wątek w tle odnawia go co ttl/3, więc długie operacje (pobieranie wyników z generowaniem
+        obrazków) nie tracą wyłączności po ttl; na końcu claim jest zwalniany. Zwraca False, gdy zasób trzyma ktoś inny.
+        """
+        if not self.claim(resource, operator, ttl):
+            yield False
+            return
+        stop = threading.Event()
+        def keep_alive():
+            while not stop.wait(ttl / 3): self.renew(resource, operator)
+        renewer = threading.Thread(target=keep_alive, daemon=True, name=f"lease:{resource}")
+        renewer.start()
+        try:
+            yield True
+        finally:
+            stop.set()
+            renewer.join()
+            self.release(resource, operator)
+
+    def claimed_by(self, resource):
+        row = self.conn.execute("SELECT operator FROM workspace_claims WHERE resource = ?", (resource,)).fetchone()
+        return row[0] if row else None
+
+    def release(self, resource, operator):
+        with self.lock, self.conn:
+            self.conn.execute("DELETE FROM workspace_claims WHERE resource = ? AND operator = ?", (resource, operator))
+
+@st.cache_resource
+def get_shared_workspace():
+    """Przestrzeń na trwałej bazie - wspólna dla wszystkich sesji (zadania wsadowe, harmonogram, a w trybie shared także konfiguracja)."""
+    return Workspace(get_data_db_connection(), get_data_db_lock())
+
+def get_workspace():
+    """Przestrzeń dla stron i person wg WORKSPACE_MODE."""
+    if WORKSPACE_MODE == "shared": return get_shared_workspace()
+    if 'workspace' not in st.session_state: st.session_state.workspace = Workspace(get_db_connection(), threading.Lock())
+    return st.session_state.workspace
+
+class ScheduleReservations:
+    """
+    Rezerwacje slotów publikacji per strona, widoczne dla wszystkich operatorów, zanim wpisy pojawią się w WordPressie.
+    Plan powstaje na migawce (rezerwacje + numer rewizji harmonogramu każdej strony); reserve() zapisuje go tylko wtedy,
+    gdy żadna z tych stron nie dostała w międzyczasie nowych rezerwacji - inaczej plan trzeba policzyć od nowa.
+    """
+    def __init__(self, workspace):
+        self.workspace = workspace
+
+    @staticmethod
+    def entity(site_url):
+        return f"schedule:{site_url}"
+
+    def snapshot(self, site_urls):
+        threshold = (datetime.now() - timedelta(seconds=SCHEDULE_RESERVATION_TTL)).isoformat()
+        placeholders = ",".join("?" * len(site_urls))
+        rows = self.workspace.conn.execute(f"SELECT site_url, publish_at FROM schedule_reservations WHERE reserved_at >= ? AND site_url IN ({placeholders})", [threshold, *site_urls]).fetchall() if site_urls else []
+        reserved = {url: [] for url in site_urls}
+        for url, publish_at in rows: reserved[url].append(datetime.fromisoformat(publish_at))
+        revisions = self.workspace.revisions([self.entity(url) for url in site_urls])
+        return reserved, {url: revisions.get(self.entity(url), {}).get("revision", 0) for url in site_urls}
+
+    def reserve(self, entries, expected_revisions, operator):
+        """entries: lista (site_url, publish_at, tytuł). Zwraca listę stron z konfliktem (pusta = zarezerwowano wszystko)."""
+        try:
+            with self.workspace.transaction(operator, *[self.entity(url) for url in dict.fromkeys(url for url, _, _ in entries)]) as conn:
+                current = self.workspace.revisions([self.entity(url) for url in expected_revisions])
+                conflicts = [url for url, revision in expected_revisions.items() if current.get(self.entity(url), {}).get("revision", 0) != revision]
+                if conflicts: raise StaleWriteError(", ".join(conflicts))
+                now = datetime.now().isoformat(timespec="seconds")
+                conn.executemany("INSERT INTO schedule_reservations VALUES (?, ?, ?, ?, ?)", [(url, publish_at.isoformat(), title, operator, now) for url, publish_at, title in entries])
+            return []
+        except StaleWriteError:
+            return conflicts
+
+    def release(self, entries):
+        """Po publikacji sloty są już widoczne w WordPressie - rezerwacje można usunąć."""
+        with self.workspace.lock, self.workspace.conn:
+            self.workspace.conn.executemany("DELETE FROM schedule_reservations WHERE site_url = ? AND publish_at = ?", [(url, publish_at.isoformat()) for url, publish_at, _ in entries])
+
+# --- BEZPIECZNIK (CIRCUIT BREAKER) I ADAPTACYJNE TIMEOUTY PER HOST ---
+
+class CircuitOpenError(requests.exceptions.ConnectionError):
+    """Obwód hosta jest otwarty - żądanie odrzucone od razu, bez czekania na timeout."""
+
+class HostCircuitBreaker:
+    """
+    Stan jednego hosta: closed → open po failure_threshold kolejnych błędach (timeout, błąd połączenia, 5xx).
+    Po cooldown obwód przechodzi w half-open i przepuszcza jedno żądanie próbne - sukces zamyka obwód,
+    błąd otwiera go ponownie z podwojonym cooldown. Timeout odczytów wynika z p95 ostatnich czasów odpowiedzi osobno
+    dla każdej klasy żądań (np. lekkie liczniki vs listy wpisów z treścią) - szybkie próby nie skracają timeoutu ciężkich odczytów.
+    """
+    def __init__(self, failure_threshold=3, cooldown=30, max_cooldown=600, min_timeout=3, window=50):
+        self.failure_threshold = failure_threshold
+        self.base_cooldown = cooldown
+        self.max_cooldown = max_cooldown
+        self.min_timeout = min_timeout
+        self.state = "closed"
+        self.failures = 0
+        self.cooldown = cooldown
+        self.opened_at = 0.0
+        self._probe_in_flight = False
+        self.window = window
+        self._latencies = {}
+        self._lock = threading.Lock()
+
+    def before_request(self, host):
+        with self._lock:
+            if self.state == "closed": return
+            remaining = self.opened_at + self.cooldown - time.monotonic()
+            if remaining <= 0 and not self._probe_in_flight:
+                self.state = "half-open"
+                self._probe_in_flight = True
+                return
+            raise CircuitOpenError(f"Host {host} chwilowo wyłączony po {self.failures} kolejnych błędach (ponowna próba za {max(0, round(remaining))}s)")
+
+    def record_success(self, latency=None, latency_class=None):
+        """Czas odpowiedzi trafia do okna klasy tylko dla żądań z adaptacyjnym timeoutem (latency_class)."""
+        with self._lock:
+            if latency_class is not None: self._latencies.setdefault(latency_class, deque(maxlen=self.window)).append(latency)
+            self.state, self.failures, self.cooldown, self._probe_in_flight = "closed", 0, self.base_cooldown, False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.state == "half-open":
+                self.cooldown = min(self.cooldown * 2, self.max_cooldown)
+            if self.state == "half-open" or self.failures >= self.failure_threshold:
+                self.state, self.opened_at = "open", time.monotonic()
+            self._probe_in_flight = False
+
+    def timeout(self, default, latency_class):
+        """p95 czasu odpowiedzi klasy × 4, w granicach [min_timeout, default]; bez próbek - default."""
+        with self._lock:
+            latencies = self._latencies.get(latency_class, ())
+            if len(latencies) < 5: return default
+            p95 = float(np.percentile(latencies, 95))
+        return min(default, max(self.min_timeout, p95 * 4))
+
+    def snapshot(self):
+        with self._lock:
+            return {"state": self.state, "failures": self.failures, "samples": sum(len(latencies) for latencies in self._latencies.values())}
+
+class CircuitBreakerRegistry:
+    """Bezpieczniki współdzielone przez wszystkie sesje i wątki, kluczowane hostem (netloc)."""
+    def __init__(self, **breaker_kwargs):
+        self._breakers = {}
+        self._breaker_kwargs = breaker_kwargs
+        self._lock = threading.Lock()
+
+    def get(self, host):
+        with self._lock:
+            if host not in self._breakers: self._breakers[host] = HostCircuitBreaker(**self._breaker_kwargs)
+            return self._breakers[host]
+
+@st.cache_resource
+def get_circuit_breakers():
+    return CircuitBreakerRegistry()
 
 # --- KLASA DO OBSŁUGI WORDPRESS REST API ---
 class WordPressAPI:
     def __init__(self, url, username, password):
         self.base_url = url.rstrip('/') + "/wp-json/wp/v2"
         self.auth = HTTPBasicAuth(username, password)
+        self.host = urlparse(self.base_url).netloc
+        self.breaker = get_circuit_breakers().get(self.host)
+
+    def _request(self, method, endpoint, timeout, adaptive=False, bypass_open=False, **kwargs):
+        """
+        Wspólna ścieżka wszystkich wywołań HTTP: sprawdza bezpiecznik hosta (otwarty → CircuitOpenError od razu),
+        dla odczytów (adaptive) skraca timeout do p95 hosta i raportuje wynik do bezpiecznika.
+        4xx to błąd żądania, nie hosta - nie otwiera obwodu.
+        """
+        if not bypass_open: self.breaker.before_request(self.host)
+        latency_class = self._latency_class(endpoint, kwargs.get("params")) if adaptive else None
+        if adaptive: timeout = self.breaker.timeout(timeout, latency_class)
+        start = time.perf_counter()
+        try:
+            response = requests.request(method, f"{self.base_url}/{endpoint}", auth=self.auth, timeout=timeout, **kwargs)
+        except requests.exceptions.RequestException:
+            self.breaker.record_failure()
+            raise
+        if response.status_code >= 500: self.breaker.record_failure()
+        else: self.breaker.record_success(time.perf_counter() - start, latency_class)
+        response.raise_for_status()
+        return response
+
+    @staticmethod
+    def _latency_class(endpoint, params):
+        """Ścieżka + czy odpowiedź niesie pełne obiekty / treść wpisów (bez _fields lub z content) - te są wielokrotnie wolniejsze."""
+        fields = (params or {}).get("_fields")
+        return endpoint.split("/")[0], fields is None or "content" in fields
 
     def _make_request(self, endpoint, params=None, display_error=True):
         try:
-            response = requests.get(f"{self.base_url}/{endpoint}", params=params, auth=self.auth, timeout=15)
-            response.raise_for_status()
+            response = self._request("GET", endpoint, 15, adaptive=True, params=params)
             return response.json(), response.headers
         except requests.exceptions.HTTPError as e:
             if display_error and e.response.status_code != 400:
@@ -87,8 +446,7 @@ class WordPressAPI:
 
     def test_connection(self):
         try:
-            response = requests.get(f"{self.base_url}/users/me", auth=self.auth, timeout=10)
-            response.raise_for_status()
+            self._request("GET", "users/me", 10, bypass_open=True)
             return True, "Połączenie udane!"
         except requests.exceptions.HTTPError as e:
             error_details = ""
@@ -113,66 +471,119 @@ Możliwe przyczyny:
         except requests.exceptions.RequestException as e: 
             return False, f"Błąd połączenia: {e}"
 
-    def get_stats(self):
+    def probe(self, timeout=5):
+        """Szybki test stanu strony (users/me): czas odpowiedzi, status autoryzacji i klasa błędu."""
+        start = time.perf_counter()
+        result = {"status": "ok", "http_status": None, "error": None}
         try:
-            data, headers = self._make_request("posts", params={"per_page": 1})
+            result["http_status"] = self._request("GET", "users/me", timeout, bypass_open=True, params={"_fields": "id"}).status_code
+        except requests.exceptions.HTTPError as e:
+            result["http_status"] = e.response.status_code
+            if e.response.status_code in (401, 403): result.update(status="auth", error=f"Błąd autoryzacji ({e.response.status_code})")
+            else: result.update(status="http", error=f"Błąd HTTP ({e.response.status_code})")
+        except requests.exceptions.Timeout: result.update(status="timeout", error=f"Brak odpowiedzi w {timeout}s")
+        except requests.exceptions.SSLError as e: result.update(status="ssl", error=f"Błąd SSL ({type(e).__name__})")
+        except requests.exceptions.RequestException as e: result.update(status="connection", error=f"Błąd połączenia ({type(e).__name__})")
+        result["latency_ms"] = round((time.perf_counter() - start) * 1000)
+        return result
+
+    def get_stats(self, display_error=True):
+        try:
+            data, headers = self._make_request("posts", params={"per_page": 1, "_fields": "date"}, display_error=display_error)
+            if data is None: return {"total_posts": "Błąd", "last_post_date": "Błąd"}
             total_posts = int(headers.get('X-WP-Total', 0))
             last_post_date = "Brak" if not data else datetime.fromisoformat(data[0]['date']).strftime('%Y-%m-%d %H:%M')
             return {"total_posts": total_posts, "last_post_date": last_post_date}
         except Exception: return {"total_posts": "Błąd", "last_post_date": "Błąd"}
 
-    def get_all_posts_since(self, start_date):
-        all_posts = []
-        page = 1
-        while True:
-            params = {"per_page": 100, "page": page, "after": start_date.isoformat(), "orderby": "date", "order": "asc"}
-            posts_data, _ = self._make_request("posts", params=params, display_error=False)
-            if not posts_data: break
-            all_posts.extend(posts_data)
-            page += 1
-        return all_posts
+    def get_all_posts_since(self, start_date, fields="id,date"):
+        return self.get_all_pages("posts", {"after": start_date.isoformat(), "orderby": "date", "order": "asc", "_fields": fields})
+
+    def _get_page(self, endpoint, params):
+        response = self._request("GET", endpoint, 15, adaptive=True, params=params)
+        return response.json(), response.headers
+
+    def get_all_pages(self, endpoint, params, max_workers=8):
+        """
+        Pobiera wszystkie strony wyników: pierwsza strona ustala liczbę stron (X-WP-TotalPages), pozostałe pobierane równolegle.
+        Nie pokazuje błędów (bywa wołana z wątków roboczych) - błąd dowolnej strony przerywa pobieranie wyjątkiem requests,
+        więc niepełna lista nie przesunie znaczników synchronizacji; wywołujący raportuje go w swoich wynikach.
+        """
+        params = {"per_page": 100, **params}
+        first_page, headers = self._get_page(endpoint, {**params, "page": 1})
+        if not first_page: return []
+        total_pages = int(headers.get('X-WP-TotalPages', 1))
+        pages = {1: first_page}
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = {executor.submit(self._get_page, endpoint, {**params, "page": page}): page for page in range(2, total_pages + 1)}
+            for future in as_completed(futures):
+                pages[futures[future]] = future.result()[0]
+        return [item for page in sorted(pages) for item in pages[page]]
+
+    def get_all_post_titles(self, max_workers=8):
+        """Wszystkie opublikowane wpisy jako {id, date, title.rendered} - do analizy tematów i indeksu tytułów sieci."""
+        return self.get_all_pages("posts", {"_fields": "id,date,title.rendered"}, max_workers)
+
+    def get_posts_for_sync(self, modified_after=None, max_workers=8):
+        """Treść wszystkich wpisów (opublikowanych i zaplanowanych) do budowy indeksów; przy modified_after tylko zmienione od tej daty."""
+        params = {"_fields": "id,title.rendered,content.rendered,date,modified,link", "status": "publish,future", "orderby": "modified", "order": "asc"}
+        if modified_after: params["modified_after"] = modified_after
+        return self.get_all_pages("posts", params, max_workers)
+
+    def get_scheduled_post_dates(self):
+        """Daty wszystkich zaplanowanych (status future) wpisów - jedno stronicowane pobranie."""
+        return [datetime.fromisoformat(p['date']) for p in self.get_all_pages("posts", {"status": "future", "_fields": "id,date"})]
+
+    def get_terms(self, taxonomy):
+        """Pełna mapa nazwa → ID dla "categories" lub "tags" - wszystkie strony wyników, nie tylko pierwsze 100."""
+        return {html_unescape(term['name']): term['id'] for term in self.get_all_pages(taxonomy, {"_fields": "id,name"})}
 
     def get_categories(self):
-        data, _ = self._make_request("categories", params={"per_page": 100})
-        return {cat['name']: cat['id'] for cat in data} if data else {}
+        return self.get_terms("categories")
+
+    def create_term(self, taxonomy, name):
+        """Tworzy kategorię/tag; gdy termin już istnieje (term_exists), zwraca jego ID. Wynik: (ID lub None, komunikat błędu)."""
+        try:
+            return self._request("POST", taxonomy, 15, json={"name": name}).json()['id'], None
+        except requests.exceptions.HTTPError as e:
+            try: error = e.response.json()
+            except ValueError: error = {}
+            if error.get('code') == 'term_exists': return error.get('data', {}).get('term_id'), None
+            return None, f"Błąd HTTP ({e.response.status_code}): {error.get('message', e.response.text[:200])}"
+        except requests.exceptions.RequestException as e:
+            return None, f"Błąd połączenia: {e}"
 
     def get_users(self):
         data, _ = self._make_request("users", params={"per_page": 100, "roles": "administrator,editor,author"}, display_error=False)
         return {user['name']: user['id'] for user in data} if data else {}
 
-    def get_posts(self, per_page=50):
-        posts_data, _ = self._make_request("posts", params={"per_page": per_page, "orderby": "date", "_embed": True})
-        if not posts_data: return []
-        is_embedded = '_embedded' in posts_data[0]
-        if is_embedded:
-            final_posts = []
-            for item in posts_data:
-                author_name = item['_embedded']['author'][0].get('name', 'N/A')
-                author_id = item['_embedded']['author'][0].get('id', 0)
-                categories = [t.get('name', '') for tl in item['_embedded'].get('wp:term', []) for t in tl if t.get('taxonomy') == 'category']
-                final_posts.append({"id": item['id'], "title": item['title']['rendered'], "date": datetime.fromisoformat(item['date']).strftime('%Y-%m-%d %H:%M'), "author_name": author_name, "author_id": author_id, "categories": ", ".join(filter(None, categories))})
-            return final_posts
-        else:
-            st.warning("Serwer nie zwrócił osadzonych danych. Dociąganie informacji...")
-            author_ids = {p['author'] for p in posts_data}
-            author_map = {}
-            for author_id in author_ids:
-                user_data, _ = self._make_request(f"users/{author_id}", display_error=False)
-                if user_data:
-                    author_map[author_id] = user_data.get('name', 'N/A')
-            category_ids = {cid for p in posts_data for cid in p['categories']}
-            cat_data, _ = self._make_request("categories", params={"include": ",".join(map(str, category_ids))})
-            category_map = {cat['id']: cat['name'] for cat in cat_data or []}
-            final_posts = []
-            for p in posts_data:
-                final_posts.append({"id": p['id'], "title": p['title']['rendered'], "date": datetime.fromisoformat(p['date']).strftime('%Y-%m-%d %H:%M'), "author_name": author_map.get(p['author'], 'N/A'), "author_id": p['author'], "categories": ", ".join(filter(None, [category_map.get(cid, '') for cid in p['categories']]))})
-            return final_posts
+    def get_posts_page(self, page=1, per_page=50, search=None, category_id=None, author_id=None, after=None, before=None, display_error=True):
+        """
+        Jedna strona wpisów z filtrowaniem po stronie serwera. Zamiast _embed autorzy i kategorie ze strony
+        są rozwiązywane dwoma zbiorczymi zapytaniami include=. Zwraca (wpisy, liczba wszystkich, liczba stron) lub None przy błędzie.
+        """
+        params = {"page": page, "per_page": per_page, "orderby": "date", "order": "desc", "_fields": "id,title.rendered,date,author,categories"}
+        if search: params["search"] = search
+        if category_id: params["categories"] = category_id
+        if author_id: params["author"] = author_id
+        if after: params["after"] = after.isoformat()
+        if before: params["before"] = before.isoformat()
+        posts_data, headers = self._make_request("posts", params=params, display_error=display_error)
+        if posts_data is None: return None
+        author_ids = sorted({p['author'] for p in posts_data})
+        category_ids = sorted({cid for p in posts_data for cid in p['categories']})
+        lookups = {endpoint: {"include": ",".join(map(str, ids)), "per_page": 100, "_fields": "id,name"} for endpoint, ids in (("users", author_ids), ("categories", category_ids)) if ids}
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            futures = {endpoint: executor.submit(self._make_request, endpoint, params, False) for endpoint, params in lookups.items()}
+            names = {endpoint: {item['id']: item['name'] for item in future.result()[0] or []} for endpoint, future in futures.items()}
+        author_map, category_map = names.get("users", {}), names.get("categories", {})
+        posts = [{"id": p['id'], "title": html_unescape(p['title']['rendered']), "date": datetime.fromisoformat(p['date']).strftime('%Y-%m-%d %H:%M'), "author_name": author_map.get(p['author'], 'N/A'), "author_id": p['author'], "categories": ", ".join(filter(None, [category_map.get(cid, '') for cid in p['categories']]))} for p in posts_data]
+        return posts, int(headers.get('X-WP-Total', len(posts))), int(headers.get('X-WP-TotalPages', 1))
 
     def upload_image_from_bytes(self, image_bytes, filename):
         try:
-            files = {'file': (filename, image_bytes, 'image/png')}
-            upload_response = requests.post(f"{self.base_url}/media", files=files, auth=self.auth, timeout=30)
-            upload_response.raise_for_status()
+            files = {'file': (filename, image_bytes, mimetypes.guess_type(filename)[0] or 'image/png')}
+            upload_response = self._request("POST", "media", 30, files=files)
             return upload_response.json().get('id')
         except requests.exceptions.HTTPError as e:
             st.warning(f"Nie udało się wgrać obrazka '{filename}'. Błąd HTTP ({e.response.status_code}): {e.response.text}")
@@ -183,26 +594,85 @@ Możliwe przyczyny:
 
     def update_post(self, post_id, data):
         try:
-            response = requests.post(f"{self.base_url}/posts/{post_id}", json=data, auth=self.auth, timeout=15)
-            response.raise_for_status()
+            self._request("POST", f"posts/{post_id}", 15, json=data)
             return True, f"Wpis ID {post_id} zaktualizowany."
         except requests.exceptions.HTTPError as e: return False, f"Błąd aktualizacji wpisu ID {post_id} ({e.response.status_code}): {e.response.text}"
         except requests.exceptions.RequestException as e: return False, f"Błąd sieci przy aktualizacji wpisu ID {post_id}: {e}"
 
-    def publish_post(self, title, content, status, publish_date, category_ids, tags, author_id=None, featured_image_bytes=None, meta_title=None, meta_description=None):
-        post_data = {'title': title, 'content': content, 'status': status, 'date': publish_date, 'categories': category_ids, 'tags': tags}
+    def publish_post(self, title, content, status, publish_date, category_ids, tag_ids, author_id=None, featured_image_bytes=None, meta_title=None, meta_description=None, featured_image_ext="png"):
+        post_data = {'title': title, 'content': content, 'status': status, 'date': publish_date, 'categories': category_ids, 'tags': tag_ids}
         if author_id: post_data['author'] = int(author_id)
         if featured_image_bytes:
-            media_id = self.upload_image_from_bytes(featured_image_bytes, f"featured-image-{datetime.now().timestamp()}.png")
+            media_id = self.upload_image_from_bytes(featured_image_bytes, f"featured-image-{datetime.now().timestamp()}.{featured_image_ext}")
             if media_id: post_data['featured_media'] = media_id
         if meta_title or meta_description:
             post_data['meta'] = { "rank_math_title": meta_title, "rank_math_description": meta_description, "_aioseo_title": meta_title, "_aioseo_description": meta_description, "_yoast_wpseo_title": meta_title, "_yoast_wpseo_metadesc": meta_description }
         try:
-            response = requests.post(f"{self.base_url}/posts", json=post_data, auth=self.auth, timeout=20)
-            response.raise_for_status()
-            return True, f"Wpis opublikowany/zaplanowany! ID: {response.json()['id']}", response.json().get('link')
-        except requests.exceptions.HTTPError as e: return False, f"Błąd publikacji ({e.response.status_code}): {e.response.text}", None
-        except requests.exceptions.RequestException as e: return False, f"Błąd sieci podczas publikacji: {e}", None
+            response = self._request("POST", "posts", 20, json=post_data)
+            return True, f"Wpis opublikowany/zaplanowany! ID: {response.json()['id']}", response.json().get('link'), response.json()['id']
+        except requests.exceptions.HTTPError as e: return False, f"Błąd publikacji ({e.response.status_code}): {e.response.text}", None, None
+        except requests.exceptions.RequestException as e: return False, f"Błąd sieci podczas publikacji: {e}", None, None
+
+# --- TAKSONOMIE (KATEGORIE I TAGI) ---
+
+class TaxonomyResolver:
+    """
+    Pełne mapy kategorii i tagów (nazwa → ID) per strona, pobierane stronicowo i trzymane przez ttl sekund.
+    resolve() zamienia listę nazw na ID zbiorczo i raz tworzy brakujące terminy - kolejne artykuły tej samej partii
+    korzystają już z mapy, więc planowanie kosztuje O(stron) zapytań o taksonomie, a nie O(artykułów × stron).
+    """
+    def __init__(self, ttl=300):
+        self.ttl = ttl
+        self._maps = {}
+        self._locks = {}
+        self._lock = threading.Lock()
+
+    def _key_lock(self, key):
+        with self._lock: return self._locks.setdefault(key, threading.RLock())
+
+    def _load(self, api, taxonomy, refresh=False):
+        key = (api.base_url, taxonomy)
+        with self._key_lock(key):
+            fetched_at, terms = self._maps.get(key, (0.0, None))
+            if refresh or terms is None or time.monotonic() - fetched_at > self.ttl:
+                terms = api.get_terms(taxonomy)
+                self._maps[key] = (time.monotonic(), terms)
+            return terms
+
+    def terms(self, api, taxonomy, refresh=False):
+        """Kopia mapy nazwa → ID (np. do list wyboru)."""
+        return dict(self._load(api, taxonomy, refresh))
+
+    def resolve(self, api, taxonomy, names, create_missing=False):
+        """ID dla nazw (bez rozróżniania wielkości liter, bez duplikatów). Zwraca (lista ID, nazwy nierozwiązane)."""
+        unique = {}
+        for name in (name.strip() for name in names):
+            if name: unique.setdefault(name.lower(), name)
+        names = list(unique.values())
+        if not names: return [], []
+        key = (api.base_url, taxonomy)
+        with self._key_lock(key):
+            terms = self._load(api, taxonomy)
+            by_lower = {name.lower(): term_id for name, term_id in terms.items()}
+            ids, unresolved = [], []
+            for name in names:
+                term_id = by_lower.get(name.lower())
+                if term_id is None and create_missing:
+                    term_id, _ = api.create_term(taxonomy, name)
+                    if term_id:
+                        terms[name] = by_lower[name.lower()] = term_id
+                        self._maps[key] = (self._maps.get(key, (time.monotonic(), None))[0], terms)
+                if term_id is None: unresolved.append(name)
+                else: ids.append(term_id)
+            return ids, unresolved
+
+    def invalidate(self, base_url=None):
+        with self._lock:
+            self._maps = {key: value for key, value in self._maps.items() if base_url is not None and key[0] != base_url}
+
+@st.cache_resource
+def get_taxonomy_resolver():
+    return TaxonomyResolver()
 
 # --- LOGIKA GENEROWANIA TREŚCI I PROMPTY ---
 
@@ -414,42 +884,736 @@ Struktura JSON:
 
 Nie dodawaj komentarzy poza strukturą JSON."""
 
-def call_gpt5_nano(api_key, prompt):
-    """Wywołanie modelu GPT-5-nano"""
+DEFAULT_CLUSTER_PROMPT_TEMPLATE = """Jesteś ekspertem SEO i strategiem treści specjalizującym się w optymalizacji pod AI search (GEO/AIO).
+
+Twoim zadaniem jest analiza listy tytułów artykułów z bloga i zaproponowanie UNIKALNYCH, NIE-DUPLIKUJĄCYCH tematów zoptymalizowanych pod systemy AI.
+
+# KROK 1: ANALIZA I GRUPOWANIE
+Przeanalizuj poniższe tytuły i pogrupuj je w logiczne klastry tematyczne:
+{{TYTULY_ARTYKULOW}}
+
+Nazwa klastra = ogólny, nadrzędny temat (np. "Marketing w mediach społecznościowych", "Pozycjonowanie lokalne", "Zdrowa dieta")
+
+# KROK 2: IDENTYFIKACJA PRAWDZIWYCH LUK (KRYTYCZNE!)
+Dla każdego klastra określ **co NAPRAWDĘ brakuje**, a nie tylko parafrazy istniejących tematów:
+
+❌ BŁĄD - Proponowanie parafraz:
+- Istniejący: "Jak zbudować skuteczną rutynę anti-aging"
+- ❌ ZŁA propozycja: "Jak stworzyć rutynę anti-aging krok po kroku"
+- ✅ DOBRA propozycja: "Jak modyfikować rutynę anti-aging podczas podróży służbowych?"
+
+Szukaj luk w:
+- **Specyficzne scenariusze użycia** (podróże, praca zdalna, małe mieszkanie, budżet do 100 zł)
+- **Niszowe przypadki brzegowe** (łączenie produktów, nietypowe typy skóry, choroby współistniejące)
+- **Zaawansowane porównania** (marka A vs B, składnik X w różnych stężeniach, procedura Y vs Z)
+- **Problematyczne sytuacje** (efekty uboczne, co zrobić gdy coś nie działa, jak naprawić błędy)
+- **Temporalne aspekty** (zmiany sezonowe, progresja w czasie, długoterminowe vs krótkoterminowe efekty)
+- **Aspekty ekonomiczne** (budżetowe alternatywy, stosunek ceny do jakości, gdzie zaoszczędzić)
+
+# KROK 3: GENEROWANIE PROPOZYCJI - ZASADA ZERO-DUPLIKACJI
+
+**ABSOLUTNIE ZABRONIONE:**
+- ❌ Parafrazowanie istniejących tytułów
+- ❌ Zmiana jednego słowa w istniejącym tytule
+- ❌ Dodanie "kompletny przewodnik" do istniejącego tematu
+- ❌ Zmiana kolejności słów w istniejącym tytule
+
+**PRZED dodaniem tematu do propozycji, SPRAWDŹ:**
+1. Czy odpowiada na INNE pytanie niż istniejące artykuły?
+2. Czy zawiera NOWY kąt/perspektywę?
+3. Czy dotyczy SPECYFICZNEGO scenariusza/przypadku?
+4. Czy NIE jest parafrazą żadnego z istniejących tytułów?
+
+**TYLKO jeśli odpowiedź na wszystkie 4 pytania to TAK - dodaj temat do propozycji.**
+
+# KROK 4: OPTYMALIZACJA POD AI SEARCH
+
+Każdy proponowany temat MUSI:
+
+1. **Być ultra-specyficzny i niszowy**
+   ✅ "Jak stosować retinol w rutynie anti-aging jeśli masz rozaceę? Bezpieczny protokół"
+   ✅ "Witamina C w serach: 10% vs 15% vs 20% - która dawka dla jakiego typu skóry?"
+   ✅ "Jak budować rutynę anti-aging z budżetem 200 zł miesięcznie? Priorytetyzacja zakupów"
+   ❌ "Jak stosować retinol w pielęgnacji?" (zbyt ogólne)
+
+2. **Odpowiadać na konkretne, zaawansowane pytanie**
+   ✅ "Co zrobić gdy niacynamid powoduje zaczerwienienia? Troubleshooting + alternatywy"
+   ✅ "Czy można łączyć kwas hialuronowy z retinolem w jednej rutynie? Bezpieczna kolejność"
+   ❌ "Jak stosować niacynamid?" (zbyt podstawowe)
+
+3. **Zawierać mierzalne parametry lub konkretne liczby**
+   ✅ "Ile czasu trzeba czekać między aplikacją witaminy C a kremu SPF? Nauka vs praktyka"
+   ✅ "Jak długo czekać na efekty peptydów miedziowych? Timeline 30/60/90 dni"
+   
+4. **Dotyczyć case study lub problematycznych sytuacji**
+   ✅ "Purging po retinolu: jak odróżnić od prawdziwej alergii? Mapa objawów"
+   ✅ "Które składniki aktywne nie powinny się znaleźć w jednej rutynie? Macierz kompatybilności"
+
+# WYMAGANY FORMAT JSON
+
+{
+  "klastry": [
+    {
+      "nazwa_klastra": "Nazwa nadrzędnego tematu",
+      "istniejace_artykuly": ["Tytuł 1", "Tytuł 2"],
+      "luki_w_tresci": "Opis KONKRETNYCH luk (nie ogólniki). Co użytkownicy chcą wiedzieć, a nie znajdą w istniejących artykułach?",
+      "proponowane_nowe_tematy": [
+        "Ultra-specyficzny temat 1 z jasnym kątem i kontekstem",
+        "Niszowy case study 2 z mierzalnymi parametrami",
+        "Zaawansowane porównanie 3 z konkretnymi liczbami",
+        "Problematyczna sytuacja 4 z troubleshooting",
+        "Scenariusz brzegowy 5 z praktycznymi ograniczeniami"
+      ]
+    }
+  ]
+}
+
+**PRZED ZWRÓCENIEM JSON - WYKONAJ SELF-CHECK:**
+Dla każdego proponowanego tematu upewnij się, że:
+- [ ] NIE jest parafrazą istniejącego tytułu
+- [ ] Zawiera UNIKALNY kąt/perspektywę
+- [ ] Jest ultra-specyficzny (nie ogólny)
+- [ ] Odpowiada na pytanie, którego istniejące artykuły NIE pokrywają
+
+WYGENERUJ TERAZ KOMPLETNĄ ANALIZĘ W FORMACIE JSON."""
+
+# Zmienne obsługiwane przez poszczególne szablony promptów
+MASTER_PROMPT_VARIABLES = ("PERSONA_DESCRIPTION", "TEMAT_ARTYKULU", "ANALIZA_TEMATU", "GRUPA_DOCELOWA", "ZAGADNIENIA_KLUCZOWE", "SLOWA_KLUCZOWE", "DODATKOWE_SLOWA_SEMANTYCZNE", "HIPERONIMY", "HIPONIMY", "SYNOMINY")
+BRIEF_PROMPT_VARIABLES = ("TOPIC",)
+CLUSTER_PROMPT_VARIABLES = ("TYTULY_ARTYKULOW",)
+
+class PromptTemplateError(ValueError):
+    pass
+
+class PromptTemplate:
+    """
+    Skompilowany szablon promptu z placeholderami {{NAZWA}}.
+    Tekst jest parsowany raz na listę fragmentów (literał / zmienna), a renderowanie
+    to pojedyncze złączenie listy zamiast łańcucha .replace() kopiującego cały szablon.
+    """
+    PLACEHOLDER_RE = re.compile(r"\{\{([A-Za-z0-9_]+)\}\}")
+
+    def __init__(self, text):
+        self.text = text
+        self._literals = []
+        self._names = []
+        pos = 0
+        for match in self.PLACEHOLDER_RE.finditer(text):
+            self._literals.append(text[pos:match.start()])
+            self._names.append(match.group(1))
+            pos = match.end()
+        self._literals.append(text[pos:])
+        self.variables = frozenset(self._names)
+
+    def validate(self, allowed):
+        """Zwraca (nieznane, brakujące): zmienne spoza listy dozwolonych oraz dozwolone, których szablon nie używa."""
+        allowed = set(allowed)
+        return sorted(self.variables - allowed), sorted(allowed - self.variables)
+
+    def render(self, values):
+        unknown = self.variables - values.keys()
+        if unknown:
+            raise PromptTemplateError(f"Brak wartości dla zmiennych: {', '.join(sorted(unknown))}")
+        parts = [None] * (len(self._literals) + len(self._names))
+        parts[::2] = self._literals
+        parts[1::2] = [str(values[name]) for name in self._names]
+        return "".join(parts)
+
+@st.cache_resource(max_entries=32)
+def compile_prompt_template(text):
+    """Kompiluje szablon raz na wersję tekstu (cache przetrwa ponowne uruchomienia skryptu)."""
+    return PromptTemplate(text)
+
+def benchmark_prompt_render(text, values, iterations=1000):
+    """Porównuje czas renderowania skompilowanego szablonu z łańcuchem .replace(). Zwraca (sekundy_kompilowany, sekundy_replace)."""
+    template = compile_prompt_template(text)
+    start = time.perf_counter()
+    for _ in range(iterations): template.render(values)
+    compiled_time = time.perf_counter() - start
+    start = time.perf_counter()
+    for _ in range(iterations):
+        rendered = text
+        for name, value in values.items(): rendered = rendered.replace(f"{{{{{name}}}}}", str(value))
+    return compiled_time, time.perf_counter() - start
+
+# --- STRUKTURALNE ODPOWIEDZI JSON (STRUCTURED OUTPUTS) ---
+
+def _json_object(properties):
+    """Obiekt w trybie strict: wszystkie pola wymagane, bez dodatkowych kluczy."""
+    return {"type": "object", "properties": properties, "required": list(properties), "additionalProperties": False}
+
+_STRING_LIST = {"type": "array", "items": {"type": "string"}}
+
+STRUCTURED_OUTPUT_SCHEMAS = {
+    "brief": _json_object({
+        "temat_artykulu": {"type": "string"},
+        "analiza_tematu": {"type": "string"},
+        "grupa_docelowa": {"type": "string"},
+        "zagadnienia_kluczowe": _STRING_LIST,
+        "slowa_kluczowe": _STRING_LIST,
+        "dodatkowe_slowa_semantyczne": _STRING_LIST,
+        "relacje_leksykalne": _json_object({"synonimy": _STRING_LIST, "hiperonimy": _STRING_LIST, "hiponimy": _STRING_LIST}),
+    }),
+    "meta_tags": _json_object({"meta_title": {"type": "string"}, "meta_description": {"type": "string"}}),
+    "clusters": _json_object({"klastry": {"type": "array", "items": _json_object({
+        "nazwa_klastra": {"type": "string"},
+        "istniejace_artykuly": _STRING_LIST,
+        "luki_w_tresci": {"type": "string"},
+        "proponowane_nowe_tematy": _STRING_LIST,
+    })}}),
+}
+
+JSON_REPAIR_PROMPT = """Poniższa odpowiedź miała być poprawnym JSON-em zgodnym ze schematem, ale walidacja wykazała błędy.
+Popraw WYŁĄCZNIE wskazane problemy, zachowując pozostałą treść bez zmian. Zwróć tylko poprawiony JSON.
+
+# BŁĘDY WALIDACJI
+{errors}
+
+# SCHEMAT
+{schema}
+
+# ODPOWIEDŹ DO NAPRAWY
+{response}"""
+
+class StructuredOutputError(ValueError):
+    pass
+
+def validate_json_schema(data, schema, path="$"):
+    """Minimalny walidator podzbioru JSON Schema używanego w STRUCTURED_OUTPUT_SCHEMAS. Zwraca listę błędów."""
+    python_types = {"object": dict, "array": list, "string": str}
+    expected = schema.get("type")
+    if expected in python_types and not isinstance(data, python_types[expected]):
+        return [f"{path}: oczekiwano typu {expected}, otrzymano {type(data).__name__}"]
+    errors = []
+    if expected == "object":
+        errors.extend(f"{path}: brak klucza '{key}'" for key in schema.get("required", []) if key not in data)
+        for key, sub_schema in schema.get("properties", {}).items():
+            if key in data: errors.extend(validate_json_schema(data[key], sub_schema, f"{path}.{key}"))
+    elif expected == "array":
+        for i, item in enumerate(data): errors.extend(validate_json_schema(item, schema.get("items", {}), f"{path}[{i}]"))
+    return errors
+
+def extract_json_text(response_text):
+    """Lokalna, darmowa naprawa: usuwa znaczniki markdown i tekst poza najbardziej zewnętrznym obiektem/tablicą JSON."""
+    text = response_text.strip().replace("```json", "").replace("```", "").strip()
+    starts = [i for i in (text.find("{"), text.find("[")) if i != -1]
+    if not starts: return text
+    start = min(starts)
+    end = text.rfind("}" if text[start] == "{" else "]")
+    return text[start:end + 1] if end > start else text[start:]
+
+def parse_structured_json(response_text, schema_name):
+    """
+    Parsuje i waliduje odpowiedź. Zwraca (dane, błędy).
+    Goła lista przy schemacie-obiekcie z jednym polem tablicowym (np. klastry ze starszych promptów) jest
+    opakowywana lokalnie w ten obiekt, zamiast trafiać do płatnej naprawy.
+    """
+    try:
+        data = json.loads(extract_json_text(response_text or ""))
+    except json.JSONDecodeError as e:
+        return None, [f"niepoprawny JSON: {e}"]
+    schema = STRUCTURED_OUTPUT_SCHEMAS[schema_name]
+    properties = schema.get("properties", {})
+    if isinstance(data, list) and schema.get("type") == "object" and len(properties) == 1:
+        (key, value_schema), = properties.items()
+        if value_schema.get("type") == "array": data = {key: data}
+    return data, validate_json_schema(data, schema)
+
+def repair_structured_json(api_key, response_text, schema_name, max_repairs=1):
+    """
+    Waliduje odpowiedź, a przy błędach wysyła krótkie żądanie naprawcze zawierające tylko wadliwą odpowiedź
+    i listę błędów (bez ponownego wysyłania pełnego promptu). Rzuca StructuredOutputError, jeśli naprawa się nie uda.
+    """
+    data, errors = parse_structured_json(response_text, schema_name)
+    for _ in range(max_repairs):
+        if not errors: break
+        repair_prompt = JSON_REPAIR_PROMPT.format(errors="\n".join(f"- {e}" for e in errors[:20]), schema=json.dumps(STRUCTURED_OUTPUT_SCHEMAS[schema_name], ensure_ascii=False), response=response_text)
+        response_text = call_gpt5_nano(api_key, repair_prompt, schema_name=schema_name)
+        data, errors = parse_structured_json(response_text, schema_name)
+    if errors: raise StructuredOutputError("; ".join(errors[:5]))
+    return data
+
+def call_gpt5_nano_json(api_key, prompt, schema_name, max_repairs=1):
+    """Wywołanie GPT-5-nano w trybie structured output z walidacją schematu i ścieżką naprawczą."""
+    return repair_structured_json(api_key, call_gpt5_nano(api_key, prompt, schema_name=schema_name), schema_name, max_repairs)
+
+def unwrap_cluster_result(data):
+    """Akceptuje zarówno {"klastry": [...]}, jak i gołą listę (starsze, edytowane prompty)."""
+    return data["klastry"] if isinstance(data, dict) else data
+
+class PromptCacheStats:
+    """Licznik tokenów promptu i tokenów obsłużonych z cache prefiksu po stronie OpenAI. Bezpieczny dla wątków."""
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.prompt_tokens = 0
+        self.cached_tokens = 0
+
+    def record(self, usage):
+        if usage is None: return
+        details = getattr(usage, "prompt_tokens_details", None)
+        cached = getattr(details, "cached_tokens", 0) or 0
+        with self._lock:
+            self.calls += 1
+            self.prompt_tokens += getattr(usage, "prompt_tokens", 0) or 0
+            self.cached_tokens += cached
+
+    @property
+    def cached_ratio(self):
+        return self.cached_tokens / self.prompt_tokens if self.prompt_tokens else 0.0
+
+def build_chat_request(prompt, system_prompt=None, model="gpt-5-nano", schema_name=None):
+    """
+    Buduje ciało żądania chat.completions.
+    Jeśli podano system_prompt, trafia on jako pierwsza (stała) wiadomość - identyczny prefiks
+    między wywołaniami pozwala OpenAI obsłużyć go z cache promptów.
+    schema_name włącza tryb structured output ze schematem z STRUCTURED_OUTPUT_SCHEMAS.
+    """
+    body = {"model": model, "messages": [{"role": "user", "content": prompt}]}
+    if system_prompt:
+        body["messages"].insert(0, {"role": "system", "content": system_prompt})
+        body["prompt_cache_key"] = hashlib.sha256(system_prompt.encode()).hexdigest()[:32]
+    if schema_name:
+        body["response_format"] = {"type": "json_schema", "json_schema": {"name": schema_name, "strict": True, "schema": STRUCTURED_OUTPUT_SCHEMAS[schema_name]}}
+    return body
+
+def call_openai_chat(api_key, prompt, system_prompt=None, cache_stats=None, schema_name=None, model="gpt-5-nano"):
     client = openai.OpenAI(api_key=api_key)
-    response = client.chat.completions.create(
-        model="gpt-5-nano",
-        messages=[{"role": "user", "content": prompt}]
-    )
+    response = client.chat.completions.create(**build_chat_request(prompt, system_prompt, model=model, schema_name=schema_name))
+    if cache_stats is not None: cache_stats.record(response.usage)
     return response.choices[0].message.content
 
-def generate_article_single_pass(api_key, title, prompt):
+def call_gpt5_nano(api_key, prompt, system_prompt=None, cache_stats=None, schema_name=None):
+    """Wywołanie modelu GPT-5-nano"""
+    return call_openai_chat(api_key, prompt, system_prompt, cache_stats, schema_name)
+
+def call_gemini_text(api_key, prompt, system_prompt=None, model="gemini-2.5-flash"):
+    client = genai.Client(api_key=api_key)
+    config = genai.types.GenerateContentConfig(system_instruction=system_prompt) if system_prompt else None
+    response = client.models.generate_content(model=model, contents=[prompt], config=config)
+    if not response.text: raise ValueError(f"Model {model} nie zwrócił treści")
+    return response.text
+
+# --- WARSTWA MODELI TEKSTOWYCH (FALLBACK I HEDGING) ---
+
+# Model → dostawca (klucz API) i limit równoległych wywołań tego modelu w całej aplikacji.
+TEXT_MODELS = {
+    "gpt-5-nano": {"provider": "openai", "concurrency": 8},
+    "gpt-5-mini": {"provider": "openai", "concurrency": 4},
+    "gemini-2.5-flash": {"provider": "gemini", "concurrency": 8},
+    "gemini-2.5-flash-lite": {"provider": "gemini", "concurrency": 8},
+}
+
+class TextModel:
+    """Jeden model tekstowy: semafor równoległości i okno ostatnich czasów odpowiedzi (próg hedgingu)."""
+    def __init__(self, name, provider, concurrency, window=100):
+        self.name = name
+        self.provider = provider
+        self._slots = threading.BoundedSemaphore(concurrency)
+        self._latencies = deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def complete(self, api_keys, prompt, system_prompt=None, cache_stats=None):
+        with self._slots:
+            start = time.monotonic()
+            if self.provider == "openai": text = call_openai_chat(api_keys["openai"], prompt, system_prompt, cache_stats, model=self.name)
+            else: text = call_gemini_text(api_keys["gemini"], prompt, system_prompt, model=self.name)
+            with self._lock: self._latencies.append(time.monotonic() - start)
+            return text
+
+    def latency_percentile(self, percentile, min_samples=5):
+        with self._lock:
+            if len(self._latencies) < min_samples: return None
+            return float(np.percentile(self._latencies, percentile))
+
+class ModelRouter:
+    """
+    Wywołuje listę modeli jako jedno żądanie: pierwszy model jest główny, kolejne są zapasem.
+    - błąd modelu → od razu startuje następny z listy (fallback),
+    - brak odpowiedzi w czasie p{hedge_percentile} dotychczasowych odpowiedzi modelu → równolegle startuje
+      następny (hedging); wygrywa pierwsza poprawna odpowiedź, pozostałe są porzucane.
+    Ogon opóźnień dużej partii jest więc ograniczony przez najszybszy sprawny model, a nie przez najwolniejsze wywołanie.
+    """
+    def __init__(self, models, hedge_percentile=90, max_workers=32):
+        self.models = {name: TextModel(name, **config) for name, config in models.items()}
+        self.hedge_percentile = hedge_percentile
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="text-models")
+        self.wins = Counter()
+        self.hedges = 0
+        self.fallbacks = 0
+        self._lock = threading.Lock()
+
+    def available(self, names, api_keys):
+        return [name for name in names if name in self.models and api_keys.get(self.models[name].provider)]
+
+    def complete(self, names, api_keys, prompt, system_prompt=None, cache_stats=None):
+        """Zwraca (tekst, nazwa modelu, który odpowiedział). Gdy zawiodą wszystkie modele - RuntimeError z listą błędów."""
+        candidates = [self.models[name] for name in self.available(names, api_keys)]
+        if not candidates: raise ValueError(f"Brak dostępnego modelu (sprawdź klucze API): {', '.join(names)}")
+        pending, errors, launched = {}, [], 0
+        hedge_deadline = None
+
+        def launch():
+            nonlocal launched, hedge_deadline
+            model = candidates[launched]
+            launched += 1
+            pending[self.executor.submit(model.complete, api_keys, prompt, system_prompt, cache_stats)] = model
+            delay = model.latency_percentile(self.hedge_percentile) if launched < len(candidates) else None
+            hedge_deadline = time.monotonic() + delay if delay is not None else None
+
+        launch()
+        while pending:
+            timeout = max(0.0, hedge_deadline - time.monotonic()) if hedge_deadline is not None else None
+            done, _ = wait(pending, timeout=timeout, return_when=FIRST_COMPLETED)
+            if not done:
+                with self._lock: self.hedges += 1
+                launch()
+                continue
+            for future in done:
+                model = pending.pop(future)
+                try:
+                    text = future.result()
+                except Exception as e:
+                    errors.append(f"{model.name}: {e}")
+                    if launched < len(candidates):
+                        with self._lock: self.fallbacks += 1
+                        launch()
+                    continue
+                for other in pending: other.cancel()
+                with self._lock: self.wins[model.name] += 1
+                return text, model.name
+        raise RuntimeError("Wszystkie modele zawiodły - " + "; ".join(errors))
+
+@st.cache_resource
+def get_model_router():
+    return ModelRouter(TEXT_MODELS)
+
+def build_article_system_prompt(template):
+    """Stała część żądania: zasady bazowe + surowy szablon Master Promptu (bez podstawionych zmiennych)."""
+    return f"""{SYSTEM_PROMPT_BASE}
+
+---SZABLON ZADANIA---
+{template}
+
+---SPOSÓB UŻYCIA SZABLONU---
+Wartości zmiennych w formacie {{{{NAZWA}}}} otrzymasz w wiadomości użytkownika. Traktuj szablon tak, jakby każda zmienna była zastąpiona podaną wartością."""
+
+def build_master_prompt_variables(brief, persona_description):
+    """Mapuje brief i opis persony na zmienne Master Promptu."""
+    relacje = brief.get("relacje_leksykalne", {})
+    return {
+        "PERSONA_DESCRIPTION": persona_description,
+        "TEMAT_ARTYKULU": brief.get("temat_artykulu", ""),
+        "ANALIZA_TEMATU": "SZEROKI" if "szeroki" in brief.get("analiza_tematu", "").lower() else "WĄSKI",
+        "GRUPA_DOCELOWA": brief.get("grupa_docelowa", ""),
+        "ZAGADNIENIA_KLUCZOWE": "\n".join(f"- {z}" for z in brief.get("zagadnienia_kluczowe", [])),
+        "SLOWA_KLUCZOWE": ", ".join(brief.get("slowa_kluczowe", [])),
+        "DODATKOWE_SLOWA_SEMANTYCZNE": ", ".join(brief.get("dodatkowe_slowa_semantyczne", [])),
+        "HIPERONIMY": ", ".join(relacje.get("hiperonimy", [])),
+        "HIPONIMY": ", ".join(relacje.get("hiponimy", [])),
+        "SYNOMINY": ", ".join(relacje.get("synonimy", [])),
+    }
+
+def build_article_user_prompt(variables):
+    """Zmienna część żądania - tylko wartości zmiennych konkretnego briefu."""
+    values = "\n\n".join(f"{{{{{name}}}}}:\n{value}" for name, value in variables.items())
+    return f"---ZMIENNE---\n{values}\n\nROZPOCZNIJ PISANIE ARTYKUŁU. TYLKO HTML, BEZ KOMENTARZY."
+
+def clean_article_html(article_html):
+    """Dodatkowe czyszczenie na wypadek, gdyby AI dodało markdown"""
+    return article_html.strip().replace("```html", "").replace("```", "").strip()
+
+# --- SANITYZACJA I WALIDACJA HTML ARTYKUŁÓW ---
+
+ARTICLE_ALLOWED_TAGS = frozenset({"h2", "h3", "p", "b", "strong", "ul", "ol", "li", "table", "tr", "th", "td"})
+ARTICLE_BLOCK_TAGS = frozenset({"h2", "h3", "p", "ul", "ol", "table"})
+ARTICLE_DROPPED_CONTENT_TAGS = frozenset({"script", "style", "iframe", "noscript", "head", "title"})
+MAX_PARAGRAPH_SENTENCES = 4
+MIN_SECTION_WORDS = 40
+MAX_SECTION_LIST_SHARE = 0.7
+# Znaczniki domykane niejawnie przez kolejne rodzeństwo: tag -> (domykane znaczniki, kontenery, za które nie wychodzimy)
+ARTICLE_IMPLICIT_CLOSE = {"li": ({"li"}, {"ul", "ol"}), "tr": ({"tr"}, {"table"}), "td": ({"td", "th"}, {"tr", "table"}), "th": ({"td", "th"}, {"tr", "table"})}
+
+SECTION_REPAIR_PROMPT = """Popraw jedną sekcję artykułu "{title}". Zachowaj nagłówek <h2>, sens, fakty i słowa kluczowe - usuń tylko wskazane problemy.
+
+PROBLEMY DO USUNIĘCIA:
+{issues}
+
+SEKCJA DO POPRAWY:
+{section_html}
+
+Zwróć WYŁĄCZNIE poprawioną sekcję w czystym HTML, zaczynając od tego samego znacznika <h2>."""
+
+def _new_article_section(heading=""):
+    return {"heading": heading, "html": [], "words": 0, "list_words": 0, "paragraphs": 0, "long_paragraphs": 0, "h3": 0, "qa_pairs": 0, "tables": 0}
+
+class ArticleSanitizer(HTMLParser):
+    """
+    Jednoprzebiegowy sanitizer HTML artykułu na zdarzeniach HTMLParser (bez budowy drzewa DOM):
+    przepuszcza tylko znaczniki z HTML_RULES i bez atrybutów, <h1> zamienia na <h2>, pozostałe znaczniki rozpakowuje
+    (tekst zostaje), usuwa zawartość script/style i domyka niezamknięte znaczniki. Przy okazji dzieli artykuł na sekcje
+    (granicą jest <h2>) i liczy statystyki struktury.
     """
-    Generowanie artykułu w JEDNYM wywołaniu API.
+    def __init__(self):
+        super().__init__(convert_charrefs=False)
+        self.sections = [_new_article_section()]
+        self.removed_tags = Counter()
+        self._open = []
+        self._skip_depth = 0
+        self._block_text = []
+        self._question_pending = False
+
+    @property
+    def _section(self):
+        return self.sections[-1]
+
+    def _emit(self, html):
+        self._section["html"].append(html)
+
+    def _close_until(self, tag):
+        while self._open:
+            open_tag = self._open.pop()
+            self._emit(f"</{open_tag}>")
+            self._on_close(open_tag)
+            if open_tag == tag: return
+
+    def _close_sibling(self, siblings, containers):
+        for open_tag in reversed(self._open):
+            if open_tag in containers: return
+            if open_tag in siblings:
+                self._close_until(open_tag)
+                return
+
+    def _on_close(self, tag):
+        text = "".join(self._block_text).strip() if tag in ("p", "h2", "h3") else ""
+        if tag in ("p", "h2", "h3"): self._block_text = []
+        if tag == "p" and text:
+            self._section["paragraphs"] += 1
+            if len(re.findall(r"[.!?…]+(?=\s|$)", text)) > MAX_PARAGRAPH_SENTENCES: self._section["long_paragraphs"] += 1
+        elif tag == "h2":
+            self._section["heading"] = html_unescape(text)
+        elif tag == "h3":
+            self._question_pending = text.endswith("?")
+
+    def handle_starttag(self, tag, attrs):
+        if tag in ARTICLE_DROPPED_CONTENT_TAGS:
+            self._skip_depth += 1
+            return
+        if self._skip_depth: return
+        if tag == "br":
+            self.handle_data(" ")
+            return
+        if tag == "h1":
+            self.removed_tags["h1"] += 1
+            tag = "h2"
+        if tag not in ARTICLE_ALLOWED_TAGS:
+            self.removed_tags[tag] += 1
+            return
+        if tag in ARTICLE_BLOCK_TAGS and "p" in self._open: self._close_until("p")
+        if tag in ARTICLE_IMPLICIT_CLOSE: self._close_sibling(*ARTICLE_IMPLICIT_CLOSE[tag])
+        if tag in ("h2", "h3") and self._open: self._close_until(self._open[0])
+        if tag == "h2" and (self._section["html"] or self._section["heading"]): self.sections.append(_new_article_section())
+        if tag in ARTICLE_BLOCK_TAGS:
+            if tag == "p" and self._question_pending: self._section["qa_pairs"] += 1
+            self._question_pending = False
+        if tag == "h3": self._section["h3"] += 1
+        if tag == "table": self._section["tables"] += 1
+        self._emit(f"<{tag}>")
+        self._open.append(tag)
+
+    def handle_startendtag(self, tag, attrs):
+        if tag == "br" and not self._skip_depth: self.handle_data(" ")
+        elif tag not in ARTICLE_ALLOWED_TAGS: self.removed_tags[tag] += 1
+
+    def handle_endtag(self, tag):
+        if tag in ARTICLE_DROPPED_CONTENT_TAGS:
+            self._skip_depth = max(0, self._skip_depth - 1)
+            return
+        if self._skip_depth: return
+        if tag == "h1": tag = "h2"
+        if tag in self._open: self._close_until(tag)
+
+    def handle_data(self, data):
+        if self._skip_depth: return
+        self._emit(data)
+        if "p" in self._open or "h2" in self._open or "h3" in self._open: self._block_text.append(data)
+        words = len(re.findall(r"\w+", data))
+        self._section["words"] += words
+        if "li" in self._open: self._section["list_words"] += words
+
+    def handle_entityref(self, name):
+        self.handle_data(f"&{name};")
+
+    def handle_charref(self, name):
+        self.handle_data(f"&#{name};")
+
+    def finish(self):
+        """Domyka dokument i zwraca (HTML, raport). Niedomknięte znaczniki na końcu oznaczają urwaną odpowiedź."""
+        self.close()
+        tail = "".join(self._block_text).strip()
+        truncated = (bool(self._open) and self._open != ["p"]) or (bool(tail) and not re.search(r"[.!?…:)]$", tail))
+        if self._open: self._close_until(self._open[0])
+        sections = []
+        for index, section in enumerate(s for s in self.sections if s["html"]):
+            section["html"] = "".join(section["html"]).strip()
+            issues = []
+            if section["long_paragraphs"]: issues.append(f"{section['long_paragraphs']} akapit(y) dłuższe niż {MAX_PARAGRAPH_SENTENCES} zdania")
+            if section["heading"] and section["words"] < MIN_SECTION_WORDS: issues.append(f"sekcja zbyt krótka ({section['words']} słów)")
+            if section["words"] and section["list_words"] > MAX_SECTION_LIST_SHARE * section["words"]: issues.append("sekcja złożona głównie z list - treść powinna być w akapitach")
+            section["issues"] = issues
+            sections.append(section)
+        if truncated and sections: sections[-1]["issues"].append("sekcja urwana w połowie (niedomknięte znaczniki lub niedokończone zdanie)")
+        report = {key: sum(s[key] for s in sections) for key in ("words", "paragraphs", "long_paragraphs", "h3", "qa_pairs", "tables")}
+        report.update(h2=sum(1 for s in sections if s["heading"]), removed_tags=dict(self.removed_tags), truncated=truncated, sections=sections)
+        return "\n".join(s["html"] for s in sections), report
+
+def sanitize_article_html(article_html):
+    """Czyści artykuł do dozwolonych znaczników HTML_RULES. Zwraca (HTML, raport ze statystykami i problemami sekcji)."""
+    parser = ArticleSanitizer()
+    parser.feed(clean_article_html(article_html))
+    return parser.finish()
+
+def summarize_article_structure(report):
+    """Statystyki struktury do tabel w interfejsie."""
+    return {"Słowa": report["words"], "H2": report["h2"], "H3": report["h3"], "Q&A": report["qa_pairs"], "Tabele": report["tables"], "Problemy": sum(len(s["issues"]) for s in report["sections"])}
+
+def regenerate_article_section(api_keys, models, title, section, cache_stats=None):
+    """Jedno wywołanie modelu poprawiające sekcję z problemami. Nowa wersja zastępuje starą tylko, gdy ma mniej problemów."""
+    prompt = SECTION_REPAIR_PROMPT.format(title=title, issues="\n".join(f"- {issue}" for issue in section["issues"]), section_html=section["html"])
+    try:
+        fixed_html, _ = get_model_router().complete(list(models), api_keys, prompt, SYSTEM_PROMPT_BASE, cache_stats)
+    except Exception:
+        return section["html"]
+    fixed_html, fixed_report = sanitize_article_html(fixed_html)
+    fixed_issues = sum(len(s["issues"]) for s in fixed_report["sections"])
+    return fixed_html if fixed_html and fixed_issues < len(section["issues"]) else section["html"]
+
+def repair_article_sections(api_keys, models, title, article_html, cache_stats=None):
+    """
+    Sanityzacja + walidacja; sekcje H2 z problemami są równolegle generowane ponownie (jedna runda),
+    reszta artykułu zostaje bez zmian. Zwraca (HTML, raport po poprawkach).
+    """
+    article_html, report = sanitize_article_html(article_html)
+    failing = [i for i, section in enumerate(report["sections"]) if section["issues"] and section["heading"]]
+    if not failing: return article_html, report
+    with ThreadPoolExecutor(max_workers=len(failing)) as executor:
+        fixed = dict(zip(failing, executor.map(lambda i: regenerate_article_section(api_keys, models, title, report["sections"][i], cache_stats), failing)))
+    return sanitize_article_html("\n".join(fixed.get(i, section["html"]) for i, section in enumerate(report["sections"])))
+
+def generate_article_single_pass(api_keys, title, prompt, system_prompt=None, cache_stats=None, models=("gpt-5-nano",), repair_sections=True):
+    """
+    Generowanie artykułu w JEDNYM wywołaniu API (przez warstwę modeli - z fallbackiem i hedgingiem między models).
+    Z system_prompt: stały prefiks w wiadomości systemowej, prompt zawiera tylko zmienne briefu.
+    Bez system_prompt: prompt to w pełni wyrenderowany Master Prompt (układ klasyczny).
+    Wynik przechodzi przez sanitizer; z repair_sections sekcje z problemami są generowane ponownie.
     Zwraca: (title, article_html)
     """
     try:
-        full_prompt = f"{SYSTEM_PROMPT_BASE}\n\n---ZADANIE---\n{prompt}\n\nROZPOCZNIJ PISANIE ARTYKUŁU. TYLKO HTML, BEZ KOMENTARZY."
-        
-        article_html = call_gpt5_nano(api_key, full_prompt)
-        
-        # Dodatkowe czyszczenie na wypadek, gdyby AI dodało markdown
-        article_html = article_html.strip()
-        article_html = article_html.replace("```html", "").replace("```", "")
-        
-        return title, article_html.strip()
+        if not system_prompt:
+            prompt = f"{SYSTEM_PROMPT_BASE}\n\n---ZADANIE---\n{prompt}\n\nROZPOCZNIJ PISANIE ARTYKUŁU. TYLKO HTML, BEZ KOMENTARZY."
+        article_html, _ = get_model_router().complete(list(models), api_keys, prompt, system_prompt, cache_stats)
+        if repair_sections: return title, repair_article_sections(api_keys, models, title, article_html, cache_stats)[0]
+        return title, sanitize_article_html(article_html)[0]
     except Exception as e:
         return title, f"<p><strong>BŁĄD KRYTYCZNY podczas generowania artykułu:</strong> {str(e)}</p>"
 
-def generate_article_dispatcher(model, api_key, title, prompt):
-    """Dispatcher - obecnie obsługuje tylko gpt-5-nano"""
-    try:
-        if model == "gpt-5-nano":
-            return generate_article_single_pass(api_key, title, prompt)
-        else:
-            return title, f"<p><strong>BŁĄD: Nieobsługiwany model '{model}'</strong></p>"
-    except Exception as e:
-        return title, f"<p><strong>BŁĄD KRYTYCZNY:</strong> {str(e)}</p>"
+def generate_article_dispatcher(models, api_keys, title, prompt, system_prompt=None, cache_stats=None, repair_sections=True):
+    """Dispatcher - models: nazwa lub lista modeli z TEXT_MODELS; pierwszy jest główny, kolejne są zapasem."""
+    if isinstance(models, str): models = [models]
+    unknown = [model for model in models if model not in TEXT_MODELS]
+    if unknown: return title, f"<p><strong>BŁĄD: Nieobsługiwany model '{unknown[0]}'</strong></p>"
+    return generate_article_single_pass(api_keys, title, prompt, system_prompt=system_prompt, cache_stats=cache_stats, models=models, repair_sections=repair_sections)
+
+# --- GENEROWANIE SEKCJAMI (TEMATY SZEROKIE) ---
+
+SECTIONED_ARTICLE_WORDS = 3200
+SECTIONED_INTRO_WORDS = 150
+MIN_SECTIONED_TOPICS = 3
+
+SECTION_WRITER_PROMPT = """{persona}
+
+Piszesz JEDEN fragment artykułu "{title}" dla: {audience}. Pozostałe fragmenty równolegle piszą inni autorzy według tego samego planu - trzymaj się swojego zakresu.
+
+PLAN CAŁEGO ARTYKUŁU:
+{outline}
+
+TWÓJ FRAGMENT: {assignment}
+
+ZASADY FRAGMENTU:
+- Długość: około {words} słów.
+- {structure}
+- Nie powtarzaj zagadnień z innych punktów planu, nie pisz wstępu ani podsumowania całego artykułu.
+- Słowa kluczowe do naturalnego użycia w tym fragmencie: {keywords}
+- Terminy wspierające i synonimy: {semantic}
+
+Zwróć WYŁĄCZNIE HTML tego fragmentu."""
+
+def is_sectioned_candidate(variables, topics):
+    """Tryb sekcji ma sens tylko dla tematów SZEROKICH z planem co najmniej kilku zagadnień."""
+    return variables.get("ANALIZA_TEMATU") == "SZEROKI" and len(topics) >= MIN_SECTIONED_TOPICS
+
+def build_article_outline(variables, topics, keywords):
+    """
+    Plan z zagadnień kluczowych briefu - bez dodatkowego wywołania modelu: każde zagadnienie to sekcja H2
+    z budżetem słów i własną częścią słów kluczowych (rozdzielonych po kolei, żeby sekcje nie powtarzały tych samych fraz).
+    Zagadnienie typu "Jak"/"Dlaczego" dostaje sekcję reasoning z listą kroków.
+    """
+    words = max(250, (SECTIONED_ARTICLE_WORDS - SECTIONED_INTRO_WORDS) // len(topics))
+    reasoning = next((i for i, topic in enumerate(topics) if re.match(r"\s*(jak|dlaczego)\b", topic, re.IGNORECASE)), 0)
+    outline = [{"heading": None, "words": SECTIONED_INTRO_WORDS, "keywords": keywords[:2],
+                "assignment": "wstęp przed pierwszym nagłówkiem - zasada answer-first: bezpośrednia, zwięzła odpowiedź na główne pytanie tematu.",
+                "structure": "Bez nagłówków - tylko 1-2 akapity <p>."}]
+    for i, topic in enumerate(topics):
+        structure = f"Zacznij od <h2>{topic}</h2>. Dodaj jedną parę pytanie-odpowiedź: pytanie w <h3>, odpowiedź w <p> (1-2 zdania)."
+        if i == reasoning: structure += ' To sekcja "jak to działa" - wyjaśnij mechanizm numerowaną listą <ol> kroków, każdy krok jako samodzielne zdanie.'
+        outline.append({"heading": topic, "words": words, "keywords": keywords[i % len(keywords)::len(topics)] if keywords else [],
+                        "assignment": f'sekcja H2 "{topic}".', "structure": structure})
+    return outline
+
+def write_article_section(api_keys, models, title, variables, outline, item, cache_stats=None):
+    """Jedno wywołanie modelu na fragment; stały SYSTEM_PROMPT_BASE jest wspólnym prefiksem wszystkich fragmentów (cache promptów)."""
+    prompt = SECTION_WRITER_PROMPT.format(
+        persona=variables.get("PERSONA_DESCRIPTION", ""), title=title, audience=variables.get("GRUPA_DOCELOWA", ""),
+        outline="\n".join(f"{n}. {entry['heading']}" for n, entry in enumerate(outline) if entry['heading']),
+        assignment=item['assignment'], words=item['words'], structure=item['structure'],
+        keywords=", ".join(item['keywords']) or "brak", semantic=variables.get("DODATKOWE_SLOWA_SEMANTYCZNE", "") or "brak")
+    section_html, _ = get_model_router().complete(list(models), api_keys, prompt, SYSTEM_PROMPT_BASE, cache_stats)
+    section_html, report = sanitize_article_html(section_html)
+    if item['heading'] and not report['h2']: section_html = f"<h2>{html_escape(item['heading'])}</h2>\n{section_html}"
+    return section_html
+
+def harmonize_article_sections(article_html):
+    """Przebieg spójności po zszyciu: usuwa powtórzone nagłówki H2 oraz pary Q&A, które niezależni autorzy napisali podwójnie."""
+    seen = set()
+    def drop_repeated(match):
+        key = re.sub(r"\W+", " ", html_unescape(match.group(1))).strip().lower()
+        if key in seen: return ""
+        seen.add(key)
+        return match.group(0)
+    article_html = re.sub(r"<h3>(.*?)</h3>\s*<p>.*?</p>", drop_repeated, article_html, flags=re.DOTALL)
+    seen.clear()
+    return re.sub(r"<h2>(.*?)</h2>", drop_repeated, article_html, flags=re.DOTALL)
+
+def generate_article_sectioned(api_keys, title, variables, topics, keywords, cache_stats=None, models=("gpt-5-nano",), repair_sections=True):
+    """
+    Długi artykuł jako wstęp + sekcje H2 pisane równolegle według wspólnego planu - czas zależy od najwolniejszej sekcji,
+    a nie od długości całego artykułu. Po zszyciu: przebieg spójności i (opcjonalnie) poprawki sekcji z problemami.
+    Sekcja, której nie udało się napisać żadnym modelem, jest pomijana. Zwraca: (title, article_html)
+    """
+    outline = build_article_outline(variables, topics, keywords)
+    with ThreadPoolExecutor(max_workers=len(outline)) as executor:
+        futures = [executor.submit(write_article_section, api_keys, models, title, variables, outline, item, cache_stats) for item in outline]
+        parts, errors = [], []
+        for item, future in zip(outline, futures):
+            try:
+                parts.append(future.result())
+            except Exception as e:
+                errors.append(f"{item['heading'] or 'wstęp'}: {e}")
+    if len(errors) == len(outline):
+        return title, f"<p><strong>BŁĄD KRYTYCZNY podczas generowania artykułu:</strong> {'; '.join(errors)}</p>"
+    article_html = harmonize_article_sections("\n".join(parts))
+    if repair_sections: return title, repair_article_sections(api_keys, models, title, article_html, cache_stats)[0]
+    return title, sanitize_article_html(article_html)[0]
 
 def generate_image_prompt_gpt5(api_key, article_title, style_prompt):
     prompt = f"""Jesteś art directorem. Twoim zadaniem jest stworzenie krótkiego promptu do generatora obrazów AI, łącząc temat artykułu z podanym stylem przewodnim.
@@ -486,26 +1650,185 @@ def generate_image_gemini(api_key, image_prompt, aspect_ratio="4:3"):
     except Exception as e:
         return None, f"Krytyczny błąd podczas komunikacji z API Gemini: {e}"
 
-def generate_brief_and_image(openai_api_key, google_api_key, topic, aspect_ratio, style_prompt, brief_template):
+# --- PULA PROCESÓW DLA ETAPÓW OBLICZENIOWYCH ---
+
+CPU_WORKERS = int(st.secrets.get("CPU_WORKERS", max(1, min(4, (os.cpu_count() or 2) - 1))))
+SIMHASH_PROCESS_MIN_POSTS = 200
+SIMHASH_CHUNK_POSTS = 250
+
+@st.cache_resource
+def get_cpu_pool():
+    """
+    Wspólna pula procesów dla zadań CPU (transkodowanie obrazków, odciski SimHash) - poza GIL procesu serwera,
+    więc wątki I/O i pozostałe sesje nie czekają. Start "spawn": bezpieczny w procesie z wieloma wątkami.
+    """
+    return ProcessPoolExecutor(max_workers=CPU_WORKERS, mp_context=multiprocessing.get_context("spawn"))
+
+def run_cpu_tasks(fn, calls, return_exceptions=False):
+    """
+    Wykonuje fn(*args) dla każdej krotki z calls w puli procesów i zwraca wyniki w tej samej kolejności.
+    Z return_exceptions wyjątek pojedynczego zadania trafia do wyników zamiast przerywać całość.
+    Gdy pula jest niedostępna (np. proces potomny padł), zadania wykonują się w bieżącym procesie.
+    """
+    def outcome(call):
+        try: return call()
+        except BrokenProcessPool: raise
+        except Exception as e:
+            if not return_exceptions: raise
+            return e
+
+    calls = list(calls)
     try:
-        final_brief_prompt = brief_template.replace("{{TOPIC}}", topic)
-        json_string = call_gpt5_nano(openai_api_key, final_brief_prompt).strip().replace("```json", "").replace("```", "")
-        brief_data = json.loads(json_string)
+        pool = get_cpu_pool()
+        futures = [pool.submit(fn, *args) for args in calls]
+        return [outcome(future.result) for future in futures]
+    except (BrokenProcessPool, OSError, NotImplementedError):
+        get_cpu_pool.clear()
+        return [outcome(lambda args=args: fn(*args)) for args in calls]
+
+def simhash_html_batch(contents):
+    """
+    SimHash listy treści HTML. Małe partie liczone na miejscu; duże - w puli procesów: treści trafiają raz
+    do bloku pamięci współdzielonej, a procesy dostają tylko jego nazwę i zakresy bajtów swojej porcji.
+    """
+    if len(contents) < SIMHASH_PROCESS_MIN_POSTS or CPU_WORKERS < 2:
+        return [simhash_text(html_to_text(content)) for content in contents]
+    encoded = [(content or "").encode("utf-8") for content in contents]
+    offsets, position = [], 0
+    for data in encoded:
+        offsets.append((position, position + len(data)))
+        position += len(data)
+    shm = shared_memory.SharedMemory(create=True, size=max(1, position))
+    try:
+        shm.buf[:position] = b"".join(encoded)
+        chunks = [offsets[i:i + SIMHASH_CHUNK_POSTS] for i in range(0, len(offsets), SIMHASH_CHUNK_POSTS)]
+        return [value for chunk in run_cpu_tasks(simhash_shared_html, [(shm.name, chunk) for chunk in chunks]) for value in chunk]
+    finally:
+        shm.close()
+        shm.unlink()
+
+# --- OBRAZKI: MAGAZYN NA DYSKU I PULA GENEROWANIA ---
+
+IMAGE_STORE_DIR = st.secrets.get("IMAGE_STORE_DIR", "generated_images")
+IMAGE_REQUESTS_PER_MINUTE = int(st.secrets.get("GEMINI_IMAGE_RPM", 20))
+IMAGE_WORKERS = 8
+
+class ImageStore:
+    """Obrazki na dysku, adresowane skrótem treści. W stanie sesji zostaje tylko nazwa pliku (ref), nie bajty obrazka."""
+    def __init__(self, root):
+        self.root = root
+        os.makedirs(root, exist_ok=True)
+
+    def path(self, ref):
+        return os.path.join(self.root, os.path.basename(ref))
+
+    def save(self, image_bytes, ext="png"):
+        ref = f"{hashlib.sha256(image_bytes).hexdigest()[:32]}.{ext}"
+        path = self.path(ref)
+        if not os.path.exists(path):
+            tmp_path = f"{path}.{threading.get_ident()}.tmp"
+            with open(tmp_path, "wb") as f: f.write(image_bytes)
+            os.replace(tmp_path, path)
+        return ref
+
+    def load(self, ref):
+        """Bajty obrazka lub None, jeśli plik usunięto z magazynu."""
+        try:
+            with open(self.path(ref), "rb") as f: return f.read()
+        except FileNotFoundError:
+            return None
+
+    def prepare_for_upload(self, refs, max_width=1600, quality=82):
+        """
+        Lżejsze wersje obrazków do wgrania na strony (JPEG, max_width px), liczone w puli procesów - proces potomny
+        czyta PNG i zapisuje JPEG bezpośrednio w magazynie. Zwraca {ref: ref_do_wgrania}; przy błędzie (lub gdy JPEG nie jest mniejszy) zostaje oryginał.
+        """
+        targets = {ref: f"{os.path.splitext(os.path.basename(ref))[0]}-w{max_width}q{quality}.jpg" for ref in dict.fromkeys(refs) if ref}
+        missing = [ref for ref, target in targets.items() if not os.path.exists(self.path(target)) and os.path.exists(self.path(ref))]
+        results = dict(zip(missing, run_cpu_tasks(transcode_image, [(self.path(ref), self.path(targets[ref]), max_width, quality) for ref in missing], return_exceptions=True)))
+        def smaller(ref, target):
+            return not isinstance(results.get(ref), Exception) and os.path.exists(self.path(target)) and os.path.getsize(self.path(target)) < os.path.getsize(self.path(ref))
+        return {ref: target if smaller(ref, target) else ref for ref, target in targets.items()}
+
+class RateLimiter:
+    """Przesuwne okno 60 s: acquire() blokuje wątek, dopóki w ostatniej minucie było już per_minute wywołań."""
+    def __init__(self, per_minute):
+        self.per_minute = per_minute
+        self._calls = deque()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                while self._calls and now - self._calls[0] >= 60: self._calls.popleft()
+                if len(self._calls) < self.per_minute:
+                    self._calls.append(now)
+                    return
+                delay = 60 - (now - self._calls[0])
+            time.sleep(delay)
+
+class ImageWorkerPool:
+    """
+    Wspólna pula wątków generowania obrazków Gemini z limitem wywołań na minutę osobno dla każdego klucza API.
+    Gotowy obrazek od razu trafia do ImageStore - future zwraca (ref, błąd), więc w pamięci procesu
+    jest najwyżej tyle obrazków, ile wątków pracuje w danej chwili.
+    """
+    def __init__(self, store, max_workers=IMAGE_WORKERS, per_minute=IMAGE_REQUESTS_PER_MINUTE):
+        self.store = store
+        self.per_minute = per_minute
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="gemini-images")
+        self._limiters = {}
+        self._lock = threading.Lock()
+
+    def _limiter(self, api_key):
+        key = hashlib.sha256(api_key.encode()).hexdigest()
+        with self._lock: return self._limiters.setdefault(key, RateLimiter(self.per_minute))
+
+    def _generate(self, api_key, image_prompt, aspect_ratio):
+        self._limiter(api_key).acquire()
+        image_bytes, error = generate_image_gemini(api_key, image_prompt, aspect_ratio)
+        return (self.store.save(image_bytes), None) if image_bytes else (None, error)
+
+    def submit(self, api_key, image_prompt, aspect_ratio="4:3", variants=1):
+        return [self.executor.submit(self._generate, api_key, image_prompt, aspect_ratio) for _ in range(variants)]
+
+@st.cache_resource
+def get_image_store():
+    return ImageStore(IMAGE_STORE_DIR)
+
+@st.cache_resource
+def get_image_worker_pool():
+    return ImageWorkerPool(get_image_store())
+
+def collect_image_variants(futures):
+    """Czeka na warianty jednego tematu: (lista ref, błąd lub None, gdy powstał choć jeden wariant)."""
+    refs, errors = [], []
+    for future in futures:
+        ref, error = future.result()
+        if ref: refs.append(ref)
+        else: errors.append(error)
+    return refs, (errors[0] if errors and not refs else None)
+
+def generate_brief_and_image(openai_api_key, google_api_key, topic, aspect_ratio, style_prompt, brief_template, variants=1):
+    """
+    Brief i prompt obrazka; same obrazki (variants wariantów) są zlecane puli get_image_worker_pool(),
+    więc wątek briefu na nie nie czeka. Zwraca (topic, brief, image_prompt, futures obrazków, błąd obrazka).
+    """
+    try:
+        final_brief_prompt = compile_prompt_template(brief_template).render({"TOPIC": topic})
+        brief_data = call_gpt5_nano_json(openai_api_key, final_brief_prompt, "brief")
     except Exception as e:
-        return topic, {"error": f"Błąd krytyczny podczas generowania briefu: {str(e)}"}, None, None
+        return topic, {"error": f"Błąd krytyczny podczas generowania briefu: {str(e)}"}, None, [], None
 
     try:
         image_prompt = generate_image_prompt_gpt5(openai_api_key, brief_data['temat_artykulu'], style_prompt)
-        st.info(f"Generowanie obrazka dla: {brief_data['temat_artykulu']}...")
-        st.caption(f"Prompt obrazka: {image_prompt}")
-        image_bytes, image_error = generate_image_gemini(google_api_key, image_prompt, aspect_ratio)
-        return topic, brief_data, image_bytes, image_error
     except Exception as e:
-        return topic, brief_data, None, f"Błąd podczas generowania promptu/obrazka: {e}"
+        return topic, brief_data, None, [], f"Błąd podczas generowania promptu obrazka: {e}"
+    return topic, brief_data, image_prompt, get_image_worker_pool().submit(google_api_key, image_prompt, aspect_ratio, variants), None
 
-def generate_meta_tags_gpt5(api_key, article_title, article_content, keywords):
-    try:
-        prompt = f"""Jesteś ekspertem SEO copywritingu. Przeanalizuj poniższy artykuł i stwórz do niego idealne meta tagi zoptymalizowane pod AI search.
+def build_meta_tags_prompt(article_title, article_content, keywords):
+    return f"""Jesteś ekspertem SEO copywritingu. Przeanalizuj poniższy artykuł i stwórz do niego idealne meta tagi zoptymalizowane pod AI search.
 
 Temat główny: {article_title}
 Słowa kluczowe: {", ".join(keywords)}
@@ -516,11 +1839,1067 @@ ZASADY:
 - Meta description: max 155 znaków, answer-first (bezpośrednia odpowiedź), call-to-action
 
 Zwróć odpowiedź WYŁĄCZNIE w formacie JSON z dwoma kluczami: "meta_title" i "meta_description"."""
-        
-        json_string = call_gpt5_nano(api_key, prompt).strip().replace("```json", "").replace("```", "")
-        return json.loads(json_string)
-    except Exception as e:
-        return {"meta_title": article_title[:60], "meta_description": f"Kompleksowy przewodnik: {article_title}"[:155]}
+
+def fallback_meta_tags(article_title):
+    return {"meta_title": article_title[:60], "meta_description": f"Kompleksowy przewodnik: {article_title}"[:155]}
+
+def generate_meta_tags_gpt5(api_key, article_title, article_content, keywords):
+    try:
+        return call_gpt5_nano_json(api_key, build_meta_tags_prompt(article_title, article_content, keywords), "meta_tags")
+    except Exception:
+        return fallback_meta_tags(article_title)
+
+# --- TRYB WSADOWY (OPENAI BATCH API) ---
+
+BATCH_ENDPOINT = "/v1/chat/completions"
+
+class OpenAIBatchRunner:
+    """
+    Wysyła żądania jako plik JSONL do OpenAI Batch API, sprawdza status i pobiera wyniki.
+    Przyjmuje klienta o interfejsie openai.OpenAI (files/batches), np. LocalBatchClient.
+    """
+    TERMINAL_STATUSES = {"completed", "failed", "expired", "cancelled"}
+
+    def __init__(self, client):
+        self.client = client
+
+    def submit(self, requests_by_id, description=""):
+        lines = [json.dumps({"custom_id": custom_id, "method": "POST", "url": BATCH_ENDPOINT, "body": body}, ensure_ascii=False) for custom_id, body in requests_by_id.items()]
+        input_file = self.client.files.create(file=("batch.jsonl", "\n".join(lines).encode("utf-8")), purpose="batch")
+        batch = self.client.batches.create(input_file_id=input_file.id, endpoint=BATCH_ENDPOINT, completion_window="24h", metadata={"description": description[:500]})
+        return batch.id
+
+    def retrieve(self, batch_id):
+        return self.client.batches.retrieve(batch_id)
+
+    def results(self, batch):
+        """Zwraca {custom_id: (treść, błąd)} dla zakończonego zadania."""
+        results = {}
+        for file_id in (batch.output_file_id, batch.error_file_id):
+            if not file_id: continue
+            for line in self.client.files.content(file_id).text.splitlines():
+                if not line.strip(): continue
+                item = json.loads(line)
+                response = item.get("response") or {}
+                if item.get("error") or response.get("status_code") != 200:
+                    results[item["custom_id"]] = (None, str(item.get("error") or response.get("body")))
+                else:
+                    results[item["custom_id"]] = (response["body"]["choices"][0]["message"]["content"], None)
+        return results
+
+class LocalBatchClient:
+    """
+    Lokalny zamiennik klienta OpenAI dla Batch API, działający bez sieci - do testów i pracy deweloperskiej.
+    Każde żądanie obsługuje funkcja responder(body) -> treść odpowiedzi; zadanie kończy się od razu.
+    """
+    def __init__(self, responder):
+        self._responder = responder
+        self._files = {}
+        self._batches = {}
+        self.files = SimpleNamespace(create=self._create_file, content=lambda file_id: SimpleNamespace(text=self._files[file_id]))
+        self.batches = SimpleNamespace(create=self._create_batch, retrieve=lambda batch_id: self._batches[batch_id])
+
+    def _create_file(self, file, purpose):
+        file_id = f"file-local-{len(self._files) + 1}"
+        self._files[file_id] = file[1].decode("utf-8")
+        return SimpleNamespace(id=file_id)
+
+    def _create_batch(self, input_file_id, endpoint, completion_window, metadata=None):
+        output = []
+        for line in self._files[input_file_id].splitlines():
+            request = json.loads(line)
+            try:
+                body = {"choices": [{"message": {"content": self._responder(request["body"])}}]}
+                output.append({"custom_id": request["custom_id"], "response": {"status_code": 200, "body": body}, "error": None})
+            except Exception as e:
+                output.append({"custom_id": request["custom_id"], "response": None, "error": {"message": str(e)}})
+        output_file = self._create_file(("output.jsonl", "\n".join(json.dumps(o) for o in output).encode("utf-8")), "batch_output")
+        batch = SimpleNamespace(id=f"batch-local-{len(self._batches) + 1}", status="completed", output_file_id=output_file.id, error_file_id=None)
+        self._batches[batch.id] = batch
+        return batch
+
+def new_batch_job(runner, kind, items, requests_by_id, **settings):
+    """Wysyła zadanie wsadowe i zwraca jego opis do przechowania w stanie sesji."""
+    batch_id = runner.submit(requests_by_id, description=f"PBN Manager: {kind} ({len(items)})")
+    return {"id": batch_id, "kind": kind, "status": "validating", "created": datetime.now().strftime('%Y-%m-%d %H:%M'), "items": items, "settings": settings, "done": False}
+
+def submit_brief_batch(runner, topics, brief_template, aspect_ratio, style_prompt, image_variants=1):
+    template = compile_prompt_template(brief_template)
+    items = {f"brief-{i}": {"topic": topic} for i, topic in enumerate(topics)}
+    requests_by_id = {cid: build_chat_request(template.render({"TOPIC": item["topic"]}), schema_name="brief") for cid, item in items.items()}
+    return new_batch_job(runner, "brief", items, requests_by_id, aspect_ratio=aspect_ratio, style_prompt=style_prompt, image_variants=image_variants)
+
+def submit_article_batch(runner, tasks, system_prompt):
+    items = {f"article-{i}": task for i, task in enumerate(tasks)}
+    requests_by_id = {cid: build_chat_request(task['prompt'], system_prompt) for cid, task in items.items()}
+    return new_batch_job(runner, "article", items, requests_by_id)
+
+def submit_meta_batch(runner, articles):
+    items = {f"meta-{i}": article for i, article in enumerate(articles)}
+    requests_by_id = {cid: build_chat_request(build_meta_tags_prompt(a['title'], a['content'], a['keywords']), schema_name="meta_tags") for cid, a in items.items()}
+    return new_batch_job(runner, "meta", items, requests_by_id)
+
+def ingest_batch_job(runner, job, openai_api_key, google_api_key):
+    """
+    Sprawdza status zadania i po zakończeniu przetwarza wyniki.
+    Zwraca (briefy, artykuły, kolejne_zadanie): briefy i artykuły gotowe do dopisania do stanu sesji,
+    a dla artykułów - zadanie wsadowe z meta tagami, które trzeba jeszcze wykonać.
+    """
+    batch = runner.retrieve(job['id'])
+    job['status'] = batch.status
+    if batch.status not in runner.TERMINAL_STATUSES: return [], [], None
+    job['done'] = True
+    results = runner.results(batch) if batch.status == "completed" else {}
+    briefs, articles, next_job = [], [], None
+
+    if job['kind'] == "brief":
+        image_jobs = []
+        for cid, item in job['items'].items():
+            content, error = results.get(cid, (None, f"Zadanie wsadowe zakończone statusem '{batch.status}'"))
+            try:
+                if error: raise ValueError(error)
+                brief = repair_structured_json(openai_api_key, content, "brief")
+            except Exception as e:
+                briefs.append({"topic": item['topic'], "brief": {"error": f"Błąd krytyczny podczas generowania briefu: {e}"}, "image": None, "image_error": None})
+                continue
+            entry = {"topic": item['topic'], "brief": brief, "image": None, "image_variants": [], "image_error": None}
+            briefs.append(entry)
+            if google_api_key:
+                try:
+                    image_prompt = generate_image_prompt_gpt5(openai_api_key, brief.get('temat_artykulu', item['topic']), job['settings'].get('style_prompt', ''))
+                    image_jobs.append((entry, get_image_worker_pool().submit(google_api_key, image_prompt, job['settings'].get('aspect_ratio', "4:3"), job['settings'].get('image_variants', 1))))
+                except Exception as e:
+                    entry['image_error'] = f"Błąd podczas generowania promptu/obrazka: {e}"
+        for entry, futures in image_jobs:
+            entry['image_variants'], entry['image_error'] = collect_image_variants(futures)
+            entry['image'] = entry['image_variants'][0] if entry['image_variants'] else None
+
+    elif job['kind'] == "article":
+        pending = []
+        for cid, task in job['items'].items():
+            content, error = results.get(cid, (None, f"Zadanie wsadowe zakończone statusem '{batch.status}'"))
+            html = sanitize_article_html(content)[0] if content else f"<p><strong>BŁĄD KRYTYCZNY podczas generowania artykułu:</strong> {error}</p>"
+            pending.append({"title": task['title'], "content": html, "image": task['image'], "keywords": task['keywords']})
+        if pending: next_job = submit_meta_batch(runner, pending)
+
+    elif job['kind'] == "meta":
+        for cid, article in job['items'].items():
+            content, error = results.get(cid, (None, "brak wyniku"))
+            try:
+                meta = repair_structured_json(openai_api_key, content, "meta_tags") if content else fallback_meta_tags(article['title'])
+            except Exception:
+                meta = fallback_meta_tags(article['title'])
+            articles.append({"title": article['title'], "content": article['content'], "image": article['image'], "structure": summarize_article_structure(sanitize_article_html(article['content'])[1]), **meta})
+
+    return briefs, articles, next_job
+
+# --- PUNKTY KONTROLNE GENEROWANIA (WZNAWIANIE PRZERWANYCH PARTII) ---
+
+def checkpoint_key(*parts):
+    """Stabilny klucz elementu z jego danych wejściowych - te same dane po restarcie dają ten sam klucz."""
+    return hashlib.sha256(json.dumps(parts, ensure_ascii=False, sort_keys=True, default=str).encode("utf-8")).hexdigest()[:32]
+
+class GenerationCheckpoints:
+    """
+    Gotowe briefy, artykuły i zadania wsadowe zapisywane w trwałej bazie zaraz po ukończeniu - każdy w osobnej, krótkiej transakcji.
+    Partia (run_id) to skrót kluczy jej elementów: ponowne uruchomienie tej samej partii po awarii, redeployu czy przypadkowym
+    kliknięciu powtarza tylko elementy bez punktu kontrolnego. Obrazki są już na dysku (ImageStore), tu trafiają tylko ich refy.
+    """
+    def __init__(self, conn, lock):
+        self.conn = conn
+        self.lock = lock
+
+    @staticmethod
+    def run_id(keys):
+        return checkpoint_key(sorted(keys))
+
+    def save(self, kind, run_id, key, payload):
+        with self.lock, self.conn:
+            self.conn.execute("INSERT OR REPLACE INTO generation_checkpoints VALUES (?, ?, ?, ?, ?)", (kind, run_id, key, json.dumps(payload, ensure_ascii=False), datetime.now().isoformat(timespec="seconds")))
+
+    def load(self, kind, run_id=None):
+        """{klucz: payload} dla partii run_id (domyślnie - ostatnio zapisywanej partii danego rodzaju), w kolejności zapisu."""
+        if run_id is None:
+            row = self.conn.execute("SELECT run_id FROM generation_checkpoints WHERE kind = ? ORDER BY saved_at DESC, rowid DESC LIMIT 1", (kind,)).fetchone()
+            if not row: return {}
+            run_id = row[0]
+        rows = self.conn.execute("SELECT item_key, payload FROM generation_checkpoints WHERE kind = ? AND run_id = ? ORDER BY rowid", (kind, run_id)).fetchall()
+        return {key: json.loads(payload) for key, payload in rows}
+
+    def get(self, kind, run_id, key):
+        row = self.conn.execute("SELECT payload FROM generation_checkpoints WHERE kind = ? AND run_id = ? AND item_key = ?", (kind, run_id, key)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def discard(self, kind, run_id=None):
+        with self.lock, self.conn:
+            if run_id is None: self.conn.execute("DELETE FROM generation_checkpoints WHERE kind = ?", (kind,))
+            else: self.conn.execute("DELETE FROM generation_checkpoints WHERE kind = ? AND run_id = ?", (kind, run_id))
+
+@st.cache_resource
+def get_generation_checkpoints():
+    return GenerationCheckpoints(get_data_db_connection(), get_data_db_lock())
+
+def brief_checkpoint_key(topic, brief_prompt, aspect_ratio, style_prompt, image_variants):
+    return checkpoint_key("brief", topic, brief_prompt, aspect_ratio, style_prompt, image_variants)
+
+def article_checkpoint_key(task, system_prompt, sectioned):
+    return checkpoint_key("article", task['title'], task['prompt'], system_prompt, sectioned)
+
+BATCH_JOBS_RUN_ID = "batch_jobs"
+
+def checkpoint_batch_job(job, operator, briefs=(), articles=()):
+    """
+    Zadanie wsadowe (ID, status, elementy) i pobrane z niego wyniki - po restarcie panel nadal zna zadania w toku,
+    a inni operatorzy widzą je i mogą przejąć gotowe wyniki bez ponownego pobierania.
+    """
+    checkpoints = get_generation_checkpoints()
+    checkpoints.save("batch_job", BATCH_JOBS_RUN_ID, job['id'], job)
+    for kind, items in (("brief", briefs), ("article", articles)):
+        for n, item in enumerate(items): checkpoints.save(kind, job['id'], str(n), item)
+    with get_shared_workspace().transaction(operator, "batch_jobs"): pass
+
+# --- LOKALNE GRUPOWANIE TYTUŁÓW (PRE-KLASTERYZACJA) ---
+
+# Poniżej tego progu wszystkie tytuły trafiają do AI w jednym prompcie (jak dotychczas)
+SINGLE_PASS_TITLE_LIMIT = 150
+TITLE_HASH_FEATURES = 1024
+STOPWORDS_PL = frozenset("jak czy dla oraz przez jest się nie które który która jakie jaki jaka ich jego lub albo czym kiedy gdzie ile można warto co to po od do na ze we za pod nad przy bez the and for".split())
+
+def tokenize_title(title):
+    return [w for w in re.findall(r"\w+", title.lower()) if len(w) > 2 and w not in STOPWORDS_PL and not w.isdigit()]
+
+def vectorize_titles(titles, n_features=TITLE_HASH_FEATURES):
+    """Wektory TF-IDF na haszowanych słowach i bigramach (bez słownika), znormalizowane L2. Zwraca macierz float32 n x n_features."""
+    rows, cols = [], []
+    for i, title in enumerate(titles):
+        words = tokenize_title(title)
+        for feature in words + [f"{a} {b}" for a, b in zip(words, words[1:])]:
+            rows.append(i)
+            cols.append(zlib.crc32(feature.encode()) % n_features)
+    X = np.zeros((len(titles), n_features), dtype=np.float32)
+    if rows: np.add.at(X, (np.array(rows), np.array(cols)), 1.0)
+    df = np.count_nonzero(X, axis=0)
+    X *= (np.log((1 + len(titles)) / (1 + df)) + 1).astype(np.float32)
+    norms = np.linalg.norm(X, axis=1, keepdims=True)
+    return X / np.where(norms == 0, 1, norms)
+
+def spherical_kmeans(X, k, iterations=25, seed=0):
+    """K-means na wektorach znormalizowanych (podobieństwo kosinusowe), inicjalizacja k-means++. Zwraca (etykiety, centroidy)."""
+    rng = np.random.default_rng(seed)
+    n = X.shape[0]
+    centers = [X[rng.integers(n)]]
+    distance = 1 - X @ centers[0]
+    for _ in range(1, k):
+        weights = np.clip(distance, 0, None)
+        idx = rng.choice(n, p=weights / weights.sum()) if weights.sum() > 0 else rng.integers(n)
+        centers.append(X[idx])
+        distance = np.minimum(distance, 1 - X @ X[idx])
+    C = np.stack(centers)
+    labels = np.argmax(X @ C.T, axis=1)
+    for _ in range(iterations):
+        membership = np.zeros((k, n), dtype=np.float32)
+        membership[labels, np.arange(n)] = 1
+        new_C = membership @ X
+        norms = np.linalg.norm(new_C, axis=1, keepdims=True)
+        new_C = np.where(norms > 0, new_C / np.where(norms == 0, 1, norms), C)
+        new_labels = np.argmax(X @ new_C.T, axis=1)
+        C = new_C
+        if np.array_equal(new_labels, labels): break
+        labels = new_labels
+    return labels, C
+
+def build_title_groups(titles, max_groups=20, representatives=25):
+    """
+    Dzieli tytuły na grupy tematyczne lokalnie (bez AI).
+    Zwraca listę słowników: size, keywords (najczęstsze słowa), titles (reprezentatywne, wybrane równomiernie wg podobieństwa do centroidu).
+    Małe strony (do SINGLE_PASS_TITLE_LIMIT) dają jedną grupę ze wszystkimi tytułami.
+    """
+    titles = list(dict.fromkeys(t.strip() for t in titles if t.strip()))
+    if len(titles) <= SINGLE_PASS_TITLE_LIMIT:
+        return [{"size": len(titles), "keywords": [], "titles": titles}]
+    X = vectorize_titles(titles)
+    k = int(min(max_groups, max(2, round((len(titles) / 2) ** 0.5))))
+    labels, C = spherical_kmeans(X, k)
+    groups = []
+    for j in range(k):
+        members = np.flatnonzero(labels == j)
+        if not len(members): continue
+        # Równomiernie z rankingu podobieństwa do centroidu - rdzeń grupy i jej obrzeża
+        ranked = members[np.argsort(-(X[members] @ C[j]))]
+        closest = ranked[np.unique(np.linspace(0, len(ranked) - 1, min(representatives, len(ranked))).astype(int))]
+        word_counts = pd.Series([w for i in members for w in tokenize_title(titles[i])]).value_counts()
+        groups.append({"size": len(members), "keywords": word_counts.index[:8].tolist(), "titles": [titles[i] for i in closest]})
+    return sorted(groups, key=lambda g: -g["size"])
+
+def format_title_group(group):
+    """Treść zmiennej {{TYTULY_ARTYKULOW}} dla jednej grupy: krótkie podsumowanie + reprezentatywne tytuły."""
+    lines = [f"- {t}" for t in group["titles"]]
+    if group["size"] > len(group["titles"]):
+        lines.insert(0, f"(Grupa {group['size']} artykułów; najczęstsze słowa: {', '.join(group['keywords'])}. Poniżej {len(group['titles'])} reprezentatywnych tytułów.)")
+    return "\n".join(lines)
+
+def analyze_title_groups(api_key, groups, cluster_template, max_workers=5):
+    """Analizuje grupy równolegle (jedno wywołanie AI na grupę). Zwraca (klastry, błędy)."""
+    template = compile_prompt_template(cluster_template)
+    clusters, errors = [], []
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {executor.submit(call_gpt5_nano_json, api_key, template.render({"TYTULY_ARTYKULOW": format_title_group(g)}), "clusters"): i for i, g in enumerate(groups)}
+        results = {}
+        for future in as_completed(futures):
+            try: results[futures[future]] = unwrap_cluster_result(future.result())
+            except Exception as e: errors.append(f"Nie udało się przeanalizować grupy {futures[future] + 1}: {e}")
+    for i in sorted(results): clusters.extend(results[i])
+    if not clusters and errors: raise StructuredOutputError(errors[0])
+    return clusters, errors
+
+# --- WYKRYWANIE NEAR-DUPLIKATÓW TEMATÓW (MINHASH + LSH) ---
+
+class MinHashIndex:
+    """
+    Indeks podobieństwa tytułów: MinHash na 3-gramach znakowych + LSH (pasma sygnatur).
+    Na tytuł przypada num_perm liczb uint32, a zapytanie porównuje tylko kandydatów z tych samych kubełków LSH,
+    więc indeks skaluje się do dziesiątek tysięcy wpisów z całej sieci.
+    Wynik podobieństwa to szacowany współczynnik nakładania |A∩B| / min(|A|, |B|), odporny na dopiski typu "kompletny przewodnik".
+    """
+    _PRIME = np.uint64((1 << 31) - 1)
+
+    def __init__(self, num_perm=60, bands=20, ngram=3, seed=1):
+        rng = np.random.default_rng(seed)
+        self._a = rng.integers(1, (1 << 31) - 1, num_perm, dtype=np.uint64)
+        self._b = rng.integers(0, (1 << 31) - 1, num_perm, dtype=np.uint64)
+        self._rows = num_perm // bands
+        self._bands = bands
+        self._ngram = ngram
+        self._buckets = [{} for _ in range(bands)]
+        self._signatures = []
+        self._sizes = []
+        self._matrix = None
+        self.titles = []
+        self.sources = []
+        self.indexed_sources = set()
+
+    def __len__(self):
+        return len(self.titles)
+
+    def _shingles(self, text):
+        text = " " + re.sub(r"[^\w]+", " ", text.lower()).strip() + " "
+        return {text[i:i + self._ngram] for i in range(max(1, len(text) - self._ngram + 1))}
+
+    def signature(self, text):
+        shingles = self._shingles(text)
+        x = np.fromiter((zlib.crc32(s.encode()) for s in shingles), dtype=np.uint64, count=len(shingles))
+        return ((self._a[:, None] * x[None, :] + self._b[:, None]) % self._PRIME).min(axis=1).astype(np.uint32), len(shingles)
+
+    def _band_keys(self, signature):
+        return [signature[i * self._rows:(i + 1) * self._rows].tobytes() for i in range(self._bands)]
+
+    def add(self, title, source=""):
+        signature, size = self.signature(title)
+        idx = len(self.titles)
+        for band, key in zip(self._buckets, self._band_keys(signature)):
+            band.setdefault(key, []).append(idx)
+        self._signatures.append(signature)
+        self._sizes.append(size)
+        self._matrix = None
+        self.titles.append(title)
+        self.sources.append(source)
+
+    def add_many(self, titles, source=""):
+        for title in titles: self.add(title, source)
+        self.indexed_sources.add(source)
+
+    def best_match(self, text):
+        """Zwraca (wynik, tytuł, źródło) najbardziej podobnego tytułu lub None, jeśli LSH nie wskazał kandydatów."""
+        if not self.titles: return None
+        signature, size = self.signature(text)
+        candidates = set()
+        for band, key in zip(self._buckets, self._band_keys(signature)):
+            candidates.update(band.get(key, ()))
+        if not candidates: return None
+        if self._matrix is None: self._matrix = np.stack(self._signatures)
+        idx = np.fromiter(candidates, dtype=np.int64, count=len(candidates))
+        jaccard = (self._matrix[idx] == signature).mean(axis=1)
+        sizes = np.asarray(self._sizes)[idx]
+        overlap = jaccard / (1 + jaccard) * (sizes + size) / np.minimum(sizes, size)
+        best = int(np.argmax(overlap))
+        return float(min(overlap[best], 1.0)), self.titles[idx[best]], self.sources[idx[best]]
+
+NEAR_DUPLICATE_THRESHOLD = 0.75
+
+def filter_near_duplicate_topics(topics, index=None, queued=(), threshold=NEAR_DUPLICATE_THRESHOLD):
+    """
+    Odrzuca tematy zbliżone do istniejących wpisów (index), tematów już w kolejce (queued) i siebie nawzajem.
+    Zwraca (zachowane, odrzucone), gdzie odrzucone to lista (temat, podobny_tytuł, źródło, wynik).
+    """
+    pending = MinHashIndex()
+    pending.add_many(queued, "kolejka")
+    kept, rejected = [], []
+    for topic in dict.fromkeys(t.strip() for t in topics if t.strip()):
+        matches = [m for m in (index.best_match(topic) if index else None, pending.best_match(topic)) if m]
+        best = max(matches, default=None)
+        if best and best[0] >= threshold:
+            rejected.append((topic, best[1], best[2], best[0]))
+        else:
+            kept.append(topic)
+            pending.add(topic, "nowe tematy")
+    return kept, rejected
+
+def touch_post_titles(conn, site_url):
+    """Znacznik zmiany tytułów strony w post_index - NetworkTitleIndex przebudowuje tylko strony ze zmienionym znacznikiem."""
+    conn.execute("INSERT OR REPLACE INTO sync_state VALUES (?, 'titles', ?)", (site_url, datetime.now().isoformat()))
+
+def store_post_titles(conn, site_url, posts):
+    """Dopisuje tytuły wpisów (id, title.rendered, opcjonalnie date) do post_index bez zmiany stanu liczników. Wywoływać w transakcji."""
+    conn.executemany("INSERT INTO post_index (site_url, post_id, date, title) VALUES (?, ?, ?, ?) ON CONFLICT (site_url, post_id) DO UPDATE SET title = excluded.title",
+                     [(site_url, p['id'], (p.get('date') or '')[:19] or None, html_unescape(p['title']['rendered'])) for p in posts if p.get('title')])
+    touch_post_titles(conn, site_url)
+
+class NetworkTitleIndex:
+    """
+    Tytuły wpisów całej sieci z post_index (Strateg Tematyczny, synchronizacja Dashboardu, webhook) - dostępne od pierwszego
+    przebiegu każdej sesji. Osobny MinHashIndex na stronę; refresh() przebudowuje tylko strony, których tytuły się zmieniły.
+    """
+    def __init__(self, conn):
+        self.conn = conn
+        self._sites = {}
+        self._lock = threading.Lock()
+
+    def refresh(self):
+        stamps = dict(self.conn.execute("SELECT site_url, synced_until FROM sync_state WHERE kind = 'titles'").fetchall())
+        with self._lock:
+            for site_url in self._sites.keys() - stamps.keys(): del self._sites[site_url]
+            for site_url, stamp in stamps.items():
+                if site_url in self._sites and self._sites[site_url][0] == stamp: continue
+                index = MinHashIndex()
+                index.add_many([title for (title,) in self.conn.execute("SELECT title FROM post_index WHERE site_url = ? AND title != '' AND (status IS NULL OR status IN ('publish', 'future'))", (site_url,))], site_url)
+                self._sites[site_url] = (stamp, index)
+        return self
+
+    def __len__(self):
+        return sum(len(index) for _, index in self._sites.values())
+
+    def best_match(self, text):
+        matches = [match for _, index in list(self._sites.values()) if (match := index.best_match(text))]
+        return max(matches, default=None)
+
+@st.cache_resource
+def get_title_index():
+    return NetworkTitleIndex(get_data_db_connection())
+
+# --- ODCISKI TREŚCI W SIECI (SIMHASH) ---
+
+SIMHASH_MAX_DISTANCE = 3
+
+def _to_signed64(value):
+    """SQLite przechowuje INTEGER jako liczbę ze znakiem."""
+    return value - (1 << 64) if value >= (1 << 63) else value
+
+def _simhash_bands(value):
+    """Cztery 16-bitowe pasma; dwa odciski w odległości <= 3 bitów mają co najmniej jedno wspólne pasmo."""
+    return [(value >> (16 * i)) & 0xFFFF for i in range(4)]
+
+class ContentFingerprintIndex:
+    """
+    Trwały indeks odcisków SimHash treści wpisów per strona.
+    Wyszukiwanie po pasmach z indeksem SQLite - koszt zapytania nie rośnie z liczbą wpisów w sieci.
+    """
+    def __init__(self, conn, lock):
+        self.conn = conn
+        self.lock = lock
+
+    def upsert_posts(self, site_url, posts):
+        rows = []
+        simhashes = simhash_html_batch([p.get('content', {}).get('rendered', '') for p in posts])
+        for p, value in zip(posts, simhashes):
+            # Wpis bez słów (pusty, same znaczniki) nie ma odcisku - NULL nie trafia do wyszukiwania po pasmach.
+            fingerprint = (None,) * 5 if value is None else (_to_signed64(value), *_simhash_bands(value))
+            rows.append((site_url, p['id'], html_unescape(p.get('title', {}).get('rendered', '')), p.get('link'), *fingerprint, p.get('modified')))
+        with self.lock, self.conn:
+            self.conn.executemany("INSERT OR REPLACE INTO content_fingerprints VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", rows)
+        return len(rows)
+
+    def record(self, site_url, post_id, title, content_html, link=None):
+        self.upsert_posts(site_url, [{"id": post_id, "title": {"rendered": title}, "content": {"rendered": content_html}, "link": link, "modified": datetime.now().isoformat()}])
+
+    def find_similar(self, content_html=None, simhash=None, max_distance=SIMHASH_MAX_DISTANCE):
+        """Zwraca listę (site_url, post_id, tytuł, link, odległość) wpisów o treści prawie identycznej."""
+        value = simhash if simhash is not None else simhash_text(html_to_text(content_html))
+        if value is None: return []
+        bands = _simhash_bands(value)
+        rows = self.conn.execute("SELECT site_url, post_id, title, link, simhash FROM content_fingerprints WHERE band0 = ? OR band1 = ? OR band2 = ? OR band3 = ?", bands).fetchall()
+        matches = [(site, pid, title, link, bin((h & 0xFFFFFFFFFFFFFFFF) ^ value).count("1")) for site, pid, title, link, h in rows]
+        return sorted((m for m in matches if m[4] <= max_distance), key=lambda m: m[4])
+
+    def duplicate_pairs(self, max_distance=SIMHASH_MAX_DISTANCE, cross_site_only=False):
+        """Wszystkie pary wpisów o prawie identycznej treści w całej sieci (kandydaci z pasm, weryfikacja odległości Hamminga)."""
+        pairs = {}
+        for band in range(4):
+            rows = self.conn.execute(f"SELECT band{band}, site_url, post_id, title, simhash FROM content_fingerprints WHERE band{band} IN (SELECT band{band} FROM content_fingerprints WHERE band{band} IS NOT NULL GROUP BY band{band} HAVING COUNT(*) > 1) ORDER BY band{band}").fetchall()
+            buckets = {}
+            for band_value, *row in rows: buckets.setdefault(band_value, []).append(row)
+            for rows in buckets.values():
+                for i, a in enumerate(rows):
+                    for b in rows[i + 1:]:
+                        if cross_site_only and a[0] == b[0]: continue
+                        distance = bin((a[3] ^ b[3]) & 0xFFFFFFFFFFFFFFFF).count("1")
+                        if distance <= max_distance: pairs[tuple(sorted([(a[0], a[1]), (b[0], b[1])]))] = (a, b, distance)
+        return [{"Strona A": a[0], "ID A": a[1], "Tytuł A": a[2], "Strona B": b[0], "ID B": b[1], "Tytuł B": b[2], "Odległość": d} for a, b, d in pairs.values()]
+
+    def site_counts(self):
+        return dict(self.conn.execute("SELECT site_url, COUNT(*) FROM content_fingerprints GROUP BY site_url").fetchall())
+
+def get_sync_state(conn, site_url, kind):
+    row = conn.execute("SELECT synced_until FROM sync_state WHERE site_url = ? AND kind = ?", (site_url, kind)).fetchone()
+    return row[0] if row else None
+
+def set_sync_state(conn, site_url, kind, synced_until):
+    with get_data_db_lock(), conn:
+        conn.execute("INSERT OR REPLACE INTO sync_state VALUES (?, ?, ?)", (site_url, kind, synced_until))
+
+def sync_site_fingerprints(index, api, site_url):
+    """Przyrostowa synchronizacja odcisków jednej strony (tylko wpisy zmienione od ostatniej synchronizacji)."""
+    since = get_sync_state(index.conn, site_url, "fingerprints")
+    posts = api.get_posts_for_sync(modified_after=since)
+    count = index.upsert_posts(site_url, posts)
+    if posts: set_sync_state(index.conn, site_url, "fingerprints", max(p['modified'] for p in posts))
+    return count
+
+# --- PLANOWANIE PUBLIKACJI (SLOTY PER STRONA) ---
+
+def plan_publication_schedule(article_ids, site_names, start, interval_hours, existing_by_site=None, max_per_day=0, jitter_minutes=0, seed=None):
+    """
+    Rozkłada publikacje (artykuł x strona) na wolne sloty każdej strony osobno, zanim cokolwiek zostanie wysłane.
+    - odstęp interval_hours obowiązuje także względem już zaplanowanych wpisów strony (existing_by_site),
+    - max_per_day > 0 ogranicza liczbę wpisów danego dnia (wliczając istniejące), nadmiar przechodzi na kolejny dzień,
+    - jitter_minutes losowo przesuwa każdą publikację, więc strony nie dostają identycznych godzin; odstęp i limit dzienny
+      sprawdzane są już dla przesuniętej godziny, więc losowanie nigdy nie skraca odstępu poniżej interval_hours.
+    Zwraca listę {"article": id, "site": nazwa, "publish_at": datetime} posortowaną po czasie.
+    """
+    rng = random.Random(seed)
+    interval = timedelta(hours=interval_hours)
+    jitter = timedelta(minutes=jitter_minutes)
+    to_minute = lambda t: (t + timedelta(seconds=59, microseconds=999999)).replace(second=0, microsecond=0)
+    plan = []
+    for site in site_names:
+        occupied = sorted((existing_by_site or {}).get(site, []))
+        per_day = Counter(t.date() for t in occupied)
+        slot = start + rng.random() * jitter
+        for article in article_ids:
+            publish_at = to_minute(max(start, slot + (rng.random() * 2 - 1) * jitter))
+            while True:
+                if max_per_day and per_day[publish_at.date()] >= max_per_day:
+                    publish_at = to_minute(datetime.combine(publish_at.date() + timedelta(days=1), start.time()) + rng.random() * jitter)
+                    continue
+                i = bisect_right(occupied, publish_at - interval)
+                if i < len(occupied) and occupied[i] < publish_at + interval:
+                    publish_at = to_minute(occupied[i] + interval)
+                    continue
+                break
+            insort(occupied, publish_at)
+            per_day[publish_at.date()] += 1
+            plan.append({"article": article, "site": site, "publish_at": publish_at})
+            slot = max(slot, publish_at) + interval
+    return sorted(plan, key=lambda p: p["publish_at"])
+
+# --- ZAGREGOWANE STATYSTYKI PUBLIKACJI (DZIENNE LICZNIKI PER STRONA) ---
+
+ROLLUP_HISTORY_DAYS = 90
+
+def sync_daily_post_counts(conn, api, site_url):
+    """
+    Przyrostowo dopisuje dzienne liczby publikacji strony: pobiera tylko wpisy nowsze niż ostatnio zliczony.
+    Przy pierwszym uruchomieniu - ostatnie ROLLUP_HISTORY_DAYS dni.
+    """
+    since = get_sync_state(conn, site_url, "daily_counts")
+    start = datetime.fromisoformat(since) if since else datetime.now() - timedelta(days=ROLLUP_HISTORY_DAYS)
+    posts = api.get_all_posts_since(start, fields="id,date,title.rendered")
+    if not posts: return 0
+    with get_data_db_lock(), conn:
+        # Wpisy już policzone (np. ze zdarzeń webhooka) są pomijane - przebieg jest idempotentny względem post_index
+        counted = {post_id for (post_id,) in conn.execute("SELECT post_id FROM post_index WHERE site_url = ? AND status = 'publish'", (site_url,))}
+        new_posts = [p for p in posts if p['id'] not in counted]
+        counts = Counter(p['date'][:10] for p in new_posts)
+        conn.executemany("INSERT INTO post_daily_counts VALUES (?, ?, ?) ON CONFLICT (site_url, day) DO UPDATE SET count = count + excluded.count", [(site_url, day, count) for day, count in counts.items()])
+        conn.executemany("INSERT INTO post_index (site_url, post_id, status, date) VALUES (?, ?, 'publish', ?) ON CONFLICT (site_url, post_id) DO UPDATE SET status = 'publish', date = excluded.date", [(site_url, p['id'], p['date'][:19]) for p in new_posts])
+        store_post_titles(conn, site_url, posts)
+        conn.execute("INSERT OR REPLACE INTO sync_state VALUES (?, ?, ?)", (site_url, "daily_counts", max(p['date'] for p in posts)))
+    return len(new_posts)
+
+def reset_daily_post_counts(conn):
+    """Czyści agregaty - kolejna synchronizacja przebuduje je od zera (np. po usunięciu wpisów)."""
+    with get_data_db_lock(), conn:
+        conn.execute("DELETE FROM post_daily_counts")
+        conn.execute("UPDATE post_index SET status = NULL WHERE status = 'publish'")
+        conn.execute("DELETE FROM sync_state WHERE kind = 'daily_counts'")
+
+def load_daily_post_counts(conn, days, site_urls):
+    """Tabela dzień x strona z ostatnich `days` dni (brakujące dni jako 0) - odczyt z agregatów, bez zapytań do stron."""
+    start = date.today() - timedelta(days=days - 1)
+    placeholders = ",".join("?" * len(site_urls))
+    df = pd.DataFrame(conn.execute(f"SELECT site_url, day, count FROM post_daily_counts WHERE day >= ? AND site_url IN ({placeholders})", [start.isoformat(), *site_urls]).fetchall(), columns=["site_url", "day", "count"])
+    table = df.pivot_table(index="day", columns="site_url", values="count", aggfunc="sum", fill_value=0) if not df.empty else pd.DataFrame()
+    table.index = pd.to_datetime(table.index).date if not table.empty else table.index
+    return table.reindex(index=pd.date_range(start=start, end=date.today()).date, columns=site_urls, fill_value=0).fillna(0).astype(int)
+
+# --- STATYSTYKI STRON (STALE-WHILE-REVALIDATE) ---
+
+class SiteStatsService:
+    """
+    Statystyki stron serwowane od razu z ostatnio zapisanych wartości (tabela site_stats),
+    a odświeżane w tle - równolegle dla wszystkich stron, których dane są starsze niż max_age.
+    Czas renderowania dashboardu nie zależy więc od liczby stron.
+    """
+    def __init__(self, conn, lock, max_workers=8):
+        self.conn = conn
+        self.lock = lock
+        self._executor = ThreadPoolExecutor(max_workers=max_workers)
+        self._in_flight = set()
+        self._in_flight_lock = threading.Lock()
+
+    def read(self, site_urls):
+        if not site_urls: return {}
+        placeholders = ",".join("?" * len(site_urls))
+        rows = self.conn.execute(f"SELECT site_url, total_posts, last_post_date, fetched_at FROM site_stats WHERE site_url IN ({placeholders})", list(site_urls)).fetchall()
+        return {url: {"total_posts": total, "last_post_date": last, "fetched_at": fetched} for url, total, last, fetched in rows}
+
+    @property
+    def refreshing(self):
+        return len(self._in_flight)
+
+    def refresh_in_background(self, credentials, max_age=600, force=False):
+        """credentials: lista (url, login, hasło). Zleca odświeżenie nieaktualnych stron i wraca natychmiast."""
+        known = self.read([url for url, _, _ in credentials])
+        threshold = (datetime.now() - timedelta(seconds=max_age)).isoformat()
+        for url, username, password in credentials:
+            if not force and url in known and known[url]["fetched_at"] >= threshold: continue
+            with self._in_flight_lock:
+                if url in self._in_flight: continue
+                self._in_flight.add(url)
+            self._executor.submit(self._refresh_site, url, username, password)
+
+    def _refresh_site(self, url, username, password):
+        try:
+            stats = WordPressAPI(url, username, password).get_stats(display_error=False)
+            with self.lock, self.conn:
+                self.conn.execute("INSERT OR REPLACE INTO site_stats VALUES (?, ?, ?, ?)", (url, str(stats['total_posts']), stats['last_post_date'], datetime.now().isoformat(timespec="seconds")))
+        finally:
+            with self._in_flight_lock:
+                self._in_flight.discard(url)
+
+@st.cache_resource
+def get_site_stats_service():
+    return SiteStatsService(get_data_db_connection(), get_data_db_lock())
+
+# --- MONITOR STANU FLOTY STRON ---
+
+HEALTH_CHECK_INTERVAL = 300
+HEALTH_FAILURE_THRESHOLD = 2
+HEALTH_RECHECK_DELAY = 60
+SITE_LIST_PAGE_SIZE = 25
+HEALTH_STATUS_LABELS = {"ok": "🟢 OK", "auth": "🔐 Błąd autoryzacji", "timeout": "⏱️ Timeout", "connection": "🔌 Brak połączenia", "ssl": "🔒 Błąd SSL", "http": "🟠 Błąd HTTP"}
+
+class FleetHealthMonitor:
+    """
+    Okresowo (w wątku w tle) sprawdza users/me wszystkich zarejestrowanych stron równolegle i zapisuje
+    czas odpowiedzi, status autoryzacji i klasę błędu w tabeli site_health.
+    Operacje masowe pytają monitor o niedziałające strony i pomijają je z góry zamiast czekać na timeouty.
+    Pojedynczy timeout nie wyklucza strony: błąd jest sprawdzany ponownie po HEALTH_RECHECK_DELAY, a za niedziałającą
+    uznawana jest dopiero strona z HEALTH_FAILURE_THRESHOLD kolejnymi błędami (błąd autoryzacji - od razu).
+    """
+    def __init__(self, conn, lock, interval=HEALTH_CHECK_INTERVAL, max_workers=16):
+        self.conn = conn
+        self.lock = lock
+        self.interval = interval
+        self.max_workers = max_workers
+        self._credentials = {}
+        self._credentials_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread = None
+
+    def register(self, credentials):
+        """credentials: lista (url, login, hasło) - strony do monitorowania. Uruchamia wątek przy pierwszym wywołaniu."""
+        with self._credentials_lock:
+            new_sites = any(url not in self._credentials for url, _, _ in credentials)
+            self._credentials.update({url: (username, password) for url, username, password in credentials})
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._run, daemon=True, name="fleet-health-monitor")
+            self._thread.start()
+        elif new_sites:
+            self._wake.set()
+
+    def forget(self, url):
+        with self._credentials_lock: self._credentials.pop(url, None)
+        with self.lock, self.conn: self.conn.execute("DELETE FROM site_health WHERE site_url = ?", (url,))
+
+    def _run(self):
+        while True:
+            failing = self.check_all()
+            if failing and not self._wake.wait(HEALTH_RECHECK_DELAY): self.check_all(failing)
+            self._wake.wait(self.interval)
+            self._wake.clear()
+
+    def check_all(self, urls=None):
+        """Sprawdza strony (domyślnie wszystkie) i zwraca listę tych, których test się nie powiódł."""
+        with self._credentials_lock:
+            targets = {url: cred for url, cred in self._credentials.items() if urls is None or url in urls}
+        if not targets: return []
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            results = dict(zip(targets, executor.map(lambda item: WordPressAPI(item[0], *item[1]).probe(), targets.items())))
+        now = datetime.now().isoformat(timespec="seconds")
+        with self.lock, self.conn:
+            for url, r in results.items():
+                self.conn.execute("""INSERT INTO site_health VALUES (?, ?, ?, ?, ?, ?, ?)
+                    ON CONFLICT (site_url) DO UPDATE SET status = excluded.status, http_status = excluded.http_status, latency_ms = excluded.latency_ms, error = excluded.error,
+                    consecutive_failures = CASE WHEN excluded.status = 'ok' THEN 0 ELSE site_health.consecutive_failures + 1 END, checked_at = excluded.checked_at""",
+                    (url, r["status"], r["http_status"], r["latency_ms"], r["error"], 0 if r["status"] == "ok" else 1, now))
+        return [url for url, r in results.items() if r["status"] != "ok"]
+
+    def statuses(self, urls):
+        if not urls: return {}
+        placeholders = ",".join("?" * len(urls))
+        rows = self.conn.execute(f"SELECT site_url, status, http_status, latency_ms, error, consecutive_failures, checked_at FROM site_health WHERE site_url IN ({placeholders})", list(urls)).fetchall()
+        return {row[0]: dict(zip(("status", "http_status", "latency_ms", "error", "consecutive_failures", "checked_at"), row[1:])) for row in rows}
+
+    def unhealthy(self, urls, max_age=2 * HEALTH_CHECK_INTERVAL, min_failures=HEALTH_FAILURE_THRESHOLD):
+        """
+        Strony, których ostatnie (niezbyt stare) testy kończą się błędem: {url: opis błędu} - co najmniej min_failures kolejnych
+        błędów albo błąd autoryzacji. Strony niesprawdzone uznajemy za zdrowe.
+        """
+        threshold = (datetime.now() - timedelta(seconds=max_age)).isoformat()
+        return {url: h["error"] for url, h in self.statuses(urls).items()
+                if h["status"] != "ok" and h["checked_at"] >= threshold and (h["status"] == "auth" or h["consecutive_failures"] >= min_failures)}
+
+@st.cache_resource
+def get_fleet_health_monitor():
+    return FleetHealthMonitor(get_data_db_connection(), get_data_db_lock())
+
+# --- ZDARZENIA Z BLOGÓW (WEBHOOK) ---
+# Strony wysyłają POST {"site_url", "event": "publish" | "update" | "delete", "post": {id, status, date, title, content, link, modified}}
+# (pojedyncze zdarzenie lub lista) na http://<host>:WEBHOOK_PORT/wp-events, z nagłówkiem X-PBN-Signature: sha256=<HMAC treści>.
+# Bez WEBHOOK_SECRET odbiornik nasłuchuje tylko na 127.0.0.1 (np. za lokalnym proxy). Zdarzenia dla nieznanych stron są odrzucane.
+# Indeks wpisów aktualizuje się przyrostowo; odpytywanie REST zostaje jako rzadki przebieg uzgadniający (WEBHOOK_RECONCILE_INTERVAL).
+
+WEBHOOK_PORT = int(st.secrets.get("WEBHOOK_PORT", 0))
+WEBHOOK_SECRET = st.secrets.get("WEBHOOK_SECRET", "")
+WEBHOOK_PATH = "/wp-events"
+WEBHOOK_MAX_BODY = 5 * 1024 * 1024
+WEBHOOK_RECONCILE_INTERVAL = 6 * 3600
+POLL_SYNC_INTERVAL = 600
+
+def sign_webhook_body(body, secret):
+    return "sha256=" + hmac.new(secret.encode(), body, hashlib.sha256).hexdigest()
+
+def _rendered(value):
+    return value.get("rendered", "") if isinstance(value, dict) else (value or "")
+
+class PostEventIngestor:
+    """
+    Stosuje zdarzenia wpisów do lokalnych indeksów w jednej transakcji: post_index (stan wpisu), dzienne liczniki publikacji,
+    statystyki strony (liczba wpisów, ostatni wpis) i odciski SimHash. Liczniki zmieniają się tylko przy przejściu wpisu do/z
+    statusu publish, więc powtórzone zdarzenie lub późniejsze odpytanie REST nie liczy wpisu drugi raz.
+    """
+    def __init__(self, conn, lock, fingerprint_index):
+        self.conn = conn
+        self.lock = lock
+        self.fingerprint_index = fingerprint_index
+        self.site_versions = Counter()
+
+    def apply(self, event):
+        site_url, post = event["site_url"].rstrip("/"), event["post"]
+        post_id, date_str = int(post["id"]), (post.get("date") or "")[:19]
+        status = "deleted" if event["event"] == "delete" else post.get("status", "publish")
+        with self.lock, self.conn:
+            previous = self.conn.execute("SELECT status, date FROM post_index WHERE site_url = ? AND post_id = ?", (site_url, post_id)).fetchone()
+            old_day = previous[1][:10] if previous and previous[0] == "publish" and previous[1] else None
+            new_day = date_str[:10] if status == "publish" and date_str else None
+            if old_day != new_day:
+                if old_day: self.conn.execute("UPDATE post_daily_counts SET count = count - 1 WHERE site_url = ? AND day = ?", (site_url, old_day))
+                if new_day: self.conn.execute("INSERT INTO post_daily_counts VALUES (?, ?, 1) ON CONFLICT (site_url, day) DO UPDATE SET count = count + 1", (site_url, new_day))
+                delta = bool(new_day) - bool(old_day)
+                if delta: self.conn.execute("UPDATE site_stats SET total_posts = CAST(CAST(total_posts AS INTEGER) + ? AS TEXT) WHERE site_url = ? AND total_posts GLOB '[0-9]*'", (delta, site_url))
+            if new_day:
+                last_post = datetime.fromisoformat(date_str).strftime('%Y-%m-%d %H:%M')
+                self.conn.execute("UPDATE site_stats SET last_post_date = ? WHERE site_url = ? AND (last_post_date = 'Brak' OR (last_post_date GLOB '[0-9]*' AND last_post_date < ?))", (last_post, site_url, last_post))
+            if status == "deleted": self.conn.execute("DELETE FROM post_index WHERE site_url = ? AND post_id = ?", (site_url, post_id))
+            else: self.conn.execute("INSERT INTO post_index VALUES (?, ?, ?, ?, ?, ?) ON CONFLICT (site_url, post_id) DO UPDATE SET status = excluded.status, date = excluded.date, modified = excluded.modified, title = COALESCE(excluded.title, title)",
+                                    (site_url, post_id, status, date_str or (previous[1] if previous else None), post.get("modified"), html_unescape(_rendered(post["title"])) if "title" in post else None))
+            touch_post_titles(self.conn, site_url)
+            if status not in ("publish", "future"): self.conn.execute("DELETE FROM content_fingerprints WHERE site_url = ? AND post_id = ?", (site_url, post_id))
+        if status in ("publish", "future") and post.get("content") is not None:
+            self.fingerprint_index.upsert_posts(site_url, [{"id": post_id, "title": {"rendered": _rendered(post.get("title"))}, "content": {"rendered": _rendered(post.get("content"))}, "link": post.get("link"), "modified": post.get("modified")}])
+        self.site_versions[site_url] += 1
+
+class WebhookReceiver:
+    """
+    Mały serwer HTTP (osobny wątek) przyjmujący zdarzenia wpisów. Z WEBHOOK_SECRET odrzuca żądania bez poprawnego podpisu HMAC,
+    bez sekretu słucha tylko lokalnie. Przyjmuje wyłącznie zdarzenia stron zgłoszonych przez register().
+    """
+    def __init__(self, ingestor, port, secret=""):
+        self.ingestor = ingestor
+        self.secret = secret
+        self.host = "0.0.0.0" if secret else "127.0.0.1"
+        self.stats = Counter()
+        self.last_event_at = None
+        self._site_urls = set()
+        receiver = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                if urlparse(self.path).path != WEBHOOK_PATH: return self._reply(404, {"error": "not found"})
+                if self.headers.get("Content-Length") is None: return self._reply(411, {"error": "length required"})
+                try:
+                    length = int(self.headers["Content-Length"])
+                except ValueError:
+                    length = -1
+                if length < 0: return self._reply(400, {"error": "invalid Content-Length"})
+                if length > WEBHOOK_MAX_BODY: return self._reply(413, {"error": "body too large"})
+                body = self.rfile.read(length)
+                if receiver.secret and not hmac.compare_digest(self.headers.get("X-PBN-Signature", ""), sign_webhook_body(body, receiver.secret)):
+                    receiver.stats["rejected"] += 1
+                    return self._reply(401, {"error": "invalid signature"})
+                try:
+                    events = json.loads(body)
+                    events = events if isinstance(events, list) else [events]
+                    unknown = {event["site_url"] for event in events if event["site_url"].rstrip("/") not in receiver._site_urls}
+                    if unknown:
+                        receiver.stats["rejected"] += 1
+                        return self._reply(403, {"error": f"unknown site: {', '.join(sorted(unknown))}"})
+                    for event in events: receiver.ingestor.apply(event)
+                except (ValueError, KeyError, TypeError) as e:
+                    receiver.stats["invalid"] += 1
+                    return self._reply(400, {"error": str(e)})
+                receiver.stats["events"] += len(events)
+                receiver.last_event_at = datetime.now()
+                self._reply(200, {"applied": len(events)})
+
+            def _reply(self, code, payload):
+                data = json.dumps(payload).encode()
+                self.send_response(code)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = ThreadingHTTPServer((self.host, port), Handler)
+        self.server.daemon_threads = True
+        threading.Thread(target=self.server.serve_forever, name="wp-webhook-receiver", daemon=True).start()
+
+    def register(self, site_urls):
+        """Strony, których zdarzenia są przyjmowane (jak FleetHealthMonitor.register - wywoływane przy każdym przebiegu)."""
+        self._site_urls.update(url.rstrip("/") for url in site_urls)
+
+@st.cache_resource
+def get_post_event_ingestor():
+    return PostEventIngestor(get_data_db_connection(), get_data_db_lock(), ContentFingerprintIndex(get_data_db_connection(), get_data_db_lock()))
+
+@st.cache_resource
+def get_webhook_receiver():
+    """Odbiornik uruchamiany raz na proces; None, gdy WEBHOOK_PORT nie jest ustawiony lub port jest zajęty."""
+    if not WEBHOOK_PORT: return None
+    try:
+        return WebhookReceiver(get_post_event_ingestor(), WEBHOOK_PORT, WEBHOOK_SECRET)
+    except OSError:
+        return None
+
+# --- IMPORT / EKSPORT KONFIGURACJI ---
+# Plik: {"sites": [...], "personas": [...]}. Import czyta plik strumieniowo, rekord po rekordzie,
+# eksport generuje JSON fragmentami dopiero po kliknięciu przycisku pobierania.
+
+CONFIG_EXPORT_QUERIES = {
+    "sites": ("SELECT name, url, username, app_password, image_style_prompt FROM sites ORDER BY id",
+              lambda r: {"name": r[0], "url": r[1], "username": r[2], "app_password_b64": base64.b64encode(r[3]).decode("utf-8"), "image_style_prompt": r[4]}),
+    "personas": ("SELECT name, description FROM personas ORDER BY id",
+                 lambda r: {"name": r[0], "description": r[1]}),
+}
+
+def iter_config_export(conn):
+    """Eksport konfiguracji jako strumień fragmentów JSON (jeden rekord na linię) - bez budowania całego dokumentu w pamięci."""
+    yield "{"
+    for i, (section, (query, to_record)) in enumerate(CONFIG_EXPORT_QUERIES.items()):
+        yield f'{"," if i else ""}\n  "{section}": ['
+        for j, row in enumerate(conn.execute(query)):
+            yield ("," if j else "") + "\n    " + json.dumps(to_record(row), ensure_ascii=False)
+        yield "\n  ]"
+    yield "\n}\n"
+
+def export_config_bytes(conn):
+    buffer = io.BytesIO()
+    for chunk in iter_config_export(conn): buffer.write(chunk.encode("utf-8"))
+    return buffer.getvalue()
+
+def iter_config_records(stream, chunk_size=65536):
+    """
+    Strumieniowy parser pliku konfiguracyjnego: zwraca pary (sekcja, rekord), czytając plik porcjami.
+    Każdy element tablic sites/personas dekodowany osobno (raw_decode); nieznane klucze są pomijane.
+    """
+    decoder = json.JSONDecoder()
+    text_decoder = codecs.getincrementaldecoder("utf-8-sig")()
+    buffer, pos, eof = "", 0, False
+
+    def fill():
+        nonlocal buffer, pos, eof
+        if eof: return False
+        chunk = stream.read(chunk_size)
+        eof = not chunk
+        buffer = buffer[pos:] + text_decoder.decode(chunk or b"", final=eof)
+        pos = 0
+        return True
+
+    def peek():
+        nonlocal pos
+        while True:
+            while pos < len(buffer) and buffer[pos] in " \t\r\n": pos += 1
+            if pos < len(buffer): return buffer[pos]
+            if not fill(): raise ValueError("Nieoczekiwany koniec pliku konfiguracyjnego")
+
+    def expect(chars):
+        nonlocal pos
+        char = peek()
+        if char not in chars: raise ValueError(f"Niepoprawny plik konfiguracyjny: oczekiwano '{' lub '.join(chars)}', znaleziono '{char}'")
+        pos += 1
+        return char
+
+    def value():
+        nonlocal pos
+        peek()
+        while True:
+            try:
+                obj, end = decoder.raw_decode(buffer, pos)
+                # Wartość kończąca się na granicy bufora (np. liczba) może być ucięta - doczytaj i dekoduj ponownie.
+                if end < len(buffer) or not fill():
+                    pos = end
+                    return obj
+            except json.JSONDecodeError:
+                if not fill(): raise
+
+    expect("{")
+    if peek() == "}": return
+    while True:
+        key = value()
+        expect(":")
+        if key in CONFIG_EXPORT_QUERIES and peek() == "[":
+            pos += 1
+            if peek() == "]": pos += 1
+            else:
+                while True:
+                    yield key, value()
+                    if expect(",]") == "]": break
+        else:
+            value()
+        if expect(",}") == "}": return
+
+def import_config(workspace, records, operator):
+    """Zastępuje strony i persony rekordami z pliku w jednej transakcji - błąd w dowolnym rekordzie wycofuje cały import."""
+    counts = Counter()
+    with workspace.transaction(operator, "sites", "personas") as conn:
+        conn.execute("DELETE FROM sites")
+        conn.execute("DELETE FROM personas")
+        for section, record in records:
+            if section == "sites":
+                conn.execute("INSERT INTO sites (name, url, username, app_password, image_style_prompt) VALUES (?, ?, ?, ?, ?)",
+                             (record['name'], record['url'], record['username'], base64.b64decode(record['app_password_b64']), record.get('image_style_prompt', '')))
+            else:
+                conn.execute("INSERT INTO personas (name, description) VALUES (?, ?)", (record['name'], record['description']))
+            counts[section] += 1
+    return counts
+
+def validate_config_sites(sites, max_workers=16):
+    """Równoległy test połączenia importowanych stron: {url: opis błędu} dla stron, które nie odpowiadają poprawnie."""
+    def check(site):
+        password = decrypt_data(base64.b64decode(site['app_password_b64']), display_error=False)
+        if password is None: return "Nie można odszyfrować hasła"
+        return WordPressAPI(site['url'], site['username'], password).probe()["error"]
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        errors = list(executor.map(check, sites))
+    return {site['url']: error for site, error in zip(sites, errors) if error}
+
+# --- EKSPORT / IMPORT WYGENEROWANYCH PARTII (PARQUET) ---
+# Parquet przez pandas (pyarrow instaluje się razem ze Streamlit). Obrazki zostają w ImageStore - w pliku tylko ich refy.
+
+BATCH_EXPORT_KINDS = {"brief": "briefy", "article": "artykuły"}
+BATCH_JSON_COLUMNS = {"brief": ["brief"], "article": ["structure"]}
+
+def batch_to_parquet_bytes(items, kind):
+    """Partia briefów lub artykułów jako jeden plik Parquet (kolumnowo, kompresja zstd). Słowniki (brief, structure) jako kolumny JSON - bez zgadywania typów."""
+    df = pd.DataFrame(items)
+    for column in BATCH_JSON_COLUMNS[kind]:
+        if column in df: df[column] = df[column].map(lambda value: json.dumps(value, ensure_ascii=False))
+    df.insert(0, "kind", kind)
+    buffer = io.BytesIO()
+    df.to_parquet(buffer, index=False, compression="zstd")
+    return buffer.getvalue()
+
+def read_batch_parquet(stream, store):
+    """
+    Odczyt partii z pliku Parquet: zwraca (rodzaj, elementy, liczba brakujących obrazków).
+    Refy obrazków, których nie ma w lokalnym magazynie, są czyszczone - brakujący obrazek główny zastępuje pierwszy
+    zachowany wariant, a gdy nie ma żadnego, wpis zostaje bez obrazka.
+    """
+    df = pd.read_parquet(stream)
+    kinds = df.pop("kind").unique().tolist() if "kind" in df else []
+    if len(kinds) != 1 or kinds[0] not in BATCH_EXPORT_KINDS: raise ValueError("Plik nie jest eksportem partii briefów ani artykułów.")
+    kind = kinds[0]
+    for column in BATCH_JSON_COLUMNS[kind]:
+        if column in df: df[column] = df[column].map(lambda value: json.loads(value) if isinstance(value, str) else value)
+    if "image_variants" in df: df["image_variants"] = df["image_variants"].map(lambda refs: [] if refs is None else list(refs))
+    items = df.astype(object).where(df.notna(), None).to_dict("records")
+    missing_images = 0
+    for item in items:
+        if "image_variants" in item: item["image_variants"] = [ref for ref in item["image_variants"] if os.path.exists(store.path(ref))]
+        if item.get("image") and not os.path.exists(store.path(item["image"])):
+            item["image"] = item["image_variants"][0] if item.get("image_variants") else None
+            if item["image"] is None: missing_images += 1
+    return kind, items, missing_images
+
+def merge_batch_items(current, imported, kind):
+    """Dokłada zaimportowane elementy do bieżącej listy; elementy o tym samym temacie/tytule są zastępowane wersją z pliku."""
+    key = "topic" if kind == "brief" else "title"
+    imported_keys = {item[key] for item in imported}
+    return [item for item in current if item.get(key) not in imported_keys] + imported
+
+# --- STRONICOWANIE WPISÓW (ZARZĄDZANIE TREŚCIĄ) ---
+
+@st.cache_resource
+def get_prefetch_executor():
+    return ThreadPoolExecutor(max_workers=4, thread_name_prefix="post-page-prefetch")
+
+class PostPageCache:
+    """
+    Ograniczona (LRU) pamięć pobranych stron wpisów, trzymana w stanie sesji - w pamięci jest najwyżej max_pages stron,
+    niezależnie od wielkości bloga. prefetch() pobiera w tle kolejną stronę, więc przejście dalej nie czeka na sieć.
+    """
+    def __init__(self, executor, max_pages=6):
+        self.executor = executor
+        self.max_pages = max_pages
+        self._pages = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _future(self, key, loader):
+        with self._lock:
+            if key in self._pages: self._pages.move_to_end(key)
+            else:
+                self._pages[key] = self.executor.submit(loader)
+                while len(self._pages) > self.max_pages: self._pages.popitem(last=False)
+            return self._pages[key]
+
+    def get(self, key, loader):
+        """Wynik loadera dla klucza; błędy i puste wyniki (None) nie są zapamiętywane."""
+        future = self._future(key, loader)
+        try: result = future.result()
+        except Exception: result = None
+        if result is None:
+            with self._lock:
+                if self._pages.get(key) is future: del self._pages[key]
+        return result
+
+    def prefetch(self, key, loader):
+        self._future(key, loader)
+
+    def clear(self):
+        with self._lock: self._pages.clear()
 
 # --- INTERFEJS UŻYTKOWNIKA (STREAMLIT) ---
 
@@ -528,14 +2907,30 @@ st.set_page_config(layout="wide", page_title="PBN Manager - AI Search Optimized"
 
 if 'master_prompt' not in st.session_state: st.session_state.master_prompt = DEFAULT_MASTER_PROMPT_TEMPLATE
 if 'brief_prompt' not in st.session_state: st.session_state.brief_prompt = DEFAULT_BRIEF_PROMPT_TEMPLATE
+if 'cluster_prompt' not in st.session_state: st.session_state.cluster_prompt = DEFAULT_CLUSTER_PROMPT_TEMPLATE
 if 'menu_choice' not in st.session_state: st.session_state.menu_choice = "Dashboard"
-if 'generated_articles' not in st.session_state: st.session_state.generated_articles = []
-if 'generated_briefs' not in st.session_state: st.session_state.generated_briefs = []
+if 'generated_articles' not in st.session_state: st.session_state.generated_articles = list(get_generation_checkpoints().load("article").values())
+if 'generated_briefs' not in st.session_state: st.session_state.generated_briefs = list(get_generation_checkpoints().load("brief").values())
+if 'prompt_cache_stats' not in st.session_state: st.session_state.prompt_cache_stats = PromptCacheStats()
+if 'batch_jobs' not in st.session_state: st.session_state.batch_jobs = [job for job in get_generation_checkpoints().load("batch_job", BATCH_JOBS_RUN_ID).values() if not job['done']]
+if 'post_pages' not in st.session_state: st.session_state.post_pages = PostPageCache(get_prefetch_executor())
 
 st.title("🚀 PBN Manager - AI Search Optimized")
 st.caption("Centralne zarządzanie i generowanie treści zoptymalizowanych pod AI search (GEO/AIO)")
 
 conn = get_db_connection()
+data_conn = get_data_db_connection()
+workspace = get_workspace()
+shared_workspace = get_shared_workspace()
+fingerprint_index = ContentFingerprintIndex(data_conn, get_data_db_lock())
+health_monitor = get_fleet_health_monitor()
+image_store = get_image_store()
+webhook_receiver = get_webhook_receiver()
+# Rzadkie uzgadnianie tylko wtedy, gdy odbiornik faktycznie działa (port mógł być zajęty)
+post_sync_interval = WEBHOOK_RECONCILE_INTERVAL if webhook_receiver else POLL_SYNC_INTERVAL
+site_credentials = [(url, username, decrypt_cached(enc_pass)) for url, username, enc_pass in db_execute(conn, "SELECT url, username, app_password FROM sites", fetch="all")]
+health_monitor.register([c for c in site_credentials if c[2] is not None])
+if webhook_receiver: webhook_receiver.register([url for url, _, _ in site_credentials])
 
 st.sidebar.header("Menu Główne")
 menu_options = ["Dashboard", "Zarządzanie Stronami", "Zarządzanie Personami", "🗺️ Strateg Tematyczny", "Generator Briefów", "Generowanie Treści", "Harmonogram Publikacji", "Zarządzanie Treścią", "⚙️ Edytor Promptów"]
@@ -554,6 +2949,26 @@ st.sidebar.radio("Wybierz sekcję:", menu_options, key='menu_choice', index=defa
 st.sidebar.header("Konfiguracja API")
 openai_api_key = st.secrets.get("OPENAI_API_KEY", "") or st.sidebar.text_input("Klucz OpenAI API", type="password")
 google_api_key = st.secrets.get("GOOGLE_API_KEY", "") or st.sidebar.text_input("Klucz Google AI API", type="password")
+api_keys = {"openai": openai_api_key, "gemini": google_api_key}
+
+st.sidebar.header("Operator")
+if 'operator' not in st.session_state: st.session_state.operator = f"operator-{random.randrange(16 ** 4):04x}"
+operator = st.sidebar.text_input("Twoja nazwa (widoczna dla innych operatorów)", key="operator").strip() or "operator"
+
+@st.fragment(run_every=WORKSPACE_POLL_SECONDS)
+def render_workspace_notifications():
+    """Co kilkanaście sekund jedno małe zapytanie o liczniki zmian - powiadomienie, gdy inny operator coś zmienił."""
+    revisions = {**workspace.revisions(), **shared_workspace.revisions()}
+    seen = st.session_state.setdefault('workspace_seen', {entity: info["revision"] for entity, info in revisions.items()})
+    for entity, info in revisions.items():
+        if seen.get(entity, 0) != info["revision"] and info["changed_by"] != operator:
+            label = WORKSPACE_ENTITY_LABELS.get(entity.split(":", 1)[0], entity)
+            st.toast(f"🔔 {label}{' · ' + entity.split(':', 1)[1] if ':' in entity else ''}: zmiana wprowadzona przez {info['changed_by']} ({info['changed_at'].replace('T', ' ')})")
+        seen[entity] = info["revision"]
+    if WORKSPACE_MODE == "shared": st.caption("👥 Wspólna przestrzeń robocza - zmiany innych operatorów pojawiają się jako powiadomienia.")
+
+with st.sidebar:
+    render_workspace_notifications()
 
 with st.sidebar.expander("ℹ️ Klucz szyfrowania"):
     st.info("""
@@ -568,47 +2983,104 @@ with st.sidebar.expander("ℹ️ Klucz szyfrowania"):
     """)
 
 with st.sidebar.expander("Zarządzanie Konfiguracją (Plik JSON)"):
+    validate_import = st.checkbox("Sprawdź połączenia importowanych stron", key="config_validate_import", help="Równoległy test każdej strony (users/me) przed importem - strony są importowane niezależnie od wyniku.")
     uploaded_file = st.file_uploader("Załaduj plik konfiguracyjny", type="json", key="config_uploader")
     if uploaded_file is not None:
         if uploaded_file.file_id != st.session_state.get('last_uploaded_file_id', ''):
             try:
-                config_data = json.load(uploaded_file)
-                db_execute(conn, "DELETE FROM sites")
-                db_execute(conn, "DELETE FROM personas")
-
-                for site in config_data.get('sites', []):
-                    encrypted_password_bytes = base64.b64decode(site['app_password_b64'])
-                    style_prompt = site.get('image_style_prompt', '')
-                    db_execute(conn,
-                        "INSERT INTO sites (name, url, username, app_password, image_style_prompt) VALUES (?, ?, ?, ?, ?)",
-                        (site['name'], site['url'], site['username'], encrypted_password_bytes, style_prompt)
-                    )
-
-                for persona in config_data.get('personas', []):
-                    db_execute(conn, "INSERT INTO personas (name, description) VALUES (?, ?)", (persona['name'], persona['description']))
-
+                records = iter_config_records(uploaded_file)
+                failures = {}
+                if validate_import:
+                    records = list(records)
+                    with st.spinner("Sprawdzanie połączeń ze stronami..."):
+                        failures = validate_config_sites([record for section, record in records if section == "sites"])
+                counts = import_config(workspace, records, operator)
                 st.session_state.last_uploaded_file_id = uploaded_file.file_id
-                st.success(f"Pomyślnie załadowano {len(config_data.get('sites',[]))} stron i {len(config_data.get('personas',[]))} person!")
+                st.session_state.config_import_report = {"sites": counts["sites"], "personas": counts["personas"], "failures": failures}
                 st.rerun()
             except Exception as e:
                 st.error(f"Błąd podczas przetwarzania pliku: {e}")
 
-    sites_for_export = db_execute(conn, "SELECT name, url, username, app_password, image_style_prompt FROM sites", fetch="all")
-    personas_for_export = db_execute(conn, "SELECT name, description FROM personas", fetch="all")
-    if sites_for_export or personas_for_export:
-        export_data = {'sites': [], 'personas': []}
-        for name, url, username, encrypted_pass_bytes, style_prompt in sites_for_export:
-            encrypted_pass_b64 = base64.b64encode(encrypted_pass_bytes).decode('utf-8')
-            export_data['sites'].append({
-                'name': name,
-                'url': url,
-                'username': username,
-                'app_password_b64': encrypted_pass_b64,
-                'image_style_prompt': style_prompt
-            })
-        for name, description in personas_for_export:
-            export_data['personas'].append({'name': name, 'description': description})
-        st.download_button(label="Pobierz konfigurację", data=json.dumps(export_data, indent=2), file_name="pbn_config.json", mime="application/json")
+    import_report = st.session_state.pop('config_import_report', None)
+    if import_report:
+        st.success(f"Pomyślnie załadowano {import_report['sites']} stron i {import_report['personas']} person!")
+        for url, error in import_report['failures'].items():
+            st.warning(f"{url}: {error}")
+
+    if db_execute(conn, "SELECT EXISTS (SELECT 1 FROM sites) OR EXISTS (SELECT 1 FROM personas)", fetch="one")[0]:
+        st.download_button(label="Pobierz konfigurację", data=lambda: export_config_bytes(conn), file_name="pbn_config.json", mime="application/json", on_click="ignore")
+
+with st.sidebar.expander("Partie briefów i artykułów (Parquet)"):
+    batch_file = st.file_uploader("Wczytaj partię", type="parquet", key="batch_uploader", help="Plik z eksportu briefów lub artykułów. Elementy o tym samym temacie/tytule są zastępowane wersją z pliku.")
+    if batch_file is not None and batch_file.file_id != st.session_state.get('last_batch_file_id', ''):
+        try:
+            kind, items, missing_images = read_batch_parquet(batch_file, image_store)
+            state_key = "generated_briefs" if kind == "brief" else "generated_articles"
+            st.session_state[state_key] = merge_batch_items(st.session_state[state_key], items, kind)
+            st.session_state.last_batch_file_id = batch_file.file_id
+            st.success(f"Wczytano {BATCH_EXPORT_KINDS[kind]}: {len(items)}." + (f" Brak {missing_images} obrazków w lokalnym magazynie - te elementy są bez obrazka." if missing_images else ""))
+        except Exception as e:
+            st.error(f"Błąd podczas wczytywania partii: {e}")
+    stamp = datetime.now().strftime('%Y%m%d-%H%M')
+    if st.session_state.generated_briefs:
+        st.download_button(f"Pobierz briefy ({len(st.session_state.generated_briefs)})", data=lambda briefs=st.session_state.generated_briefs: batch_to_parquet_bytes(briefs, "brief"), file_name=f"briefy-{stamp}.parquet", mime="application/vnd.apache.parquet", on_click="ignore")
+    if st.session_state.generated_articles:
+        st.download_button(f"Pobierz artykuły ({len(st.session_state.generated_articles)})", data=lambda articles=st.session_state.generated_articles: batch_to_parquet_bytes(articles, "article"), file_name=f"artykuly-{stamp}.parquet", mime="application/vnd.apache.parquet", on_click="ignore")
+
+def get_categories_for_site(site_url, site_user, site_pass):
+    try:
+        return get_taxonomy_resolver().terms(WordPressAPI(site_url, site_user, site_pass), "categories")
+    except requests.exceptions.RequestException as e:
+        st.error(f"Nie udało się pobrać kategorii z {site_url}: {e}")
+        return {}
+
+@st.cache_data(ttl=300)
+def get_users_for_site(site_url, site_user, _site_pass):
+    return WordPressAPI(site_url, site_user, _site_pass).get_users()
+
+@st.cache_data(ttl=300)
+def get_scheduled_dates_for_site(site_url, site_user, _site_pass):
+    return WordPressAPI(site_url, site_user, _site_pass).get_scheduled_post_dates()
+
+def render_batch_jobs_panel():
+    """
+    Lista zadań Batch API (także tych wysłanych przez innych operatorów) z przyciskiem sprawdzenia statusu i pobrania wyników.
+    Wyniki zadania pobiera tylko jeden operator naraz (claim); pozostali przejmują je z punktów kontrolnych.
+    """
+    checkpoints = get_generation_checkpoints()
+    jobs = st.session_state.batch_jobs
+    known = {j['id'] for j in jobs}
+    jobs.extend(job for job_id, job in checkpoints.load("batch_job", BATCH_JOBS_RUN_ID).items() if job_id not in known and not job['done'])
+    if not jobs: return
+    with st.expander(f"📦 Zadania wsadowe (Batch API) - w toku: {sum(not j['done'] for j in jobs)}", expanded=True):
+        st.dataframe(pd.DataFrame([{"ID": j['id'], "Typ": j['kind'], "Elementów": len(j['items']), "Status": j['status'], "Utworzono": j['created']} for j in jobs]), hide_index=True, use_container_width=True)
+        if st.button("🔄 Sprawdź status i pobierz wyniki"):
+            runner = OpenAIBatchRunner(openai.OpenAI(api_key=openai_api_key))
+            with st.spinner("Sprawdzanie zadań wsadowych..."):
+                for job in [j for j in jobs if not j['done']]:
+                    stored = checkpoints.get("batch_job", BATCH_JOBS_RUN_ID, job['id'])
+                    if stored and stored['done']:
+                        job.update(stored)
+                        st.session_state.generated_briefs.extend(checkpoints.load("brief", job['id']).values())
+                        st.session_state.generated_articles.extend(checkpoints.load("article", job['id']).values())
+                        continue
+                    claim = f"batch:{job['id']}"
+                    with shared_workspace.lease(claim, operator) as granted:
+                        if not granted:
+                            st.info(f"Wyniki zadania {job['id']} pobiera teraz {shared_workspace.claimed_by(claim)} - pojawią się tu po zakończeniu.")
+                            continue
+                        try:
+                            briefs, articles, next_job = ingest_batch_job(runner, job, openai_api_key, google_api_key)
+                        except Exception as e:
+                            st.error(f"Błąd podczas obsługi zadania {job['id']}: {e}")
+                            continue
+                        # Zapis przed zwolnieniem claimu - kolejny operator zobaczy zadanie już jako zakończone
+                        checkpoint_batch_job(job, operator, briefs, articles)
+                        if next_job: checkpoint_batch_job(next_job, operator)
+                    st.session_state.generated_briefs.extend(briefs)
+                    st.session_state.generated_articles.extend(articles)
+                    if next_job: jobs.append(next_job)
+            st.rerun()
 
 # --- GŁÓWNA LOGIKA WYŚWIETLANIA STRON ---
 
@@ -645,32 +3117,54 @@ if st.session_state.menu_choice == "Zarządzanie Stronami":
                     success, message = api.test_connection()
                 if success:
                     encrypted_password = encrypt_data(app_password_clean)
-                    try:
-                        db_execute(conn, "INSERT INTO sites (name, url, username, app_password, image_style_prompt) VALUES (?, ?, ?, ?, ?)", (name, url, username, encrypted_password, ""))
+                    if workspace.insert("sites", operator, name=name, url=url, username=username, app_password=encrypted_password, image_style_prompt=""):
                         st.success(f"Strona '{name}' dodana!")
                         st.rerun()
-                    except sqlite3.IntegrityError: st.error(f"Strona o URL '{url}' już istnieje.")
+                    else: st.error(f"Strona o URL '{url}' już istnieje.")
                 else: st.error(f"Nie udało się dodać strony. Błąd: {message}")
             else: st.error("Wszystkie pola są wymagane.")
 
-    st.subheader("Lista załadowanych stron")
-    sites = db_execute(conn, "SELECT id, name, url, username, image_style_prompt, app_password FROM sites", fetch="all")
-    if not sites: st.info("Brak załadowanych stron.")
-    else:
-        for site_id, name, url, username, style_prompt, encrypted_pass in sites:
+    @st.fragment
+    def render_site_list():
+        """Lista stron jako fragment: wyszukiwanie, stronicowanie i edycja stylu przeładowują tylko tę sekcję, a nie całą aplikację."""
+        sites = db_execute(conn, "SELECT id, name, url, username, image_style_prompt, app_password, version FROM sites", fetch="all")
+        if not sites:
+            st.info("Brak załadowanych stron.")
+            return
+        c1, c2, c3 = st.columns([2, 1, 1])
+        query = c1.text_input("Szukaj strony", placeholder="nazwa lub URL").strip().lower()
+        if query: sites = [site for site in sites if query in site[1].lower() or query in site[2].lower()]
+        page_count = max(1, -(-len(sites) // SITE_LIST_PAGE_SIZE))
+        page = c2.number_input(f"Strona listy (z {page_count})", min_value=1, max_value=page_count, value=1)
+        if c3.button("🩺 Sprawdź teraz stan wszystkich stron", use_container_width=True):
+            with st.spinner(f"Sprawdzanie {len(sites)} stron..."):
+                health_monitor.check_all()
+        sites = sites[(page - 1) * SITE_LIST_PAGE_SIZE:page * SITE_LIST_PAGE_SIZE]
+        site_health = health_monitor.statuses([site[2] for site in sites])
+        for site_id, name, url, username, style_prompt, encrypted_pass, version in sites:
             # Sprawdź status deszyfrowania
             decryption_status = "✅ OK"
-            decrypted_test = decrypt_data(encrypted_pass)
+            decrypted_test = decrypt_cached(encrypted_pass)
             if decrypted_test is None:
                 decryption_status = "⚠️ BŁĄD HASŁA"
-            
+
             with st.container(border=True):
                 c1, c2, c3 = st.columns([2, 1, 1])
                 c1.markdown(f"**{name}** (`{url}`)")
+                health = site_health.get(url)
+                if health:
+                    c1.caption(f"{HEALTH_STATUS_LABELS.get(health['status'], health['status'])} · {health['latency_ms']} ms · sprawdzono {health['checked_at'].replace('T', ' ')}" + (f" · {health['error']}" if health['error'] else ""))
+                else:
+                    c1.caption("⏳ Oczekuje na pierwszy test stanu")
+                breaker = get_circuit_breakers().get(urlparse(url).netloc).snapshot()
+                if breaker["state"] != "closed":
+                    c1.caption(f"⛔ Bezpiecznik: {breaker['state']} po {breaker['failures']} kolejnych błędach - żądania są odrzucane bez czekania")
                 c2.metric("Status hasła", decryption_status)
                 if c3.button("🗑️ Usuń", key=f"delete_{site_id}", use_container_width=True):
-                    db_execute(conn, "DELETE FROM sites WHERE id = ?", (site_id,))
-                    st.rerun()
+                    if workspace.delete("sites", site_id, version, operator):
+                        health_monitor.forget(url)
+                        st.rerun()
+                    else: st.warning(f"Strona '{name}' została w międzyczasie zmieniona przez innego operatora - sprawdź ją i spróbuj ponownie.")
 
                 # Jeśli błąd deszyfrowania, pokaż opcję naprawy
                 if decryption_status == "⚠️ BŁĄD HASŁA":
@@ -689,9 +3183,10 @@ if st.session_state.menu_choice == "Zarządzanie Stronami":
                                     success, message = test_api.test_connection()
                                     if success:
                                         encrypted_new = encrypt_data(new_password_clean)
-                                        db_execute(conn, "UPDATE sites SET app_password = ? WHERE id = ?", (encrypted_new, site_id))
-                                        st.success(f"✅ Hasło dla '{name}' zaktualizowane!")
-                                        st.rerun()
+                                        if workspace.update("sites", site_id, version, operator, app_password=encrypted_new):
+                                            st.success(f"✅ Hasło dla '{name}' zaktualizowane!")
+                                            st.rerun()
+                                        else: st.warning(f"Strona '{name}' została w międzyczasie zmieniona przez innego operatora - odśwież listę i spróbuj ponownie.")
                                     else:
                                         st.error(message)
                                 else:
@@ -700,9 +3195,13 @@ if st.session_state.menu_choice == "Zarządzanie Stronami":
                 with st.expander("Edytuj styl wizualny obrazków dla tej strony"):
                     new_style = st.text_area("Prompt stylu", value=style_prompt or "photorealistic, sharp focus, soft natural lighting", key=f"style_{site_id}", height=100, help="Opisz styl obrazków, np. 'minimalistyczny, flat design, pastelowe kolory' lub 'dramatyczne oświetlenie, styl kinowy, wysoki kontrast'.")
                     if st.button("Zapisz styl", key=f"save_style_{site_id}"):
-                        db_execute(conn, "UPDATE sites SET image_style_prompt = ? WHERE id = ?", (new_style, site_id))
-                        st.success(f"Styl dla '{name}' zaktualizowany!")
-                        st.rerun()
+                        if workspace.update("sites", site_id, version, operator, image_style_prompt=new_style):
+                            st.success(f"Styl dla '{name}' zaktualizowany!")
+                            st.rerun(scope="fragment")
+                        else: st.warning(f"Styl strony '{name}' zmienił w międzyczasie inny operator - odśwież listę, aby zobaczyć aktualną wersję.")
+
+    st.subheader("Lista załadowanych stron")
+    render_site_list()
 
 elif st.session_state.menu_choice == "Dashboard":
     st.header("📊 Dashboard Aktywności")
@@ -710,70 +3209,106 @@ elif st.session_state.menu_choice == "Dashboard":
     if not sites_list:
         st.warning("Brak załadowanych stron. Przejdź do 'Zarządzanie Stronami'.")
     else:
-        st.subheader("Liczba publikacji w czasie")
-        time_range_options = {"Ostatnie 7 dni": 7, "Ostatnie 30 dni": 30, "Ostatnie 3 miesiące": 90}
-        selected_range_label = st.radio("Wybierz zakres czasu", options=time_range_options.keys(), horizontal=True, label_visibility="collapsed")
-        days_to_fetch = time_range_options[selected_range_label]
-
-        @st.cache_data(ttl=600)
-        def get_all_posts_for_dashboard(sites_tuple, days):
-            start_date = datetime.now() - timedelta(days=days)
-            all_posts_dates = []
-            def fetch_site_posts(site_data):
-                _, site_name, url, username, enc_pass = site_data
-                try:
-                    decrypted_pass = decrypt_data(enc_pass)
-                    if decrypted_pass is None:
-                        st.warning(f"⚠️ Pomiń stronę '{site_name}' - nie można odszyfrować hasła.")
-                        return []
-                    api = WordPressAPI(url, username, decrypted_pass)
-                    return [p['date'] for p in api.get_all_posts_since(start_date)]
-                except Exception as e:
-                    st.warning(f"⚠️ Błąd pobierania danych z '{site_name}': {e}")
-                    return []
-
-            with ThreadPoolExecutor() as executor:
-                futures = {executor.submit(fetch_site_posts, site): site for site in sites_tuple}
-                for future in as_completed(futures):
-                    all_posts_dates.extend(future.result())
-            return all_posts_dates
-
-        with st.spinner(f"Pobieranie danych o publikacjach z {len(sites_list)} stron..."):
-            post_data = get_all_posts_for_dashboard(tuple(sites_list), days_to_fetch)
-
-        if not post_data:
-            st.info("Brak opublikowanych wpisów w wybranym okresie.")
-        else:
-            df_posts = pd.DataFrame(post_data, columns=['date'])
-            df_posts['date_only'] = pd.to_datetime(df_posts['date']).dt.date
-            posts_by_day = df_posts.groupby('date_only').size().reset_index(name='count')
-            posts_by_day = posts_by_day.set_index('date_only')
-            date_range = pd.date_range(start=date.today() - timedelta(days=days_to_fetch-1), end=date.today())
-            posts_by_day = posts_by_day.reindex(date_range.date, fill_value=0)
-            posts_by_day.index.name = "Data"
-            posts_by_day.columns = ["Liczba publikacji"]
-            st.bar_chart(posts_by_day)
-
-        st.subheader("Ogólne statystyki")
-        @st.cache_data(ttl=600)
-        def get_summary_stats(sites_tuple):
-            all_data = []
-            for _, name, url, username, encrypted_pass in sites_tuple:
-                decrypted_pass = decrypt_data(encrypted_pass)
-                if decrypted_pass is None:
-                    all_data.append({"Nazwa": name, "URL": url, "Liczba wpisów": "⚠️ Błąd hasła", "Ostatni wpis": "N/A"})
-                    continue
-                try:
-                    api = WordPressAPI(url, username, decrypted_pass)
-                    stats = api.get_stats()
-                    all_data.append({"Nazwa": name, "URL": url, "Liczba wpisów": stats['total_posts'], "Ostatni wpis": stats['last_post_date']})
-                except Exception as e:
-                    all_data.append({"Nazwa": name, "URL": url, "Liczba wpisów": f"Błąd: {e}", "Ostatni wpis": "N/A"})
-            return all_data
-
-        if st.button("Odśwież statystyki"): st.cache_data.clear()
-        stats_data = get_summary_stats(tuple(sites_list))
-        st.dataframe(pd.DataFrame(stats_data), use_container_width=True, hide_index=True)
+        @st.fragment
+        def render_publication_chart(sites_list):
+            """Wykres publikacji - zmiana zakresu, stron czy podziału przeładowuje tylko wykres."""
+            st.subheader("Liczba publikacji w czasie")
+            time_range_options = {"Ostatnie 7 dni": 7, "Ostatnie 30 dni": 30, "Ostatnie 3 miesiące": 90}
+            selected_range_label = st.radio("Wybierz zakres czasu", options=time_range_options.keys(), horizontal=True, label_visibility="collapsed")
+            days_to_fetch = time_range_options[selected_range_label]
+
+            @st.cache_data(ttl=post_sync_interval)
+            def refresh_daily_post_counts(sites_tuple):
+                """Synchronizacja agregatów najwyżej raz na post_sync_interval (przy aktywnym webhooku to tylko przebieg uzgadniający); zmiana zakresu lub stron to już tylko odczyt z bazy."""
+                def sync_site(site_data):
+                    _, site_name, url, username, enc_pass = site_data
+                    decrypted_pass = decrypt_data(enc_pass, display_error=False)
+                    if decrypted_pass is None: return f"⚠️ Pomiń stronę '{site_name}' - nie można odszyfrować hasła."
+                    try:
+                        sync_daily_post_counts(data_conn, WordPressAPI(url, username, decrypted_pass), url)
+                    except Exception as e:
+                        return f"⚠️ Błąd pobierania danych z '{site_name}': {e}"
+                with ThreadPoolExecutor(max_workers=8) as executor:
+                    return [w for w in executor.map(sync_site, sites_tuple) if w]
+
+            with st.spinner(f"Aktualizacja danych o publikacjach z {len(sites_list)} stron..."):
+                dead_sites = health_monitor.unhealthy([site[2] for site in sites_list])
+                for warning in refresh_daily_post_counts(tuple(site for site in sites_list if site[2] not in dead_sites)): st.warning(warning)
+
+            site_names_by_url = {site[2]: site[1] for site in sites_list}
+            c1, c2 = st.columns([3, 1])
+            chart_sites = c1.multiselect("Strony", options=list(site_names_by_url), default=list(site_names_by_url), format_func=site_names_by_url.get)
+            per_site = c2.checkbox("Podział na strony")
+            posts_by_day = load_daily_post_counts(data_conn, days_to_fetch, chart_sites) if chart_sites else pd.DataFrame()
+
+            if posts_by_day.empty or not posts_by_day.values.any():
+                st.info("Brak opublikowanych wpisów w wybranym okresie.")
+            else:
+                posts_by_day.index.name = "Data"
+                if per_site:
+                    st.bar_chart(posts_by_day.rename(columns=site_names_by_url))
+                else:
+                    st.bar_chart(posts_by_day.sum(axis=1).rename("Liczba publikacji"))
+
+        @st.fragment
+        def render_site_stats(sites_list):
+            st.subheader("Ogólne statystyki")
+            if webhook_receiver:
+                last_event = webhook_receiver.last_event_at.strftime('%H:%M:%S') if webhook_receiver.last_event_at else "brak"
+                st.caption(f"📡 Webhook aktywny ({webhook_receiver.host}:{WEBHOOK_PORT}{WEBHOOK_PATH}): {webhook_receiver.stats['events']} zdarzeń, ostatnie: {last_event}, odrzucone: {webhook_receiver.stats['rejected'] + webhook_receiver.stats['invalid']}. Pełna synchronizacja co {post_sync_interval // 3600} h.")
+            force_stats_refresh = st.button("Odśwież statystyki")
+            if force_stats_refresh: st.cache_data.clear()
+            if st.button("Przebuduj agregaty publikacji", help="Usuwa zapisane dzienne liczniki i pobiera je ponownie (np. po usunięciu wpisów na stronach)."):
+                reset_daily_post_counts(data_conn)
+                st.cache_data.clear()
+                st.rerun()
+            stats_service = get_site_stats_service()
+            site_passwords = {url: decrypt_cached(enc_pass) for _, _, url, _, enc_pass in sites_list}
+            stats_service.refresh_in_background([(url, username, site_passwords[url]) for _, _, url, username, _ in sites_list if site_passwords[url] is not None], max_age=post_sync_interval, force=force_stats_refresh)
+            known_stats = stats_service.read([site[2] for site in sites_list])
+            stats_data = []
+            for _, name, url, _, _ in sites_list:
+                if site_passwords[url] is None:
+                    stats_data.append({"Nazwa": name, "URL": url, "Liczba wpisów": "⚠️ Błąd hasła", "Ostatni wpis": "N/A", "Stan na": "N/A"})
+                else:
+                    stats = known_stats.get(url, {})
+                    stats_data.append({"Nazwa": name, "URL": url, "Liczba wpisów": stats.get('total_posts', "⏳"), "Ostatni wpis": stats.get('last_post_date', "⏳"), "Stan na": (stats.get('fetched_at') or "⏳").replace("T", " ")})
+            st.dataframe(pd.DataFrame(stats_data), use_container_width=True, hide_index=True)
+            if stats_service.refreshing:
+                c1, c2 = st.columns([3, 1])
+                c1.caption(f"🔄 Odświeżanie w tle: {stats_service.refreshing} stron. Wyświetlane są ostatnio znane wartości.")
+                if c2.button("Pokaż najnowsze"): st.rerun(scope="fragment")
+
+        @st.fragment
+        def render_duplicate_finder(sites_list):
+            st.subheader("🧬 Duplikaty treści w sieci")
+            fingerprint_counts = fingerprint_index.site_counts()
+            st.caption(f"Indeks odcisków treści: {sum(fingerprint_counts.values())} wpisów z {len(fingerprint_counts)} stron.")
+            c1, c2 = st.columns(2)
+            if c1.button("Synchronizuj indeks odcisków", help="Pobiera treść wpisów zmienionych od ostatniej synchronizacji (przy pierwszym uruchomieniu - wszystkich) i zapisuje ich odciski SimHash."):
+                def sync_site(site_data):
+                    _, site_name, url, username, enc_pass = site_data
+                    decrypted_pass = decrypt_data(enc_pass, display_error=False)
+                    if decrypted_pass is None: return site_name, "⚠️ Błąd hasła"
+                    try:
+                        return site_name, sync_site_fingerprints(fingerprint_index, WordPressAPI(url, username, decrypted_pass), url)
+                    except Exception as e:
+                        return site_name, f"Błąd: {e}"
+                with st.spinner(f"Synchronizacja odcisków treści z {len(sites_list)} stron..."):
+                    with ThreadPoolExecutor(max_workers=8) as executor:
+                        dead_sites = health_monitor.unhealthy([site[2] for site in sites_list])
+                        sync_results = list(executor.map(sync_site, [site for site in sites_list if site[2] not in dead_sites]))
+                        sync_results += [(site[1], f"⏭️ Pominięto: {dead_sites[site[2]]}") for site in sites_list if site[2] in dead_sites]
+                st.dataframe(pd.DataFrame(sync_results, columns=["Strona", "Zaktualizowane wpisy"]), hide_index=True, use_container_width=True)
+            cross_site_only = c2.checkbox("Tylko duplikaty między różnymi stronami", value=True)
+            if c2.button("Znajdź duplikaty"):
+                duplicates = fingerprint_index.duplicate_pairs(cross_site_only=cross_site_only)
+                if duplicates: st.dataframe(pd.DataFrame(duplicates).sort_values("Odległość"), hide_index=True, use_container_width=True)
+                else: st.success("Nie znaleziono zduplikowanych treści.")
+
+        render_publication_chart(sites_list)
+        render_site_stats(sites_list)
+        render_duplicate_finder(sites_list)
 
 elif st.session_state.menu_choice == "Zarządzanie Personami":
     st.header("🎭 Zarządzanie Personami")
@@ -783,22 +3318,20 @@ elif st.session_state.menu_choice == "Zarządzanie Personami":
             persona_desc = st.text_area("Opis Persony", height=150, help="Opisz kim jest autor, jakie ma doświadczenie i styl.")
             if st.form_submit_button("Zapisz Personę"):
                 if persona_name and persona_desc:
-                    try:
-                        db_execute(conn, "INSERT INTO personas (name, description) VALUES (?, ?)", (persona_name, persona_desc))
-                        st.success(f"Persona '{persona_name}' zapisana!")
-                    except sqlite3.IntegrityError: st.error(f"Persona o nazwie '{persona_name}' już istnieje.")
+                    if workspace.insert("personas", operator, name=persona_name, description=persona_desc): st.success(f"Persona '{persona_name}' zapisana!")
+                    else: st.error(f"Persona o nazwie '{persona_name}' już istnieje.")
                 else: st.error("Nazwa i opis nie mogą być puste.")
 
     st.subheader("Lista zapisanych Person")
-    personas = db_execute(conn, "SELECT id, name, description FROM personas", fetch="all")
+    personas = db_execute(conn, "SELECT id, name, description, version FROM personas", fetch="all")
     if not personas: st.info("Brak zapisanych Person.")
     else:
-        for id, name, desc in personas:
+        for id, name, desc, version in personas:
             with st.expander(f"**{name}**"):
                 st.text_area("Opis", value=desc, height=100, disabled=True, key=f"desc_{id}")
                 if st.button("Usuń", key=f"delete_persona_{id}"):
-                    db_execute(conn, "DELETE FROM personas WHERE id = ?", (id,))
-                    st.rerun()
+                    if workspace.delete("personas", id, version, operator): st.rerun()
+                    else: st.warning(f"Persona '{name}' została w międzyczasie zmieniona przez innego operatora.")
 
 elif st.session_state.menu_choice == "🗺️ Strateg Tematyczny":
     st.header("🗺️ Strateg Tematyczny")
@@ -811,6 +3344,7 @@ elif st.session_state.menu_choice == "🗺️ Strateg Tematyczny":
         st.warning("Brak załadowanych stron. Przejdź do 'Zarządzanie Stronami'.")
     else:
         site_name = st.selectbox("Wybierz stronę do analizy", options=sites_options.keys())
+        max_groups = st.slider("Maksymalna liczba grup tematycznych analizowanych przez AI", min_value=2, max_value=60, value=20, help="Przy dużej liczbie wpisów tytuły są najpierw grupowane lokalnie, a AI dostaje tylko podsumowanie i reprezentatywne tytuły każdej grupy.")
 
         if st.button("Analizuj i Zaplanuj Klastry", type="primary"):
             site_info = sites_options[site_name]
@@ -822,114 +3356,26 @@ elif st.session_state.menu_choice == "🗺️ Strateg Tematyczny":
             api = WordPressAPI(site_info[2], site_info[3], decrypted_pass)
 
             with st.spinner(f"Pobieranie tytułów artykułów ze strony '{site_name}'..."):
-                all_posts = []
-                page = 1
-                while True:
-                    posts_data, _ = api._make_request("posts", params={"per_page": 100, "page": page, "_fields": "title.rendered"})
-                    if not posts_data:
-                        break
-                    all_posts.extend(posts_data)
-                    page += 1
-                
-                all_titles = [p['title']['rendered'] for p in all_posts]
+                try:
+                    posts = api.get_all_post_titles()
+                except requests.exceptions.RequestException as e:
+                    st.error(f"❌ Nie udało się pobrać wpisów ze strony '{site_name}': {e}")
+                    st.stop()
+                all_titles = [html_unescape(p['title']['rendered']) for p in posts]
+                with get_data_db_lock(), data_conn:
+                    store_post_titles(data_conn, site_info[2], posts)
 
             if not all_titles:
                 st.error("Nie znaleziono żadnych artykułów na tej stronie.")
             else:
+                with st.spinner(f"Lokalne grupowanie {len(all_titles)} tytułów..."):
+                    title_groups = build_title_groups(all_titles, max_groups=max_groups)
+                if len(title_groups) > 1:
+                    st.info(f"Pogrupowano lokalnie {len(all_titles)} tytułów w {len(title_groups)} grup. AI analizuje każdą grupę równolegle na podstawie reprezentatywnych tytułów.")
                 with st.spinner("AI analizuje strukturę tematyczną i szuka luk..."):
-                    CLUSTER_ANALYSIS_PROMPT = f"""Jesteś ekspertem SEO i strategiem treści specjalizującym się w optymalizacji pod AI search (GEO/AIO).
-
-Twoim zadaniem jest analiza listy tytułów artykułów z bloga i zaproponowanie UNIKALNYCH, NIE-DUPLIKUJĄCYCH tematów zoptymalizowanych pod systemy AI.
-
-# KROK 1: ANALIZA I GRUPOWANIE
-Przeanalizuj poniższe tytuły i pogrupuj je w logiczne klastry tematyczne:
-{'- ' + '\n- '.join(all_titles)}
-
-Nazwa klastra = ogólny, nadrzędny temat (np. "Marketing w mediach społecznościowych", "Pozycjonowanie lokalne", "Zdrowa dieta")
-
-# KROK 2: IDENTYFIKACJA PRAWDZIWYCH LUK (KRYTYCZNE!)
-Dla każdego klastra określ **co NAPRAWDĘ brakuje**, a nie tylko parafrazy istniejących tematów:
-
-❌ BŁĄD - Proponowanie parafraz:
-- Istniejący: "Jak zbudować skuteczną rutynę anti-aging"
-- ❌ ZŁA propozycja: "Jak stworzyć rutynę anti-aging krok po kroku"
-- ✅ DOBRA propozycja: "Jak modyfikować rutynę anti-aging podczas podróży służbowych?"
-
-Szukaj luk w:
-- **Specyficzne scenariusze użycia** (podróże, praca zdalna, małe mieszkanie, budżet do 100 zł)
-- **Niszowe przypadki brzegowe** (łączenie produktów, nietypowe typy skóry, choroby współistniejące)
-- **Zaawansowane porównania** (marka A vs B, składnik X w różnych stężeniach, procedura Y vs Z)
-- **Problematyczne sytuacje** (efekty uboczne, co zrobić gdy coś nie działa, jak naprawić błędy)
-- **Temporalne aspekty** (zmiany sezonowe, progresja w czasie, długoterminowe vs krótkoterminowe efekty)
-- **Aspekty ekonomiczne** (budżetowe alternatywy, stosunek ceny do jakości, gdzie zaoszczędzić)
-
-# KROK 3: GENEROWANIE PROPOZYCJI - ZASADA ZERO-DUPLIKACJI
-
-**ABSOLUTNIE ZABRONIONE:**
-- ❌ Parafrazowanie istniejących tytułów
-- ❌ Zmiana jednego słowa w istniejącym tytule
-- ❌ Dodanie "kompletny przewodnik" do istniejącego tematu
-- ❌ Zmiana kolejności słów w istniejącym tytule
-
-**PRZED dodaniem tematu do propozycji, SPRAWDŹ:**
-1. Czy odpowiada na INNE pytanie niż istniejące artykuły?
-2. Czy zawiera NOWY kąt/perspektywę?
-3. Czy dotyczy SPECYFICZNEGO scenariusza/przypadku?
-4. Czy NIE jest parafrazą żadnego z istniejących tytułów?
-
-**TYLKO jeśli odpowiedź na wszystkie 4 pytania to TAK - dodaj temat do propozycji.**
-
-# KROK 4: OPTYMALIZACJA POD AI SEARCH
-
-Każdy proponowany temat MUSI:
-
-1. **Być ultra-specyficzny i niszowy**
-   ✅ "Jak stosować retinol w rutynie anti-aging jeśli masz rozaceę? Bezpieczny protokół"
-   ✅ "Witamina C w serach: 10% vs 15% vs 20% - która dawka dla jakiego typu skóry?"
-   ✅ "Jak budować rutynę anti-aging z budżetem 200 zł miesięcznie? Priorytetyzacja zakupów"
-   ❌ "Jak stosować retinol w pielęgnacji?" (zbyt ogólne)
-
-2. **Odpowiadać na konkretne, zaawansowane pytanie**
-   ✅ "Co zrobić gdy niacynamid powoduje zaczerwienienia? Troubleshooting + alternatywy"
-   ✅ "Czy można łączyć kwas hialuronowy z retinolem w jednej rutynie? Bezpieczna kolejność"
-   ❌ "Jak stosować niacynamid?" (zbyt podstawowe)
-
-3. **Zawierać mierzalne parametry lub konkretne liczby**
-   ✅ "Ile czasu trzeba czekać między aplikacją witaminy C a kremu SPF? Nauka vs praktyka"
-   ✅ "Jak długo czekać na efekty peptydów miedziowych? Timeline 30/60/90 dni"
-   
-4. **Dotyczyć case study lub problematycznych sytuacji**
-   ✅ "Purging po retinolu: jak odróżnić od prawdziwej alergii? Mapa objawów"
-   ✅ "Które składniki aktywne nie powinny się znaleźć w jednej rutynie? Macierz kompatybilności"
-
-# WYMAGANY FORMAT JSON
-
-[
-  {{
-    "nazwa_klastra": "Nazwa nadrzędnego tematu",
-    "istniejace_artykuly": ["Tytuł 1", "Tytuł 2"],
-    "luki_w_tresci": "Opis KONKRETNYCH luk (nie ogólniki). Co użytkownicy chcą wiedzieć, a nie znajdą w istniejących artykułach?",
-    "proponowane_nowe_tematy": [
-      "Ultra-specyficzny temat 1 z jasnym kątem i kontekstem",
-      "Niszowy case study 2 z mierzalnymi parametrami",
-      "Zaawansowane porównanie 3 z konkretnymi liczbami",
-      "Problematyczna sytuacja 4 z troubleshooting",
-      "Scenariusz brzegowy 5 z praktycznymi ograniczeniami"
-    ]
-  }}
-]
-
-**PRZED ZWRÓCENIEM JSON - WYKONAJ SELF-CHECK:**
-Dla każdego proponowanego tematu upewnij się, że:
-- [ ] NIE jest parafrazą istniejącego tytułu
-- [ ] Zawiera UNIKALNY kąt/perspektywę
-- [ ] Jest ultra-specyficzny (nie ogólny)
-- [ ] Odpowiada na pytanie, którego istniejące artykuły NIE pokrywają
-
-WYGENERUJ TERAZ KOMPLETNĄ ANALIZĘ W FORMACIE JSON."""
                     try:
-                        response_str = call_gpt5_nano(openai_api_key, CLUSTER_ANALYSIS_PROMPT).strip().replace("```json", "").replace("```", "")
-                        cluster_data = json.loads(response_str)
+                        cluster_data, group_errors = analyze_title_groups(openai_api_key, title_groups, st.session_state.cluster_prompt)
+                        for error in group_errors: st.warning(error)
                         st.session_state.cluster_analysis_result = cluster_data
                     except Exception as e:
                         st.error(f"Błąd podczas analizy przez AI: {e}")
@@ -939,6 +3385,7 @@ WYGENERUJ TERAZ KOMPLETNĄ ANALIZĘ W FORMACIE JSON."""
         st.subheader("Wyniki Analizy i Propozycje Treści")
         
         all_new_topics = []
+        title_index = get_title_index().refresh()
         for cluster in st.session_state.cluster_analysis_result:
             with st.expander(f"**Klaster: {cluster['nazwa_klastra']}** ({len(cluster['istniejace_artykuly'])} istniejących, {len(cluster['proponowane_nowe_tematy'])} propozycji)"):
                 st.markdown("##### Istniejące artykuły w klastrze:")
@@ -951,7 +3398,11 @@ WYGENERUJ TERAZ KOMPLETNĄ ANALIZĘ W FORMACIE JSON."""
                 
                 st.markdown("##### 💡 Proponowane nowe tematy (zoptymalizowane pod AI search):")
                 for new_topic in cluster['proponowane_nowe_tematy']:
-                    st.write(f"- **{new_topic}**")
+                    match = title_index.best_match(new_topic)
+                    if match and match[0] >= NEAR_DUPLICATE_THRESHOLD:
+                        st.write(f"- ~~{new_topic}~~ ⚠️ zbliżony do: *{match[1]}* ({match[2]}, {match[0]:.0%})")
+                    else:
+                        st.write(f"- **{new_topic}**")
                     all_new_topics.append(new_topic)
 
         st.subheader("Akcje")
@@ -960,14 +3411,13 @@ WYGENERUJ TERAZ KOMPLETNĄ ANALIZĘ W FORMACIE JSON."""
                 if 'topics_from_strategist' not in st.session_state:
                     st.session_state.topics_from_strategist = ""
                 
-                existing_topics = st.session_state.topics_from_strategist.split('\n')
-                new_topics_set = set(all_new_topics)
-                
-                final_topics = existing_topics + [t for t in new_topics_set if t not in existing_topics]
-                st.session_state.topics_from_strategist = "\n".join(filter(None, final_topics))
+                existing_topics = [t for t in st.session_state.topics_from_strategist.split('\n') if t]
+                new_topics, rejected = filter_near_duplicate_topics(all_new_topics, get_title_index().refresh(), queued=existing_topics)
+                st.session_state.topics_from_strategist = "\n".join(existing_topics + new_topics)
+                st.session_state.dedup_report = rejected
                 
                 st.session_state.go_to_page = "Generator Briefów"
-                st.success(f"{len(new_topics_set)} unikalnych tematów dodanych! Przechodzenie do Generatora Briefów...")
+                st.success(f"{len(new_topics)} unikalnych tematów dodanych! Przechodzenie do Generatora Briefów...")
                 st.rerun()
 
 elif st.session_state.menu_choice == "Generator Briefów":
@@ -992,18 +3442,82 @@ elif st.session_state.menu_choice == "Generator Briefów":
             if style: site_styles[f"Styl: {name}"] = style
         selected_style_label = c2.selectbox("Styl wizualny obrazków", options=site_styles.keys())
         selected_style_prompt = site_styles[selected_style_label]
+        c1, c2 = st.columns(2)
+        skip_duplicates = c1.checkbox("Pomiń tematy zbliżone do istniejących wpisów", value=True, help="Tematy porównywane są lokalnie z tytułami wpisów całej sieci zapisanymi w bazie (Strateg Tematyczny, synchronizacja Dashboardu, webhook) oraz ze sobą nawzajem (MinHash na 3-gramach znakowych). Duplikaty nie zużywają wywołań AI.")
+        dedup_threshold = c2.slider("Próg podobieństwa", min_value=0.5, max_value=1.0, value=NEAR_DUPLICATE_THRESHOLD, step=0.05, disabled=not skip_duplicates)
+        c1, c2 = st.columns(2)
+        batch_mode = c1.checkbox("Tryb wsadowy (OpenAI Batch API)", help="Dla dużych, niepilnych partii: briefy są wysyłane jako jedno zadanie wsadowe (tańsze, wyniki do 24h). Obrazki powstają po pobraniu wyników.")
+        resume_checkpoints = c1.checkbox("Wznawiaj z punktów kontrolnych", value=True, help="Każdy gotowy brief (z obrazkami) jest od razu zapisywany na dysku. Ponowne uruchomienie tej samej partii - np. po awarii lub restarcie aplikacji - generuje tylko brakujące tematy.")
+        image_variants = c2.number_input("Wariantów obrazka na temat", min_value=1, max_value=4, value=1, help=f"Obrazki generuje wspólna pula {IMAGE_WORKERS} wątków z limitem {IMAGE_REQUESTS_PER_MINUTE} wywołań/min na klucz API; gotowe pliki trafiają od razu na dysk.")
+
+        if st.session_state.get('dedup_report'):
+            with st.expander(f"🔁 Odrzucone near-duplikaty ({len(st.session_state.dedup_report)})"):
+                for topic, similar, source, score in st.session_state.dedup_report:
+                    st.write(f"- **{topic}** → *{similar}* ({source}, {score:.0%})")
 
         if st.button("Generuj briefy i obrazki", type="primary"):
             topics = [topic.strip() for topic in topics_input.split('\n') if topic.strip()]
-            if topics:
-                st.session_state.generated_briefs = []
-                with st.spinner(f"Generowanie {len(topics)} briefów..."):
-                    for topic in topics:
-                        _, brief, img, err = generate_brief_and_image(openai_api_key, google_api_key, topic, aspect_ratio, selected_style_prompt, st.session_state.brief_prompt)
-                        st.session_state.generated_briefs.append({ "topic": topic, "brief": brief, "image": img, "image_error": err })
+            if topics and skip_duplicates:
+                topics, rejected = filter_near_duplicate_topics(topics, get_title_index().refresh(), threshold=dedup_threshold)
+                st.session_state.dedup_report = rejected
+                if rejected: st.info(f"Pominięto {len(rejected)} tematów zbliżonych do istniejących wpisów lub do siebie nawzajem.")
+            if topics and batch_mode:
+                try:
+                    runner = OpenAIBatchRunner(openai.OpenAI(api_key=openai_api_key))
+                    job = submit_brief_batch(runner, topics, st.session_state.brief_prompt, aspect_ratio, selected_style_prompt, image_variants)
+                    st.session_state.batch_jobs.append(job)
+                    checkpoint_batch_job(job, operator)
+                    st.success(f"Wysłano zadanie wsadowe {job['id']} ({len(topics)} briefów).")
+                except Exception as e:
+                    st.error(f"Nie udało się wysłać zadania wsadowego: {e}")
+            elif topics:
+                checkpoints = get_generation_checkpoints()
+                keys = {topic: brief_checkpoint_key(topic, st.session_state.brief_prompt, aspect_ratio, selected_style_prompt, image_variants) for topic in topics}
+                run_id = checkpoints.run_id(keys.values())
+                done = checkpoints.load("brief", run_id) if resume_checkpoints else {}
+                pending = [topic for topic in dict.fromkeys(topics) if keys[topic] not in done]
+                if len(pending) < len(topics): st.info(f"Wznowiono {len(topics) - len(pending)} briefów z punktów kontrolnych - generowanie tylko brakujących ({len(pending)}).")
+                progress_bar = st.progress(0)
+                status_text = st.empty()
+                with st.spinner(f"Generowanie {len(pending)} briefów..."):
+                    with ThreadPoolExecutor(max_workers=8) as executor:
+                        outstanding = {executor.submit(generate_brief_and_image, openai_api_key, google_api_key, topic, aspect_ratio, selected_style_prompt, st.session_state.brief_prompt, image_variants) for topic in pending}
+                        # Każdy brief trafia do checkpointu, gdy gotowy jest on i wszystkie jego obrazki.
+                        image_jobs, image_owner = {}, {}
+                        briefs_done = topics_done = 0
+                        while outstanding:
+                            finished, outstanding = wait(outstanding, return_when=FIRST_COMPLETED)
+                            for future in finished:
+                                if future in image_owner:
+                                    topic = image_owner.pop(future)
+                                    if topic not in image_jobs or not all(f.done() for f in image_jobs[topic][1]): continue
+                                    item, image_futures = image_jobs.pop(topic)
+                                    item['image_variants'], item['image_error'] = collect_image_variants(image_futures)
+                                    item['image'] = item['image_variants'][0] if item['image_variants'] else None
+                                    checkpoints.save("brief", run_id, keys[topic], item)
+                                    topics_done += 1
+                                else:
+                                    topic, brief, image_prompt, image_futures, err = future.result()
+                                    item = {"topic": topic, "brief": brief, "image": None, "image_variants": [], "image_prompt": image_prompt, "image_error": err}
+                                    done[keys[topic]] = item
+                                    briefs_done += 1
+                                    if image_futures:
+                                        image_jobs[topic] = (item, image_futures)
+                                        image_owner.update(dict.fromkeys(image_futures, topic))
+                                        outstanding.update(image_futures)
+                                    else:
+                                        if 'error' not in brief: checkpoints.save("brief", run_id, keys[topic], item)
+                                        topics_done += 1
+                            progress_bar.progress((briefs_done + topics_done) / (2 * len(pending)))
+                            status_text.text(f"Briefy: {briefs_done}/{len(pending)}, gotowe z obrazkami: {topics_done}/{len(pending)}")
+                st.session_state.generated_briefs = [done[keys[topic]] for topic in dict.fromkeys(topics)]
+                progress_bar.empty()
+                status_text.empty()
                 st.success("Generowanie zakończone!")
             else: st.error("Wpisz przynajmniej jeden temat.")
 
+        render_batch_jobs_panel()
+
         if st.session_state.generated_briefs:
             st.subheader("Wygenerowane Briefy")
             if st.button("Przejdź do generowania artykułów"):
@@ -1014,13 +3528,20 @@ elif st.session_state.menu_choice == "Generator Briefów":
                     c1, c2 = st.columns(2)
                     c1.json(item['brief'])
                     with c2:
-                        if item['image']: st.image(item['image'], use_column_width=True)
+                        variants = item.get('image_variants') or ([item['image']] if item['image'] else [])
+                        if len(variants) > 1:
+                            item['image'] = st.radio("Wybrany wariant", options=variants, index=variants.index(item['image']), format_func=lambda ref: f"Wariant {variants.index(ref) + 1}", horizontal=True, key=f"image_variant_{i}")
+                            st.image([image_store.path(ref) for ref in variants], width=160)
+                        if item['image']: st.image(image_store.path(item['image']), use_column_width=True)
+                        if item.get('image_prompt'): st.caption(f"Prompt obrazka: {item['image_prompt']}")
                         if item['image_error']: st.warning(item['image_error'])
 
 elif st.session_state.menu_choice == "Generowanie Treści":
     st.header("🤖 Generator Treści AI (Jednoetapowy)")
     st.info("✨ Artykuły generowane w JEDNYM wywołaniu API, zoptymalizowane pod AI search (GEO/AIO)")
     
+    render_batch_jobs_panel()
+
     if not st.session_state.generated_briefs: 
         st.warning("Brak briefów. Przejdź do 'Generator Briefów'.")
     else:
@@ -1028,64 +3549,105 @@ elif st.session_state.menu_choice == "Generowanie Treści":
         if not personas: 
             st.error("Brak Person. Przejdź do 'Zarządzanie Personami'.")
         else:
-            c1, c2 = st.columns(2)
-            persona_name = c1.selectbox("Wybierz Personę autora", options=personas.keys())
-            c2.info("Model: **gpt-5-nano** (Single-pass generation)")
-
-            valid_briefs = [b for b in st.session_state.generated_briefs if 'error' not in b['brief']]
-            if valid_briefs:
-                df = pd.DataFrame(valid_briefs)
-                df['Zaznacz'] = False
-                df['Temat'] = df['brief'].apply(lambda x: x.get('temat_artykulu', 'B/D'))
-                df['Ma obrazek'] = df['image'].apply(lambda x: "✅" if x else "❌")
-
-                with st.form("article_generation_form"):
-                    edited_df = st.data_editor(df[['Zaznacz', 'Temat', 'Ma obrazek']], hide_index=True, use_container_width=True)
-                    if st.form_submit_button("Generuj zaznaczone artykuły", type="primary"):
-                        indices = edited_df[edited_df.Zaznacz].index.tolist()
-                        if indices:
-                            tasks = []
-                            for i in indices:
-                                brief = valid_briefs[i]['brief']
-                                relacje = brief.get("relacje_leksykalne", {})
+            @st.fragment
+            def render_article_generation(personas):
+                """Wybór person, opcji i briefów oraz postęp generowania - interakcje przeładowują tylko ten fragment."""
+                c1, c2 = st.columns(2)
+                persona_name = c1.selectbox("Wybierz Personę autora", options=personas.keys())
+                article_models = c2.multiselect("Modele (pierwszy - główny, kolejne - zapasowe)", options=list(TEXT_MODELS), default=["gpt-5-nano"], help="Przy błędzie modelu lub odpowiedzi wolniejszej niż zwykle (p90) zapytanie trafia równolegle do kolejnego modelu z listy i liczy się pierwsza poprawna odpowiedź. Tryb wsadowy zawsze używa gpt-5-nano.")
+                batch_mode = c2.checkbox("Tryb wsadowy (OpenAI Batch API)", help="Artykuły, a potem meta tagi, są wysyłane jako zadania wsadowe. Wyniki trafiają do harmonogramu po pobraniu w panelu zadań wsadowych.")
+                repair_sections = c1.checkbox("Poprawiaj sekcje z problemami", value=True, help="Każdy artykuł przechodzi przez sanitizer HTML (tylko dozwolone znaczniki). Sekcje H2 z za długimi akapitami, zbyt krótkie, złożone z samych list lub urwane są generowane ponownie - pojedynczo, bez ponownego pisania całego artykułu.")
+                resume_checkpoints = c2.checkbox("Wznawiaj z punktów kontrolnych", value=True, help="Każdy gotowy artykuł (z meta tagami) jest od razu zapisywany na dysku. Ponowne uruchomienie tej samej partii po przerwaniu generuje tylko brakujące artykuły.")
+                sectioned_mode = c1.checkbox("Tematy SZEROKIE: sekcje równolegle", value=False, help=f"Długie artykuły (SZEROKI, min. {MIN_SECTIONED_TOPICS} zagadnienia) są pisane jako wstęp i osobne sekcje H2 według planu z zagadnień kluczowych - wszystkie jednocześnie, ze wspólnym kontekstem - a potem zszywane i ujednolicane. Mniejsze ryzyko urwania tekstu i krótszy czas. Nie dotyczy trybu wsadowego.")
+                cache_layout = c1.checkbox("Układ przyjazny dla cache promptów", value=True, help="Zasady i szablon Master Promptu trafiają do stałej wiadomości systemowej, a zmienia się tylko wiadomość ze zmiennymi briefu. OpenAI obsługuje wtedy wspólny prefiks z cache, co obniża koszt i czas odpowiedzi.")
+                cache_stats = st.session_state.prompt_cache_stats
+                if cache_stats.calls:
+                    c2.metric("Tokeny promptu z cache", f"{cache_stats.cached_ratio:.0%}", help=f"{cache_stats.cached_tokens} z {cache_stats.prompt_tokens} tokenów promptu w {cache_stats.calls} wywołaniach")
+                model_router = get_model_router()
+                if model_router.wins:
+                    c2.caption("Odpowiedzi wg modelu: " + ", ".join(f"{name}: {count}" for name, count in model_router.wins.most_common()) + f" · hedging: {model_router.hedges} · fallback: {model_router.fallbacks}")
+
+                valid_briefs = [b for b in st.session_state.generated_briefs if 'error' not in b['brief']]
+                if valid_briefs:
+                    df = pd.DataFrame(valid_briefs)
+                    df['Zaznacz'] = False
+                    df['Temat'] = df['brief'].apply(lambda x: x.get('temat_artykulu', 'B/D'))
+                    df['Ma obrazek'] = df['image'].apply(lambda x: "✅" if x else "❌")
+
+                    with st.form("article_generation_form"):
+                        edited_df = st.data_editor(df[['Zaznacz', 'Temat', 'Ma obrazek']], hide_index=True, use_container_width=True)
+                        if st.form_submit_button("Generuj zaznaczone artykuły", type="primary"):
+                            indices = edited_df[edited_df.Zaznacz].index.tolist()
+                            master_template = compile_prompt_template(st.session_state.master_prompt)
+                            unknown_vars, _ = master_template.validate(MASTER_PROMPT_VARIABLES)
+                            if unknown_vars:
+                                st.error(f"Master Prompt zawiera nieznane zmienne: {', '.join(unknown_vars)}. Popraw szablon w 'Edytor Promptów'.")
+                            elif indices and not batch_mode and not get_model_router().available(article_models, api_keys):
+                                st.error("Wybierz co najmniej jeden model, dla którego ustawiono klucz API.")
+                            elif indices:
+                                system_prompt = build_article_system_prompt(st.session_state.master_prompt) if cache_layout else None
+                                tasks = []
+                                for i in indices:
+                                    brief = valid_briefs[i]['brief']
+                                    variables = build_master_prompt_variables(brief, personas[persona_name])
                                 
-                                prompt = st.session_state.master_prompt \
-                                    .replace("{{PERSONA_DESCRIPTION}}", personas[persona_name]) \
-                                    .replace("{{TEMAT_ARTYKULU}}", brief.get("temat_artykulu", "")) \
-                                    .replace("{{ANALIZA_TEMATU}}", "SZEROKI" if "szeroki" in brief.get("analiza_tematu", "").lower() else "WĄSKI") \
-                                    .replace("{{GRUPA_DOCELOWA}}", brief.get("grupa_docelowa", "")) \
-                                    .replace("{{ZAGADNIENIA_KLUCZOWE}}", "\n".join(f"- {z}" for z in brief.get("zagadnienia_kluczowe", []))) \
-                                    .replace("{{SLOWA_KLUCZOWE}}", ", ".join(brief.get("slowa_kluczowe", []))) \
-                                    .replace("{{DODATKOWE_SLOWA_SEMANTYCZNE}}", ", ".join(brief.get("dodatkowe_slowa_semantyczne", []))) \
-                                    .replace("{{HIPERONIMY}}", ", ".join(relacje.get("hiperonimy", []))) \
-                                    .replace("{{HIPONIMY}}", ", ".join(relacje.get("hiponimy", []))) \
-                                    .replace("{{SYNOMINY}}", ", ".join(relacje.get("synonimy", [])))
+                                    if cache_layout:
+                                        prompt = build_article_user_prompt({k: v for k, v in variables.items() if k in master_template.variables})
+                                    else:
+                                        prompt = master_template.render(variables)
                                 
-                                tasks.append({'title': brief['temat_artykulu'], 'prompt': prompt, 'keywords': brief.get('slowa_kluczowe', []), 'image': valid_briefs[i]['image']})
-
-                            st.session_state.generated_articles = []
-                            progress_bar = st.progress(0)
-                            status_text = st.empty()
+                                    tasks.append({'title': brief['temat_artykulu'], 'prompt': prompt, 'keywords': brief.get('slowa_kluczowe', []), 'image': valid_briefs[i]['image'], 'variables': variables, 'topics': brief.get('zagadnienia_kluczowe', [])})
+
+                                if batch_mode:
+                                    try:
+                                        runner = OpenAIBatchRunner(openai.OpenAI(api_key=openai_api_key))
+                                        job = submit_article_batch(runner, tasks, system_prompt)
+                                        st.session_state.batch_jobs.append(job)
+                                        checkpoint_batch_job(job, operator)
+                                        st.success(f"Wysłano zadanie wsadowe {job['id']} ({len(tasks)} artykułów). Sprawdź status w panelu zadań wsadowych.")
+                                    except Exception as e:
+                                        st.error(f"Nie udało się wysłać zadania wsadowego: {e}")
+                                else:
+                                    checkpoints = get_generation_checkpoints()
+                                    for t in tasks: t['checkpoint'] = article_checkpoint_key(t, system_prompt, sectioned_mode and is_sectioned_candidate(t['variables'], t['topics']))
+                                    run_id = checkpoints.run_id(t['checkpoint'] for t in tasks)
+                                    done = checkpoints.load("article", run_id) if resume_checkpoints else {}
+                                    st.session_state.generated_articles = [done[t['checkpoint']] for t in tasks if t['checkpoint'] in done]
+                                    tasks = [t for t in tasks if t['checkpoint'] not in done]
+                                    if done: st.info(f"Wznowiono {len(st.session_state.generated_articles)} artykułów z punktów kontrolnych - generowanie tylko brakujących ({len(tasks)}).")
+                                    progress_bar = st.progress(0)
+                                    status_text = st.empty()
                             
-                            with st.spinner(f"Generowanie {len(tasks)} artykułów (jednoetapowo)..."):
-                                with ThreadPoolExecutor(max_workers=5) as executor:
-                                    futures = {executor.submit(generate_article_dispatcher, "gpt-5-nano", openai_api_key, t['title'], t['prompt']): t for t in tasks}
-                                    completed = 0
-                                    for future in as_completed(futures):
-                                        task = futures[future]
-                                        title, content = future.result()
-                                        meta = generate_meta_tags_gpt5(openai_api_key, title, content, task['keywords'])
-                                        st.session_state.generated_articles.append({"title": title, "content": content, "image": task['image'], **meta})
+                                    with st.spinner(f"Generowanie {len(tasks)} artykułów (jednoetapowo)..."):
+                                        with ThreadPoolExecutor(max_workers=max(5, TEXT_MODELS[article_models[0]]["concurrency"])) as executor:
+                                            futures = {}
+                                            for t in tasks:
+                                                if sectioned_mode and is_sectioned_candidate(t['variables'], t['topics']):
+                                                    future = executor.submit(generate_article_sectioned, api_keys, t['title'], t['variables'], t['topics'], t['keywords'], cache_stats, article_models, repair_sections)
+                                                else:
+                                                    future = executor.submit(generate_article_dispatcher, article_models, api_keys, t['title'], t['prompt'], system_prompt, cache_stats, repair_sections)
+                                                futures[future] = t
+                                            completed = 0
+                                            for future in as_completed(futures):
+                                                task = futures[future]
+                                                title, content = future.result()
+                                                meta = generate_meta_tags_gpt5(openai_api_key, title, content, task['keywords'])
+                                                structure = summarize_article_structure(sanitize_article_html(content)[1])
+                                                article = {"title": title, "content": content, "image": task['image'], "structure": structure, **meta}
+                                                st.session_state.generated_articles.append(article)
+                                                if not content.startswith("<p><strong>BŁĄD"): checkpoints.save("article", run_id, task['checkpoint'], article)
                                         
-                                        completed += 1
-                                        progress_bar.progress(completed / len(tasks))
-                                        status_text.text(f"Wygenerowano {completed}/{len(tasks)} artykułów")
+                                                completed += 1
+                                                progress_bar.progress(completed / len(tasks))
+                                                status_text.text(f"Wygenerowano {completed}/{len(tasks)} artykułów")
                             
-                            progress_bar.empty()
-                            status_text.empty()
-                            st.success("✅ Generowanie zakończone!")
-                            st.session_state.go_to_page = "Harmonogram Publikacji"
-                            st.rerun()
+                                    progress_bar.empty()
+                                    status_text.empty()
+                                    st.success("✅ Generowanie zakończone!")
+                                    st.session_state.go_to_page = "Harmonogram Publikacji"
+                                    st.rerun()
+
+            render_article_generation(personas)
 
 elif st.session_state.menu_choice == "Harmonogram Publikacji":
     st.header("🗓️ Harmonogram Publikacji")
@@ -1098,82 +3660,152 @@ elif st.session_state.menu_choice == "Harmonogram Publikacji":
             df = pd.DataFrame(st.session_state.generated_articles)
             df['Zaznacz'] = True
             df['Ma obrazek'] = df['image'].apply(lambda x: "✅" if x else "❌")
+            structure_columns = ["Słowa", "H2", "H3", "Q&A", "Tabele", "Problemy"]
+            df[structure_columns] = pd.DataFrame([a.get('structure') or summarize_article_structure(sanitize_article_html(a['content'])[1]) for a in st.session_state.generated_articles], index=df.index)[structure_columns]
+
+            @st.fragment
+            def render_category_picker(sites_options):
+                """Kategorie poza formularzem: zmiana strony źródłowej od razu przeładowuje listę (tylko ten fragment, z cache)."""
+                st.subheader("Kategorie wpisów")
+                cat_site = st.selectbox("Pobierz kategorie ze strony:", options=sites_options.keys(), key="cat_site_selector")
+                cat_site_info = sites_options[cat_site]
+                decrypted_cat_pass = decrypt_cached(cat_site_info[4])
+                if decrypted_cat_pass is None:
+                    st.error(f"❌ Nie można odszyfrować hasła dla '{cat_site}'. Pomiń lub napraw konfigurację.")
+                    categories = {}
+                else:
+                    categories = get_categories_for_site(cat_site_info[2], cat_site_info[3], decrypted_cat_pass)
+                st.session_state.schedule_categories = st.multiselect("Wybierz kategorie", options=categories.keys(), key=f"schedule_categories_{cat_site}")
+
+            render_category_picker(sites_options)
 
             with st.form("bulk_schedule_form"):
                 st.subheader("1. Wybierz artykuły do publikacji")
-                edited_df = st.data_editor(df[['Zaznacz', 'title', 'Ma obrazek', 'meta_title', 'meta_description']], hide_index=True, use_container_width=True, column_config={"title": "Tytuł", "Ma obrazek": st.column_config.TextColumn("Obrazek", width="small"), "meta_title": "Meta Tytuł", "meta_description": "Meta Opis"})
+                edited_df = st.data_editor(df[['Zaznacz', 'title', 'Ma obrazek', *structure_columns, 'meta_title', 'meta_description']], hide_index=True, use_container_width=True, disabled=structure_columns, column_config={"title": "Tytuł", "Ma obrazek": st.column_config.TextColumn("Obrazek", width="small"), "meta_title": "Meta Tytuł", "meta_description": "Meta Opis"})
 
                 st.subheader("2. Ustawienia publikacji")
                 c1, c2 = st.columns(2)
                 selected_sites = c1.multiselect("Wybierz strony docelowe", options=sites_options.keys())
                 author_id = c2.number_input("ID Autora (opcjonalnie)", min_value=1, step=1)
 
-                # Kategorie - pobierz dla wybranej strony
-                cat_site = st.selectbox("Pobierz kategorie ze strony:", options=sites_options.keys(), key="cat_site_selector")
-                
-                # Pobierz kategorie dynamicznie dla wybranej strony
-                cat_site_info = sites_options[cat_site]
-                decrypted_cat_pass = decrypt_data(cat_site_info[4])
-                
-                if decrypted_cat_pass is None:
-                    st.error(f"❌ Nie można odszyfrować hasła dla '{cat_site}'. Pomiń lub napraw konfigurację.")
-                    categories = {}
-                else:
-                    # Cache per strona - klucz zawiera nazwę strony
-                    @st.cache_data(ttl=300)
-                    def get_categories_for_site(site_name, site_url, site_user, site_pass):
-                        api = WordPressAPI(site_url, site_user, site_pass)
-                        return api.get_categories()
-                    
-                    categories = get_categories_for_site(cat_site, cat_site_info[2], cat_site_info[3], decrypted_cat_pass)
-                
-                selected_cats = st.multiselect("Wybierz kategorie", options=categories.keys())
-                tags_str = st.text_input("Tagi (oddzielone przecinkami)")
+                selected_cats = st.session_state.get('schedule_categories', [])
+                st.caption(f"Kategorie: {', '.join(selected_cats) or 'brak'} (wybór powyżej formularza)")
+                tags_str = st.text_input("Tagi (oddzielone przecinkami)", help="Brakujące tagi są tworzone na stronach docelowych raz na całą partię.")
+                create_missing_cats = st.checkbox("Twórz brakujące kategorie na stronach docelowych", value=False, help="Bez tej opcji kategorie, których nie ma na danej stronie, są pomijane.")
 
                 st.subheader("3. Planowanie")
                 c1,c2,c3 = st.columns(3)
                 start_date_val = c1.date_input("Data pierwszego wpisu", datetime.now())
                 start_time_val = c2.time_input("Godzina pierwszego wpisu", datetime.now().time())
-                interval = c3.number_input("Odstęp (godziny)", min_value=1, value=8)
+                interval = c3.number_input("Odstęp (godziny)", min_value=1, value=8, help="Minimalny odstęp między wpisami na tej samej stronie - także względem wpisów już zaplanowanych.")
+                c1, c2 = st.columns(2)
+                max_per_day = c1.number_input("Maks. wpisów dziennie na stronę (0 = bez limitu)", min_value=0, value=0, step=1)
+                jitter_minutes = c2.number_input("Losowe przesunięcie (minuty)", min_value=0, value=45, step=5, help="Każda publikacja jest losowo przesuwana, aby strony nie publikowały o identycznych godzinach.")
+                skip_unhealthy = st.checkbox("Pomijaj strony niedostępne wg monitora stanu", value=True, help=f"Strony z błędem autoryzacji albo z {HEALTH_FAILURE_THRESHOLD} kolejnymi nieudanymi testami (users/me: timeout, brak połączenia) są pomijane z góry zamiast spowalniać całą partię.")
+                block_duplicates = st.checkbox("Blokuj treści już opublikowane w sieci", value=True, help="Przed publikacją treść jest porównywana z indeksem odcisków (SimHash) wszystkich stron. Ten sam artykuł trafi tylko na pierwszą stronę - na pozostałych zostanie pominięty.")
 
-                if st.form_submit_button("Zaplanuj zaznaczone artykuły", type="primary"):
+                c1, c2 = st.columns(2)
+                preview_clicked = c1.form_submit_button("👁️ Podgląd planu")
+                schedule_clicked = c2.form_submit_button("Zaplanuj zaznaczone artykuły", type="primary")
+                if preview_clicked or schedule_clicked:
                     selected = edited_df[edited_df.Zaznacz]
                     if not selected.empty and selected_sites:
-                        pub_time = datetime.combine(start_date_val, start_time_val)
                         tags_list = [tag.strip() for tag in tags_str.split(',') if tag.strip()]
 
-                        with st.spinner("Planowanie publikacji..."):
-                            for index, row in selected.iterrows():
-                                article = st.session_state.generated_articles[index]
-                                for site_name in selected_sites:
+                        site_passwords = {name: decrypt_cached(sites_options[name][4]) for name in selected_sites}
+                        for name in [n for n, p in site_passwords.items() if p is None]:
+                            st.error(f"❌ [{name}]: Nie można odszyfrować hasła. Pomijam tę stronę.")
+                        target_sites = [n for n, p in site_passwords.items() if p is not None]
+                        if skip_unhealthy:
+                            dead_sites = health_monitor.unhealthy([sites_options[n][2] for n in target_sites])
+                            for name in [n for n in target_sites if sites_options[n][2] in dead_sites]:
+                                st.warning(f"⏭️ [{name}]: Pomijam - monitor stanu zgłasza problem: {dead_sites[sites_options[name][2]]}")
+                            target_sites = [n for n in target_sites if sites_options[n][2] not in dead_sites]
+
+                        with st.spinner(f"Pobieranie zaplanowanych wpisów z {len(target_sites)} stron..."):
+                            with ThreadPoolExecutor(max_workers=8) as executor:
+                                futures = {name: executor.submit(get_scheduled_dates_for_site, sites_options[name][2], sites_options[name][3], site_passwords[name]) for name in target_sites}
+                                existing_by_site = {}
+                                for name, future in futures.items():
+                                    try:
+                                        existing_by_site[name] = future.result()
+                                    except requests.exceptions.RequestException as e:
+                                        st.warning(f"⏭️ [{name}]: Pomijam - nie udało się pobrać zaplanowanych wpisów (bez nich nie da się zachować odstępów): {e}")
+                        target_sites = [n for n in target_sites if n in existing_by_site]
+
+                        # Sloty zarezerwowane przez innych operatorów (jeszcze niewidoczne w WordPressie) też są zajęte.
+                        # Plan zapisywany jest tylko, jeśli nikt nie zarezerwował nic na tych stronach od migawki - inaczej liczony od nowa.
+                        reservations = ScheduleReservations(shared_workspace)
+                        for attempt in range(3):
+                            reserved, schedule_revisions = reservations.snapshot([sites_options[name][2] for name in target_sites])
+                            busy_by_site = {name: existing_by_site[name] + reserved[sites_options[name][2]] for name in target_sites}
+                            plan = plan_publication_schedule(selected.index.tolist(), target_sites, datetime.combine(start_date_val, start_time_val), interval, busy_by_site, max_per_day, jitter_minutes)
+                            reserved_entries = [(sites_options[p['site']][2], p['publish_at'], selected.loc[p['article'], 'title']) for p in plan]
+                            if preview_clicked or not reservations.reserve(reserved_entries, schedule_revisions, operator): break
+                        else:
+                            st.error("Inni operatorzy właśnie planują wpisy na tych samych stronach - nic nie zostało zaplanowane. Spróbuj ponownie za chwilę.")
+                            st.stop()
+
+                        if preview_clicked:
+                            st.dataframe(pd.DataFrame([{"Data publikacji": p['publish_at'].strftime('%Y-%m-%d %H:%M'), "Strona": p['site'], "Tytuł": selected.loc[p['article'], 'title'], "Już zaplanowanych na stronie": len(busy_by_site.get(p['site'], []))} for p in plan]), hide_index=True, use_container_width=True)
+                        else:
+                            taxonomy_resolver = get_taxonomy_resolver()
+                            def resolve_site_terms(site_name):
+                                api = WordPressAPI(sites_options[site_name][2], sites_options[site_name][3], site_passwords[site_name])
+                                try:
+                                    cat_ids, missing_cats = taxonomy_resolver.resolve(api, "categories", selected_cats, create_missing=create_missing_cats)
+                                    tag_ids, missing_tags = taxonomy_resolver.resolve(api, "tags", tags_list, create_missing=True)
+                                except requests.exceptions.RequestException as e:
+                                    return [], [], [f"{', '.join(list(selected_cats) + list(tags_list))} (błąd pobierania taksonomii: {e})"]
+                                return cat_ids, tag_ids, missing_cats + missing_tags
+                            plan_sites = list(dict.fromkeys(entry['site'] for entry in plan))
+                            with st.spinner(f"Dopasowywanie kategorii i tagów na {len(plan_sites)} stronach..."):
+                                with ThreadPoolExecutor(max_workers=8) as executor:
+                                    site_terms = dict(zip(plan_sites, executor.map(resolve_site_terms, plan_sites)))
+                            for site_name, (_, _, unresolved) in site_terms.items():
+                                if unresolved: st.warning(f"[{site_name}]: Pominięto kategorie/tagi, których nie ma lub nie udało się utworzyć: {', '.join(unresolved)}")
+
+                            article_simhashes = {}
+                            with st.spinner("Przygotowywanie obrazków wyróżniających..."):
+                                upload_refs = image_store.prepare_for_upload(st.session_state.generated_articles[entry['article']].get('image') for entry in plan)
+                            with st.spinner(f"Planowanie {len(plan)} publikacji..."):
+                                for entry in plan:
+                                    index, site_name = entry['article'], entry['site']
+                                    row = selected.loc[index]
+                                    article = st.session_state.generated_articles[index]
                                     site_info = sites_options[site_name]
-                                    decrypted_pub_pass = decrypt_data(site_info[4])
-                                    if decrypted_pub_pass is None:
-                                        st.error(f"❌ [{site_name}]: Nie można odszyfrować hasła. Pomijam tę stronę.")
-                                        continue
-                                    
-                                    api_pub = WordPressAPI(site_info[2], site_info[3], decrypted_pub_pass)
-                                    
-                                    site_cats = api_pub.get_categories()
-                                    cat_ids = [site_cats[name] for name in selected_cats if name in site_cats]
 
-                                    success, msg, _ = api_pub.publish_post(
+                                    if block_duplicates:
+                                        if index not in article_simhashes: article_simhashes[index] = simhash_text(html_to_text(article['content']))
+                                        duplicates = fingerprint_index.find_similar(simhash=article_simhashes[index])
+                                        if duplicates:
+                                            dup_site, dup_id, dup_title, _, _ = duplicates[0]
+                                            st.warning(f"[{site_name}]: Pominięto '{row['title']}' - identyczna treść istnieje już jako wpis ID {dup_id} ('{dup_title}') na {dup_site}.")
+                                            continue
+
+                                    api_pub = WordPressAPI(site_info[2], site_info[3], site_passwords[site_name])
+
+                                    cat_ids, tag_ids, _ = site_terms[site_name]
+                                    success, msg, link, post_id = api_pub.publish_post(
                                         title=row['title'],
                                         content=article['content'],
                                         status="future",
-                                        publish_date=pub_time.isoformat(),
+                                        publish_date=entry['publish_at'].isoformat(),
                                         category_ids=cat_ids,
-                                        tags=tags_list,
+                                        tag_ids=tag_ids,
                                         author_id=(author_id if author_id > 0 else None),
-                                        featured_image_bytes=article.get('image'),
+                                        featured_image_bytes=image_store.load(upload_refs[article['image']]) if article.get('image') else None,
                                         meta_title=row['meta_title'],
-                                        meta_description=row['meta_description']
+                                        meta_description=row['meta_description'],
+                                        featured_image_ext=os.path.splitext(upload_refs[article['image']])[1].lstrip(".") if article.get('image') else "png"
                                     )
-                                    if success: st.success(f"[{site_name}]: {msg}")
+                                    if success:
+                                        fingerprint_index.record(site_info[2], post_id, row['title'], article['content'], link)
+                                        st.success(f"[{site_name}] {entry['publish_at'].strftime('%Y-%m-%d %H:%M')}: {msg}")
                                     else: st.error(f"[{site_name}]: {msg}")
-                                
-                                pub_time += timedelta(hours=interval)
-                        st.balloons()
+                            get_scheduled_dates_for_site.clear()
+                            reservations.release(reserved_entries)
+                            st.balloons()
 
 elif st.session_state.menu_choice == "Zarządzanie Treścią":
     st.header("✏️ Zarządzanie Treścią")
@@ -1182,7 +3814,7 @@ elif st.session_state.menu_choice == "Zarządzanie Treścią":
     if sites_options:
         site_name = st.selectbox("Wybierz stronę", options=sites_options.keys())
         site_info = sites_options[site_name]
-        decrypted_content_pass = decrypt_data(site_info[4])
+        decrypted_content_pass = decrypt_cached(site_info[4])
         
         if decrypted_content_pass is None:
             st.error("❌ Nie można odszyfrować hasła dla wybranej strony. Sprawdź konfigurację lub ponownie dodaj stronę.")
@@ -1190,40 +3822,88 @@ elif st.session_state.menu_choice == "Zarządzanie Treścią":
         
         api = WordPressAPI(site_info[2], site_info[3], decrypted_content_pass)
 
-        @st.cache_data(ttl=300)
-        def get_site_content(_site_name):
-            posts, categories, users = api.get_posts(per_page=100), api.get_categories(), api.get_users()
-            return posts, categories, users
-
-        posts, categories, users = get_site_content(site_name)
-        if posts:
-            df = pd.DataFrame(posts)
-            df['Zaznacz'] = False
-            edited_df = st.data_editor(df[['Zaznacz', 'id', 'title', 'date', 'author_name', 'categories']].rename(columns={'author_name': 'autor'}), disabled=['id', 'title', 'date', 'autor', 'categories'], hide_index=True)
-            selected_posts = edited_df[edited_df.Zaznacz]
-            if not selected_posts.empty:
-                with st.form("bulk_edit_form"):
-                    st.subheader(f"Masowa edycja dla {len(selected_posts)} wpisów")
-                    new_cats = st.multiselect("Zastąp kategorie", options=categories.keys())
-                    new_author = st.selectbox("Zmień autora", options=[None] + list(users.keys()))
-                    if st.form_submit_button("Wykonaj"):
-                        data = {}
-                        if new_cats: data['categories'] = [categories[c] for c in new_cats]
-                        if new_author: data['author'] = users[new_author]
-                        if data:
-                            with st.spinner("Aktualizowanie..."):
-                                for post_id in selected_posts['id']:
-                                    success, msg = api.update_post(post_id, data)
-                                    if success: st.success(msg)
-                                    else: st.error(msg)
-                            st.cache_data.clear()
-                            st.rerun()
+        @st.fragment
+        def render_post_editor(api, site_url, site_user, site_pass):
+            """Filtry, stronicowanie i masowa edycja - zmiana filtra, strony czy zaznaczenia przeładowuje tylko ten fragment."""
+            categories = get_categories_for_site(site_url, site_user, site_pass)
+            users = get_users_for_site(site_url, site_user, site_pass)
+            c1, c2, c3, c4 = st.columns([2, 1, 1, 1])
+            search = c1.text_input("Szukaj we wpisach", placeholder="fraza w tytule lub treści").strip()
+            category_name = c2.selectbox("Kategoria", options=[None] + list(categories), format_func=lambda x: x or "Wszystkie")
+            author_name = c3.selectbox("Autor", options=[None] + list(users), format_func=lambda x: x or "Wszyscy")
+            per_page = c4.selectbox("Wpisów na stronę", options=[25, 50, 100], index=1)
+            c1, c2, _ = st.columns([1, 1, 3])
+            date_from = c1.date_input("Od dnia", value=None)
+            date_to = c2.date_input("Do dnia", value=None)
+            filters = {
+                "per_page": per_page, "search": search or None, "category_id": categories.get(category_name), "author_id": users.get(author_name),
+                "after": datetime.combine(date_from, datetime.min.time()) if date_from else None,
+                "before": datetime.combine(date_to + timedelta(days=1), datetime.min.time()) if date_to else None,
+            }
+            query_key = (site_url, tuple(sorted(filters.items())))
+            if st.session_state.get('content_query') != query_key:
+                st.session_state.content_query = query_key
+                st.session_state.content_page = 1
+
+            page_cache = st.session_state.post_pages
+            # Zdarzenie z webhooka dla tej strony unieważnia zapamiętane strony listy wpisów
+            site_version = get_post_event_ingestor().site_versions[site_url.rstrip("/")]
+            if st.session_state.get('content_site_version') != (site_url, site_version):
+                st.session_state.content_site_version = (site_url, site_version)
+                page_cache.clear()
+            page_loader = lambda page: (lambda: api.get_posts_page(page, display_error=False, **filters))
+            page = st.session_state.get('content_page', 1)
+            result = page_cache.get((query_key, page), page_loader(page))
+            if result is None:
+                st.error("❌ Nie udało się pobrać wpisów z wybranej strony.")
+                return
+            posts, total, total_pages = result
+            if page < total_pages: page_cache.prefetch((query_key, page + 1), page_loader(page + 1))
+
+            c1, c2 = st.columns([1, 3])
+            c1.number_input(f"Strona (z {max(total_pages, 1)})", min_value=1, max_value=max(total_pages, 1), key="content_page")
+            c2.caption(f"Wpisów spełniających kryteria: {total}")
+            if posts:
+                df = pd.DataFrame(posts)
+                df['Zaznacz'] = False
+                edited_df = st.data_editor(df[['Zaznacz', 'id', 'title', 'date', 'author_name', 'categories']].rename(columns={'author_name': 'autor'}), disabled=['id', 'title', 'date', 'autor', 'categories'], hide_index=True)
+                selected_posts = edited_df[edited_df.Zaznacz]
+                if not selected_posts.empty:
+                    with st.form("bulk_edit_form"):
+                        st.subheader(f"Masowa edycja dla {len(selected_posts)} wpisów")
+                        new_cats = st.multiselect("Zastąp kategorie", options=categories.keys())
+                        new_author = st.selectbox("Zmień autora", options=[None] + list(users.keys()))
+                        if st.form_submit_button("Wykonaj"):
+                            data = {}
+                            if new_cats: data['categories'] = [categories[c] for c in new_cats]
+                            if new_author: data['author'] = users[new_author]
+                            if data:
+                                with st.spinner("Aktualizowanie..."):
+                                    for post_id in selected_posts['id']:
+                                        success, msg = api.update_post(post_id, data)
+                                        if success: st.success(msg)
+                                        else: st.error(msg)
+                                page_cache.clear()
+                                st.rerun(scope="fragment")
+            else:
+                st.info("Brak wpisów spełniających kryteria.")
+
+        render_post_editor(api, site_info[2], site_info[3], decrypted_content_pass)
 
 elif st.session_state.menu_choice == "⚙️ Edytor Promptów":
     st.header("⚙️ Edytor Promptów (AI Search Optimized)")
     st.info("Dostosuj szablony promptów zoptymalizowane pod AI search. Zmiany są aktywne w bieżącej sesji.")
     
-    tab1, tab2 = st.tabs(["Master Prompt (Artykuły)", "Prompt do Briefu"])
+    def show_template_validation(text, allowed):
+        try:
+            unknown_vars, missing_vars = compile_prompt_template(text).validate(allowed)
+        except Exception as e:
+            st.error(f"Nie można sparsować szablonu: {e}")
+            return
+        if unknown_vars: st.error(f"Nieznane zmienne (nie zostaną podstawione): {', '.join('{{' + v + '}}' for v in unknown_vars)}")
+        if missing_vars: st.warning(f"Szablon nie używa zmiennych: {', '.join('{{' + v + '}}' for v in missing_vars)}")
+
+    tab1, tab2, tab3 = st.tabs(["Master Prompt (Artykuły)", "Prompt do Briefu", "Prompt Stratega (Klastry)"])
     
     with tab1:
         st.subheader("Master Prompt do generowania artykułów (Jednoetapowy)")
@@ -1241,6 +3921,15 @@ elif st.session_state.menu_choice == "⚙️ Edytor Promptów":
             """)
         
         st.session_state.master_prompt = st.text_area("Edytuj Master Prompt", value=st.session_state.master_prompt, height=600, label_visibility="collapsed")
+        show_template_validation(st.session_state.master_prompt, MASTER_PROMPT_VARIABLES)
+        with st.expander("⏱️ Benchmark renderowania szablonu"):
+            iterations = st.number_input("Liczba renderowań (wielkość partii)", min_value=100, max_value=100000, value=1000, step=100)
+            if st.button("Uruchom benchmark"):
+                sample_values = {name: f"przykładowa wartość {name.lower()} " * 20 for name in MASTER_PROMPT_VARIABLES}
+                compiled_time, replace_time = benchmark_prompt_render(st.session_state.master_prompt, sample_values, int(iterations))
+                c1, c2 = st.columns(2)
+                c1.metric("Szablon skompilowany", f"{compiled_time * 1000:.1f} ms")
+                c2.metric("Łańcuch .replace()", f"{replace_time * 1000:.1f} ms")
         if st.button("Przywróć domyślny Master Prompt"):
             st.session_state.master_prompt = DEFAULT_MASTER_PROMPT_TEMPLATE
             st.rerun()
@@ -1249,6 +3938,16 @@ elif st.session_state.menu_choice == "⚙️ Edytor Promptów":
         st.subheader("Prompt do generowania briefu")
         st.markdown("**Zmienne:** `{{TOPIC}}`")
         st.session_state.brief_prompt = st.text_area("Edytuj Prompt do Briefu", value=st.session_state.brief_prompt, height=600, label_visibility="collapsed")
+        show_template_validation(st.session_state.brief_prompt, BRIEF_PROMPT_VARIABLES)
         if st.button("Przywróć domyślny Prompt do Briefu"):
             st.session_state.brief_prompt = DEFAULT_BRIEF_PROMPT_TEMPLATE
             st.rerun()
+
+    with tab3:
+        st.subheader("Prompt do analizy klastrów tematycznych")
+        st.markdown("**Zmienne:** `{{TYTULY_ARTYKULOW}}`")
+        st.session_state.cluster_prompt = st.text_area("Edytuj Prompt Stratega", value=st.session_state.cluster_prompt, height=600, label_visibility="collapsed")
+        show_template_validation(st.session_state.cluster_prompt, CLUSTER_PROMPT_VARIABLES)
+        if st.button("Przywróć domyślny Prompt Stratega"):
+            st.session_state.cluster_prompt = DEFAULT_CLUSTER_PROMPT_TEMPLATE
+            st.rerun()
@@ -0,0 +1,64 @@
+"""
+Zadania obliczeniowe (CPU) uruchamiane w puli procesów aplikacji.
+
+Osobny moduł, bo funkcje wykonywane w procesach potomnych muszą dać się zaimportować po nazwie -
+skrypt Streamlit (app.py) nie jest zwykłym modułem. Wszystko tutaj to czyste funkcje bez Streamlit i bez stanu.
+Duże dane nie są przesyłane przez pickle: obrazki wymieniane są przez pliki, teksty przez pamięć współdzieloną.
+"""
+import os
+import re
+import zlib
+from html import unescape as html_unescape
+from multiprocessing import shared_memory
+
+import numpy as np
+from PIL import Image
+
+
+def html_to_text(content_html):
+    return html_unescape(re.sub(r"<[^>]+>", " ", content_html or ""))
+
+def _mix64(x):
+    """Finalizator splitmix64 - rozprasza bity haszy shingli (operacje na uint64 z przepełnieniem)."""
+    with np.errstate(over="ignore"):
+        x = (x ^ (x >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+        x = (x ^ (x >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+        return x ^ (x >> np.uint64(31))
+
+def simhash_text(text):
+    """64-bitowy SimHash z 3-wyrazowych shingli. Teksty prawie identyczne różnią się w kilku bitach. None dla tekstu bez słów."""
+    words = re.findall(r"\w+", text.lower())
+    if not words: return None
+    unique_words, inverse = np.unique(words, return_inverse=True)
+    word_hashes = np.fromiter((zlib.crc32(w.encode()) for w in unique_words), dtype=np.uint64, count=len(unique_words))[inverse]
+    if len(word_hashes) >= 3:
+        with np.errstate(over="ignore"):
+            word_hashes = word_hashes[:-2] * np.uint64(0x9E3779B97F4A7C15) + word_hashes[1:-1] * np.uint64(0xC2B2AE3D27D4EB4F) + word_hashes[2:]
+    hashes = _mix64(np.unique(word_hashes))
+    bits = np.unpackbits(hashes.view(np.uint8).reshape(-1, 8), axis=1, bitorder="little")
+    votes = bits.sum(axis=0, dtype=np.int64) * 2 - len(hashes)
+    return int(np.packbits(votes > 0, bitorder="little").view(np.uint64)[0])
+
+def simhash_shared_html(shm_name, offsets):
+    """
+    SimHash treści HTML zapisanych jedna za drugą (UTF-8) w bloku pamięci współdzielonej shm_name.
+    offsets: lista (początek, koniec) w bajtach. Do procesu głównego wraca tylko lista liczb.
+    """
+    shm = shared_memory.SharedMemory(name=shm_name)
+    try:
+        return [simhash_text(html_to_text(bytes(shm.buf[start:end]).decode("utf-8"))) for start, end in offsets]
+    finally:
+        shm.close()
+
+def transcode_image(src_path, dst_path, max_width=1600, quality=82):
+    """
+    PNG z generatora -> progresywny JPEG o szerokości co najwyżej max_width, zapis atomowy do dst_path.
+    Zwraca rozmiar pliku wynikowego w bajtach.
+    """
+    with Image.open(src_path) as image:
+        image = image.convert("RGB")
+        if image.width > max_width: image = image.resize((max_width, round(image.height * max_width / image.width)), Image.LANCZOS)
+        tmp_path = f"{dst_path}.{os.getpid()}.tmp"
+        image.save(tmp_path, "JPEG", quality=quality, optimize=True, progressive=True)
+    os.replace(tmp_path, dst_path)
+    return os.path.getsize(dst_path)
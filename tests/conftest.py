@@ -0,0 +1,35 @@
+"""
+app.py to skrypt Streamlit - testy ładują tylko jego część przed interfejsem (stałe, klasy i funkcje),
+bez renderowania stron. Sekrety (w tym ścieżka trwałej bazy) pochodzą z tymczasowego secrets.toml.
+"""
+import sys
+import types
+from pathlib import Path
+
+import pytest
+from streamlit import config
+
+ROOT = Path(__file__).resolve().parents[1]
+UI_MARKER = "# --- INTERFEJS UŻYTKOWNIKA"
+
+
+@pytest.fixture(scope="session")
+def app(tmp_path_factory):
+    data_dir = tmp_path_factory.mktemp("data")
+    secrets = data_dir / "secrets.toml"
+    secrets.write_text(f'DATA_DB_PATH = "{(data_dir / "pbn_data.db").as_posix()}"\n', encoding="utf-8")
+    config.set_option("secrets.files", [str(secrets)])
+    sys.path.insert(0, str(ROOT))
+    source = (ROOT / "app.py").read_text(encoding="utf-8")
+    module = types.ModuleType("pbn_app")
+    exec(compile(source[:source.index(UI_MARKER)], str(ROOT / "app.py"), "exec"), module.__dict__)
+    return module
+
+
+@pytest.fixture
+def data_conn(app, tmp_path):
+    """Świeża trwała baza (schemat konfiguracji i danych) na każdy test."""
+    conn = app.ThreadLocalConnection(str(tmp_path / "data.db"))
+    app.init_db(conn)
+    app.init_data_db(conn)
+    return conn
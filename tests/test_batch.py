@@ -0,0 +1,72 @@
+import json
+
+import pytest
+
+BRIEF = {
+    "temat_artykulu": "Jak dbać o storczyki",
+    "analiza_tematu": "Poradnik pielęgnacji.",
+    "grupa_docelowa": "Początkujący hodowcy",
+    "zagadnienia_kluczowe": ["podlewanie"],
+    "slowa_kluczowe": ["storczyk"],
+    "dodatkowe_slowa_semantyczne": ["phalaenopsis"],
+    "relacje_leksykalne": {"synonimy": [], "hiperonimy": ["roślina"], "hiponimy": []},
+}
+ARTICLE_HTML = "<h2>Podlewanie</h2><p>Storczyki podlewa się rzadko. Woda nie może stać w osłonce.</p>"
+
+
+def responder(body):
+    """Odpowiedź zależna od rodzaju żądania: schemat structured output albo zwykły artykuł."""
+    schema = body.get("response_format", {}).get("json_schema", {}).get("name")
+    prompt = body["messages"][-1]["content"]
+    if "FAIL" in prompt: raise RuntimeError("model error")
+    if schema == "brief": return json.dumps(BRIEF, ensure_ascii=False)
+    if schema == "meta_tags": return json.dumps({"meta_title": "Storczyki", "meta_description": "Jak dbać o storczyki."})
+    return ARTICLE_HTML
+
+
+@pytest.fixture
+def runner(app):
+    return app.OpenAIBatchRunner(app.LocalBatchClient(responder))
+
+
+def test_submit_sends_one_request_per_item(app, runner):
+    job = app.submit_article_batch(runner, [{"title": "A", "prompt": "a", "image": None, "keywords": []}, {"title": "B", "prompt": "b", "image": None, "keywords": []}], "system")
+    batch = runner.retrieve(job["id"])
+    lines = [json.loads(line) for line in runner.client.files.content(batch.output_file_id).text.splitlines()]
+    assert job["kind"] == "article" and not job["done"]
+    assert sorted(line["custom_id"] for line in lines) == ["article-0", "article-1"]
+
+
+def test_article_batch_chains_meta_batch(app, runner):
+    job = app.submit_article_batch(runner, [{"title": "Storczyki", "prompt": "napisz", "image": None, "keywords": ["storczyk"]}], "system")
+    briefs, articles, meta_job = app.ingest_batch_job(runner, job, "sk-test", None)
+    assert job["done"] and job["status"] == "completed"
+    assert briefs == [] and articles == []
+    assert meta_job["kind"] == "meta" and meta_job["items"]["meta-0"]["content"].startswith("<h2>Podlewanie</h2>")
+
+    _, articles, next_job = app.ingest_batch_job(runner, meta_job, "sk-test", None)
+    assert next_job is None
+    assert articles[0]["meta_title"] == "Storczyki"
+    assert articles[0]["structure"]["H2"] == 1
+
+
+def test_failed_request_becomes_error_article(app, runner):
+    job = app.submit_article_batch(runner, [{"title": "X", "prompt": "FAIL", "image": None, "keywords": []}], "system")
+    _, _, meta_job = app.ingest_batch_job(runner, job, "sk-test", None)
+    assert "BŁĄD KRYTYCZNY" in meta_job["items"]["meta-0"]["content"]
+
+
+def test_brief_batch_without_image_key(app, runner):
+    job = app.submit_brief_batch(runner, ["storczyki", "FAIL"], "Brief: {{TOPIC}}", "4:3", "")
+    briefs, articles, next_job = app.ingest_batch_job(runner, job, "sk-test", None)
+    by_topic = {b["topic"]: b for b in briefs}
+    assert by_topic["storczyki"]["brief"] == BRIEF and by_topic["storczyki"]["image"] is None
+    assert "error" in by_topic["FAIL"]["brief"]
+    assert articles == [] and next_job is None
+
+
+def test_unfinished_job_is_left_pending(app, runner):
+    job = app.submit_article_batch(runner, [{"title": "A", "prompt": "a", "image": None, "keywords": []}], "system")
+    runner.retrieve(job["id"]).status = "in_progress"
+    assert app.ingest_batch_job(runner, job, "sk-test", None) == ([], [], None)
+    assert job["status"] == "in_progress" and not job["done"]
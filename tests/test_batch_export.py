@@ -0,0 +1,39 @@
+import io
+import os
+
+import pytest
+
+
+@pytest.fixture
+def store(app, tmp_path):
+    return app.ImageStore(str(tmp_path / "images"))
+
+
+def round_trip(app, store, items, kind):
+    return app.read_batch_parquet(io.BytesIO(app.batch_to_parquet_bytes(items, kind)), store)
+
+
+def test_article_structure_keeps_integers(app, store):
+    article = {"title": "A", "content": "<p>x</p>", "image": None, "meta_title": "A", "meta_description": "d", "structure": {"Słowa": 1, "H2": 0, "Problemy": 2}}
+    kind, items, missing = round_trip(app, store, [article], "article")
+    assert kind == "article" and missing == 0
+    assert items[0]["structure"] == article["structure"] and isinstance(items[0]["structure"]["Słowa"], int)
+
+
+def test_missing_main_image_falls_back_to_variant(app, store):
+    main, variant = store.save(b"main"), store.save(b"variant")
+    briefs = [
+        {"topic": "a", "brief": {"temat_artykulu": "a"}, "image": main, "image_variants": [main, variant], "image_error": None},
+        {"topic": "b", "brief": {"temat_artykulu": "b"}, "image": main, "image_variants": [main], "image_error": None},
+    ]
+    data = app.batch_to_parquet_bytes(briefs, "brief")
+    os.remove(store.path(main))
+    _, items, missing = app.read_batch_parquet(io.BytesIO(data), store)
+    assert items[0]["image"] == variant and items[0]["image"] in items[0]["image_variants"]
+    assert items[1]["image"] is None and items[1]["image_variants"] == []
+    assert missing == 1
+
+
+def test_merge_replaces_by_topic(app):
+    merged = app.merge_batch_items([{"topic": "a", "v": 1}, {"topic": "b", "v": 1}], [{"topic": "a", "v": 2}], "brief")
+    assert merged == [{"topic": "b", "v": 1}, {"topic": "a", "v": 2}]
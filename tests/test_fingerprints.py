@@ -0,0 +1,34 @@
+import threading
+
+ARTICLE = "<p>" + " ".join(f"Zdanie numer {i} o pielęgnacji storczyków w mieszkaniu." for i in range(40)) + "</p>"
+OTHER = "<p>" + " ".join(f"Akapit {i} opisuje naprawę rowerów górskich i wymianę łańcucha." for i in range(40)) + "</p>"
+
+
+def post(post_id, content, title="T"):
+    return {"id": post_id, "title": {"rendered": title}, "content": {"rendered": content}, "link": f"https://x/{post_id}", "modified": "2026-10-01T10:00:00"}
+
+
+def test_near_duplicate_found_across_sites(app, data_conn):
+    index = app.ContentFingerprintIndex(data_conn, threading.Lock())
+    index.upsert_posts("https://a.pl", [post(1, ARTICLE), post(2, OTHER)])
+    edited = ARTICLE.replace("numer 3 ", "numer trzy ")
+    matches = index.find_similar(edited)
+    assert [(m[0], m[1]) for m in matches] == [("https://a.pl", 1)]
+
+
+def test_duplicate_pairs_cross_site_only(app, data_conn):
+    index = app.ContentFingerprintIndex(data_conn, threading.Lock())
+    index.upsert_posts("https://a.pl", [post(1, ARTICLE), post(2, ARTICLE)])
+    index.upsert_posts("https://b.pl", [post(7, ARTICLE), post(8, OTHER)])
+    pairs = index.duplicate_pairs(cross_site_only=True)
+    assert {(p["Strona A"], p["ID A"], p["Strona B"], p["ID B"]) for p in pairs} == {("https://a.pl", 1, "https://b.pl", 7), ("https://a.pl", 2, "https://b.pl", 7)}
+    assert index.site_counts() == {"https://a.pl": 2, "https://b.pl": 2}
+
+
+def test_posts_without_words_are_not_duplicates(app, data_conn):
+    index = app.ContentFingerprintIndex(data_conn, threading.Lock())
+    index.upsert_posts("https://a.pl", [post(1, ""), post(2, "<div><img src='x.jpg'></div>"), post(3, ARTICLE)])
+    index.upsert_posts("https://b.pl", [post(4, "<p></p>")])
+    assert index.duplicate_pairs() == []
+    assert index.find_similar("<br>") == []
+    assert index.site_counts() == {"https://a.pl": 3, "https://b.pl": 1}
@@ -0,0 +1,16 @@
+import threading
+from datetime import datetime
+
+
+def record(conn, url, status, failures):
+    with conn:
+        conn.execute("INSERT OR REPLACE INTO site_health VALUES (?, ?, NULL, 5000, ?, ?, ?)", (url, status, f"błąd {status}", failures, datetime.now().isoformat(timespec="seconds")))
+
+
+def test_single_timeout_does_not_skip_site(app, data_conn):
+    monitor = app.FleetHealthMonitor(data_conn, threading.Lock())
+    record(data_conn, "https://slow.pl", "timeout", 1)
+    record(data_conn, "https://dead.pl", "timeout", 2)
+    record(data_conn, "https://auth.pl", "auth", 1)
+    record(data_conn, "https://ok.pl", "ok", 0)
+    assert set(monitor.unhealthy(["https://slow.pl", "https://dead.pl", "https://auth.pl", "https://ok.pl"])) == {"https://dead.pl", "https://auth.pl"}
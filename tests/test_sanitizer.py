@@ -0,0 +1,31 @@
+LONG_TEXT = " ".join(["Storczyki lubią jasne stanowisko bez ostrego słońca."] * 8)
+
+
+def test_disallowed_tags_are_removed_with_script_content(app):
+    html, report = app.sanitize_article_html(f"<h2>Wstęp</h2><p onclick='x()'>{LONG_TEXT}</p><script>alert(1)</script><div><p>Koniec.</p></div>")
+    assert "<script" not in html and "alert" not in html and "onclick" not in html and "<div" not in html
+    assert report["removed_tags"].get("div") == 1
+
+
+def test_sibling_list_items_are_not_nested(app):
+    html, _ = app.sanitize_article_html(f"<h2>Lista</h2><p>{LONG_TEXT}</p><ul><li>jeden<li>dwa</ul>")
+    assert "<li>jeden</li><li>dwa</li>" in html
+
+
+def test_short_and_list_heavy_sections_are_reported(app):
+    _, report = app.sanitize_article_html("<h2>Krótka</h2><p>Za mało treści.</p><h2>Listy</h2><ul>" + "".join(f"<li>{LONG_TEXT}</li>" for _ in range(2)) + "</ul>")
+    issues = {s["heading"]: s["issues"] for s in report["sections"]}
+    assert any("zbyt krótka" in issue for issue in issues["Krótka"])
+    assert any("głównie z list" in issue for issue in issues["Listy"])
+
+
+def test_truncated_answer_is_flagged(app):
+    _, report = app.sanitize_article_html(f"<h2>Sekcja</h2><p>{LONG_TEXT}</p><p>Urwane zdanie bez")
+    assert report["truncated"]
+    assert any("urwana" in issue for issue in report["sections"][-1]["issues"])
+
+
+def test_structure_summary(app):
+    _, report = app.sanitize_article_html(f"<h2>A</h2><p>{LONG_TEXT}</p><h3>Pytanie?</h3><p>Odpowiedź.</p><table><tr><td>1</td></tr></table>")
+    summary = app.summarize_article_structure(report)
+    assert summary["H2"] == 1 and summary["H3"] == 1 and summary["Tabele"] == 1
@@ -0,0 +1,35 @@
+from collections import Counter
+from datetime import datetime, timedelta
+
+import pytest
+
+START = datetime(2026, 10, 20, 8, 0)
+
+
+def gaps(times):
+    times = sorted(times)
+    return [b - a for a, b in zip(times, times[1:])]
+
+
+@pytest.mark.parametrize("seed", range(20))
+def test_jitter_never_shortens_the_interval(app, seed):
+    existing = [START + timedelta(hours=3), START + timedelta(hours=20, minutes=7)]
+    plan = app.plan_publication_schedule(list(range(8)), ["a", "b"], START, 8, {"a": existing}, jitter_minutes=45, seed=seed)
+    for site, busy in (("a", existing), ("b", [])):
+        times = [p["publish_at"] for p in plan if p["site"] == site]
+        assert len(times) == 8 and min(times) >= START
+        assert min(gaps(times + busy)) >= timedelta(hours=8)
+
+
+def test_daily_cap_counts_existing_posts(app):
+    existing = [START + timedelta(hours=1)]
+    plan = app.plan_publication_schedule(list(range(5)), ["a"], START, 1, {"a": existing}, max_per_day=2, seed=1)
+    per_day = Counter(t.date() for t in [p["publish_at"] for p in plan] + existing)
+    assert max(per_day.values()) <= 2
+    assert per_day[START.date()] == 2
+
+
+def test_sites_are_planned_independently(app):
+    plan = app.plan_publication_schedule(["x", "y"], ["a", "b"], START, 4)
+    assert [(p["site"], p["article"], p["publish_at"]) for p in plan if p["site"] == "a"] == [("a", "x", START), ("a", "y", START + timedelta(hours=4))]
+    assert sorted(p["publish_at"] for p in plan) == [p["publish_at"] for p in plan]
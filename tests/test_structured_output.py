@@ -0,0 +1,30 @@
+import json
+
+META = {"meta_title": "Storczyki", "meta_description": "Jak dbać o storczyki."}
+
+
+def test_markdown_fence_and_prose_are_stripped(app):
+    data, errors = app.parse_structured_json(f"Oto wynik:\n```json\n{json.dumps(META)}\n```\nPozdrawiam", "meta_tags")
+    assert errors == [] and data == META
+
+
+def test_missing_key_and_wrong_type_are_reported(app):
+    _, errors = app.parse_structured_json(json.dumps({"meta_title": ["x"]}), "meta_tags")
+    assert "$: brak klucza 'meta_description'" in errors
+    assert any(e.startswith("$.meta_title: oczekiwano typu string") for e in errors)
+
+
+def test_invalid_json(app):
+    data, errors = app.parse_structured_json("{nie json", "meta_tags")
+    assert data is None and errors[0].startswith("niepoprawny JSON")
+
+
+def test_valid_response_needs_no_repair_call(app):
+    assert app.repair_structured_json("sk-test", json.dumps(META), "meta_tags") == META
+
+
+def test_bare_cluster_list_is_wrapped_without_repair(app):
+    clusters = [{"nazwa_klastra": "Pielęgnacja", "istniejace_artykuly": ["Podlewanie storczyków"], "luki_w_tresci": "Nawożenie", "proponowane_nowe_tematy": ["Nawozy do storczyków"]}]
+    data, errors = app.parse_structured_json(json.dumps(clusters), "clusters")
+    assert errors == [] and app.unwrap_cluster_result(data) == clusters
+    assert app.repair_structured_json("sk-test", json.dumps(clusters), "clusters") == {"klastry": clusters}
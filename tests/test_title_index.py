@@ -0,0 +1,37 @@
+def titles(*pairs):
+    return [{"id": post_id, "date": "2026-10-01T10:00:00", "title": {"rendered": title}} for post_id, title in pairs]
+
+
+def store(app, conn, site_url, posts):
+    with conn:
+        app.store_post_titles(conn, site_url, posts)
+
+
+def test_index_is_built_from_persisted_titles(app, data_conn):
+    store(app, data_conn, "https://a.pl", titles((1, "Jak dbać o storczyki w mieszkaniu"), (2, "Naprawa roweru górskiego krok po kroku")))
+    index = app.NetworkTitleIndex(data_conn).refresh()
+    assert len(index) == 2
+    score, title, source = index.best_match("Jak dbać o storczyki w mieszkaniu - kompletny przewodnik")
+    assert title == "Jak dbać o storczyki w mieszkaniu" and source == "https://a.pl" and score >= app.NEAR_DUPLICATE_THRESHOLD
+    kept, rejected = app.filter_near_duplicate_topics(["Naprawa roweru górskiego krok po kroku", "Uprawa pomidorów na balkonie"], index)
+    assert kept == ["Uprawa pomidorów na balkonie"] and rejected[0][2] == "https://a.pl"
+
+
+def test_refresh_rebuilds_changed_sites_only(app, data_conn):
+    store(app, data_conn, "https://a.pl", titles((1, "Jak dbać o storczyki w mieszkaniu")))
+    store(app, data_conn, "https://b.pl", titles((1, "Naprawa roweru górskiego krok po kroku")))
+    index = app.NetworkTitleIndex(data_conn).refresh()
+    site_b = index._sites["https://b.pl"][1]
+    store(app, data_conn, "https://a.pl", titles((2, "Uprawa pomidorów na balkonie")))
+    index.refresh()
+    assert index._sites["https://b.pl"][1] is site_b
+    assert index.best_match("Uprawa pomidorów na balkonie")[1] == "Uprawa pomidorów na balkonie"
+
+
+def test_titles_do_not_count_as_published(app, data_conn):
+    class API:
+        def get_all_posts_since(self, start, fields="id,date"):
+            return [{"id": 1, "date": "2026-10-01T10:00:00", "title": {"rendered": "Storczyki"}}]
+    store(app, data_conn, "https://a.pl", titles((1, "Storczyki")))
+    assert app.sync_daily_post_counts(data_conn, API(), "https://a.pl") == 1
+    assert data_conn.execute("SELECT status, title FROM post_index").fetchall() == [("publish", "Storczyki")]
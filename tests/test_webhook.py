@@ -0,0 +1,80 @@
+import json
+import threading
+import urllib.error
+import urllib.request
+
+import pytest
+
+SITE = "https://a.pl"
+POST = {"id": 7, "status": "publish", "date": "2026-10-19T12:00:00", "title": {"rendered": "T"}, "content": {"rendered": "<p>Treść wpisu o storczykach.</p>"}, "link": "https://a.pl/t", "modified": "2026-10-19T12:00:00"}
+
+
+@pytest.fixture
+def ingestor(app, data_conn):
+    lock = threading.Lock()
+    data_conn.execute("INSERT INTO site_stats VALUES (?, '5', '2026-10-01 10:00', '2026-10-18')", (SITE,))
+    data_conn.commit()
+    return app.PostEventIngestor(data_conn, lock, app.ContentFingerprintIndex(data_conn, lock))
+
+
+@pytest.fixture
+def receiver(app, ingestor):
+    receiver = app.WebhookReceiver(ingestor, 0, "sekret")
+    receiver.register([SITE + "/"])
+    yield receiver
+    receiver.server.shutdown()
+    receiver.server.server_close()
+
+
+def daily_counts(conn):
+    return dict(conn.execute("SELECT day, count FROM post_daily_counts WHERE count > 0").fetchall())
+
+
+def send(app, receiver, events, secret="sekret"):
+    body = json.dumps(events).encode()
+    request = urllib.request.Request(f"http://127.0.0.1:{receiver.server.server_address[1]}/wp-events", body, {"X-PBN-Signature": app.sign_webhook_body(body, secret)})
+    try:
+        return urllib.request.urlopen(request).status
+    except urllib.error.HTTPError as e:
+        return e.code
+
+
+def test_publish_update_delete(app, ingestor, data_conn):
+    ingestor.apply({"site_url": SITE, "event": "publish", "post": POST})
+    ingestor.apply({"site_url": SITE, "event": "publish", "post": POST})
+    assert daily_counts(data_conn) == {"2026-10-19": 1}
+    assert data_conn.execute("SELECT total_posts, last_post_date FROM site_stats").fetchone() == ("6", "2026-10-19 12:00")
+    ingestor.apply({"site_url": SITE, "event": "update", "post": {**POST, "date": "2026-10-18T09:00:00"}})
+    assert daily_counts(data_conn) == {"2026-10-18": 1}
+    ingestor.apply({"site_url": SITE, "event": "delete", "post": {"id": 7}})
+    assert daily_counts(data_conn) == {}
+    assert data_conn.execute("SELECT COUNT(*) FROM content_fingerprints").fetchone() == (0,)
+
+
+def test_reconciliation_does_not_count_event_posts_twice(app, ingestor, data_conn):
+    class API:
+        def get_all_posts_since(self, start, fields="id,date"):
+            return [{"id": 7, "date": "2026-10-19T12:00:00", "title": {"rendered": "T"}}, {"id": 8, "date": "2026-10-19T13:00:00", "title": {"rendered": "Nowy &amp; inny"}}]
+    ingestor.apply({"site_url": SITE, "event": "publish", "post": POST})
+    assert app.sync_daily_post_counts(data_conn, API(), SITE) == 1
+    assert daily_counts(data_conn) == {"2026-10-19": 2}
+
+
+def test_receiver_authentication_and_validation(app, receiver, data_conn):
+    event = {"site_url": SITE, "event": "publish", "post": POST}
+    assert send(app, receiver, event, secret="zly") == 401
+    assert send(app, receiver, {**event, "site_url": "https://obca.example"}) == 403
+    assert send(app, receiver, {"bad": 1}) == 400
+    assert daily_counts(data_conn) == {}
+    assert send(app, receiver, [event]) == 200
+    assert daily_counts(data_conn) == {"2026-10-19": 1}
+    assert receiver.stats["events"] == 1
+
+
+def test_receiver_without_secret_listens_locally(app, ingestor):
+    receiver = app.WebhookReceiver(ingestor, 0)
+    try:
+        assert receiver.server.server_address[0] == "127.0.0.1"
+    finally:
+        receiver.server.shutdown()
+        receiver.server.server_close()
@@ -0,0 +1,39 @@
+import pytest
+import requests
+
+
+class FakeResponse:
+    def __init__(self, status_code, payload, total_pages=2):
+        self.status_code = status_code
+        self._payload = payload
+        self.headers = {"X-WP-TotalPages": str(total_pages)}
+        self.text = str(payload)
+
+    def json(self):
+        return self._payload
+
+    def raise_for_status(self):
+        if self.status_code >= 400: raise requests.exceptions.HTTPError(response=self)
+
+
+@pytest.fixture
+def wordpress(monkeypatch):
+    """Strona z dwiema stronami wyników; druga odpowiada 500."""
+    def fake_request(method, url, params=None, **kwargs):
+        if params["page"] == 1: return FakeResponse(200, [{"id": 1, "date": "2026-10-01T10:00:00", "title": {"rendered": "A"}}])
+        return FakeResponse(500, {"code": "internal_server_error"})
+    monkeypatch.setattr(requests, "request", fake_request)
+
+
+def test_failed_page_raises_instead_of_returning_partial_list(app, wordpress):
+    api = app.WordPressAPI("https://broken-page.example", "u", "p")
+    with pytest.raises(requests.exceptions.HTTPError):
+        api.get_all_pages("posts", {"_fields": "id"})
+
+
+def test_failed_sync_does_not_advance_sync_state(app, wordpress, data_conn):
+    api = app.WordPressAPI("https://broken-sync.example", "u", "p")
+    with pytest.raises(requests.exceptions.RequestException):
+        app.sync_daily_post_counts(data_conn, api, "https://broken-sync.example")
+    assert app.get_sync_state(data_conn, "https://broken-sync.example", "daily_counts") is None
+    assert data_conn.execute("SELECT COUNT(*) FROM post_daily_counts").fetchone() == (0,)